@@ -1,11 +1,22 @@
+import os
+
 from flask import Flask, render_template, session, request, redirect, url_for, flash
 from flask_login import LoginManager, UserMixin, login_user, logout_user, current_user, login_required
+from login_limiter import login_limiter
+from user_store import add_user_command, make_store
+from server_session import server_session
 
 app = Flask(__name__)
 application = app
 
 app.config.from_pyfile('config.py')
 
+# Лимит неудачных входов по IP и по логину
+login_limiter.init_app(app)
+
+# Сессии хранятся на сервере (SQLite + LRU-кэш), в cookie только идентификатор
+server_session.init_app(app)
+
 login_manager = LoginManager()
 login_manager.init_app(app)
 
@@ -13,14 +24,11 @@ login_manager.login_view = 'login'
 login_manager.login_message = 'Для доступа к запрашиваемой странице необходимо пройти процедуру аутентификациию.'
 login_manager.login_message_category = 'warning'
 
-def get_users():
-    return [
-        {
-            'id': '1',
-            'login': 'user',
-            'password': 'qwerty'
-        }
-    ]
+# Пользователи загружаются один раз и перечитываются при изменении файла (flask add-user добавляет новых)
+app.config.setdefault('USER_STORE', os.environ.get('USER_STORE', os.path.join(app.root_path, 'users.json')))
+user_store = make_store(app.config['USER_STORE'], app.config.get('USER_STORE_CHECK_INTERVAL', 1.0))
+app.extensions['user_store'] = user_store
+app.cli.add_command(add_user_command)
 
 class User(UserMixin):
     def __init__(self, user_id, login):
@@ -29,10 +37,10 @@ class User(UserMixin):
 
 @login_manager.user_loader
 def load_user(user_id):
-    for user in get_users():
-        if user_id == user['id']:
-            return User(user['id'], user['login'])
-    return None
+    record = user_store.get(user_id)
+    if record is None:
+        return None
+    return User(record.id, record.login)
 
 @app.route('/')
 def index():
@@ -45,7 +53,6 @@ def counter():
     else:
         session['counter'] = 1
 
-    print(session)
     return render_template('counter.html')
 
 @app.route('/login', methods=['GET','POST'])
@@ -55,17 +62,24 @@ def login():
         password = request.form.get('password')
         remember_me = request.form.get('remember_me') == 'on'
         if login and password:
-            for user in get_users():
-                if user['login'] == login and user['password'] == password:
-                    user = User(user['id'],user['login'])
-                    login_user(user,remember=remember_me)
-                    flash('Вы успешно аутентифицированы.', 'success')
-
-                    next_page = request.args.get('next')
-                    if next_page:
-                        return redirect(next_page)
-                    else:
-                        return redirect(url_for('index'))
+            retry_after = login_limiter.retry_after(login)
+            if retry_after:
+                error = f'Слишком много неудачных попыток входа. Повторите через {retry_after} с.'
+                return render_template('auth.html', error=error), 429, {'Retry-After': str(retry_after)}
+            record = user_store.authenticate(login, password)
+            if record is not None:
+                login_limiter.success(login)
+                session.regenerate()  # Новый sid после входа: старый мог быть известен атакующему
+                user = User(record.id, record.login)
+                login_user(user,remember=remember_me)
+                flash('Вы успешно аутентифицированы.', 'success')
+
+                next_page = request.args.get('next')
+                if next_page:
+                    return redirect(next_page)
+                else:
+                    return redirect(url_for('index'))
+            login_limiter.failure(login)
             return render_template('auth.html',error='Пользователь не найден, проверьте корректность введенных данных.')
     return render_template('auth.html')
 
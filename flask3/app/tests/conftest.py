@@ -7,6 +7,7 @@ from app import app as application
 
 @pytest.fixture
 def app():
+    application.config['SESSION_STORE_PATH'] = ':memory:'  # Сессии тестов не попадают в instance/sessions.db
     return application
 
 @pytest.fixture
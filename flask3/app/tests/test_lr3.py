@@ -104,3 +104,88 @@ def test_load_user():
     assert user is None
 
 
+def test_login_limit(client):
+    from login_limiter import login_limiter
+    login_limiter.clear()
+    try:
+        for _ in range(5):
+            response = client.post('/login', data={'username': 'user', 'password': '1234'})
+            assert response.status_code == 200
+        # Даже верный пароль не проверяется, пока не истечет окно
+        response = client.post('/login', data={'username': 'user', 'password': 'qwerty'})
+        assert response.status_code == 429
+        assert 'Слишком много неудачных попыток входа' in response.text
+    finally:
+        login_limiter.clear()
+
+
+def test_user_store_indexes_and_reload(tmp_path):
+    import json
+    import os
+    from user_store import make_store
+    path = tmp_path / 'users.json'
+    store = make_store(str(path), check_interval=0)
+    record = store.add('alice', 'secret1')
+    assert store.get(record.id) is record
+    assert store.authenticate('alice', 'secret1') is record
+    assert store.authenticate('alice', 'wrong') is None
+    assert store.authenticate('nobody', 'secret1') is None
+
+    # Файл изменил другой процесс: при следующем обращении индексы перечитываются
+    data = json.loads(path.read_text(encoding='utf-8'))
+    data.append({'id': '7', 'login': 'bob', 'password_hash': data[0]['password_hash']})
+    path.write_text(json.dumps(data), encoding='utf-8')
+    os.utime(path, ns=(0, 10 ** 18))
+    assert store.get_by_login('bob').id == '7'
+
+    sqlite_store = make_store(f'sqlite:///{tmp_path / "users.db"}', check_interval=0)
+    sqlite_store.add('carol', 'secret2')
+    assert make_store(f'sqlite:///{tmp_path / "users.db"}').authenticate('carol', 'secret2').login == 'carol'
+
+    # Наследник без _write не создается, а не падает при первом сохранении
+    import pytest
+    from user_store import JSONUserStore, UserStore
+
+    class ReadOnlyStore(UserStore):
+        _mtime_of_source = JSONUserStore._mtime_of_source
+        _read = JSONUserStore._read
+
+    with pytest.raises(TypeError):
+        ReadOnlyStore()
+
+
+def test_server_side_session(client):
+    from server_session import server_session
+    client.get('/counter')
+    cookie = client.get_cookie('session')
+    # В cookie только идентификатор, данные на сервере
+    assert len(cookie.value) == 43 and 'counter' not in cookie.value
+    writes = server_session.store.writes
+    client.get('/')  # Сессия не менялась - в хранилище ничего не пишется
+    assert server_session.store.writes == writes
+    response = client.get('/counter')
+    assert 'Вы посетили эту страницу 2 раз' in response.text
+    assert server_session.store.writes == writes + 1
+
+
+def test_session_store_sees_other_workers(tmp_path):
+    import time
+    from server_session import SQLiteSessionStore
+    path = str(tmp_path / 'sessions.db')
+    first, second = SQLiteSessionStore(path, check_interval=5), SQLiteSessionStore(path, check_interval=5)
+    now = time.time()
+    first.set('sid', '{"a": 1}', now + 60)
+    data, version = second.get('sid', now)
+    assert second.get('sid', now + 1) == (data, version)  # Из кэша без запроса к базе
+    assert second.get('sid', now + 6) == (data, version)  # Интервал прошел: из кэша после сверки версии
+    assert (second.reads, second.cache_hits, second.version_checks) == (1, 1, 1)
+
+    # Выход в другом воркере: устаревшие данные сессию не возвращают, после интервала ее нет и в кэше
+    first.delete('sid')
+    assert not second.set('sid', '{"a": 2}', now + 60, version)
+    assert second.get('sid', now + 7) is None
+    first.set('sid2', '{"a": 1}', now + 60)
+    second.get('sid2', now)
+    first.delete('sid2')
+    assert second.get('sid2', now + 6) is None
+    assert first.get('sid', now) is None
@@ -0,0 +1,200 @@
+# user_store.py
+import abc
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+class UserRecord:
+    """Пользователь в хранилище: три поля без __dict__ (около 70 байт на запись, не считая строк)."""
+
+    __slots__ = ('id', 'login', 'password_hash')
+
+    def __init__(self, user_id, login, password_hash):
+        self.id = str(user_id)
+        self.login = login
+        self.password_hash = password_hash
+
+
+class UserStore(abc.ABC):
+    """Пользователи в памяти процесса с индексами по id и по логину.
+
+    Источник читается один раз и перечитывается, когда меняется время его
+    изменения (проверка не чаще раза в USER_STORE_CHECK_INTERVAL секунд).
+    Наследники реализуют _mtime_of_source, _read и _write.
+    """
+
+    def __init__(self, check_interval=1.0):
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._indexes = ({}, {})
+        self._mtime = None
+        self._checked_at = 0
+        self._dummy_hash = None
+        self.loads = 0
+
+    def get(self, user_id):
+        self.reload_if_changed()
+        return self._indexes[0].get(str(user_id))
+
+    def get_by_login(self, login):
+        self.reload_if_changed()
+        return self._indexes[1].get(login)
+
+    def authenticate(self, login, password):
+        """Запись пользователя, если логин и пароль верны, иначе None."""
+        record = self.get_by_login(login)
+        if record is None:
+            # Хеш проверяется и для неизвестного логина, чтобы время ответа не выдавало, есть ли такой пользователь
+            if self._dummy_hash is None:
+                self._dummy_hash = generate_password_hash('dummy-password')
+            check_password_hash(self._dummy_hash, password)
+            return None
+        return record if check_password_hash(record.password_hash, password) else None
+
+    def add(self, login, password, user_id=None):
+        """Добавляет пользователя (или меняет пароль существующего) в источнике и в индексах."""
+        with self._lock:
+            self.reload_if_changed(force=True)
+            by_id, by_login = self._indexes
+            existing = by_login.get(login)
+            if existing is not None:
+                user_id = existing.id
+            elif user_id is None:
+                user_id = max((int(key) for key in by_id if key.isdigit()), default=0) + 1
+            record = UserRecord(user_id, login, generate_password_hash(password))
+            records = [item for item in by_id.values() if item.id != record.id] + [record]
+            self._write(records, record)
+            self._index(records)
+            self._mtime = self._mtime_of_source()
+            return record
+
+    def __len__(self):
+        self.reload_if_changed()
+        return len(self._indexes[0])
+
+    def reload_if_changed(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._checked_at < self.check_interval:
+            return
+        self._checked_at = now
+        mtime = self._mtime_of_source()
+        if mtime != self._mtime or force:
+            self._index(self._read())
+            self._mtime = mtime
+
+    def _index(self, records):
+        by_id, by_login = {}, {}
+        for record in records:
+            by_id[record.id] = record
+            by_login[record.login] = record
+        # Индексы заменяются целиком: читающие потоки видят либо старую, либо новую версию
+        self._indexes = (by_id, by_login)
+        self.loads += 1
+
+    @abc.abstractmethod
+    def _mtime_of_source(self):
+        """Отметка изменения источника; по ее смене хранилище перечитывается."""
+
+    @abc.abstractmethod
+    def _read(self):
+        """Все записи источника списком UserRecord."""
+
+    @abc.abstractmethod
+    def _write(self, records, changed):
+        """Сохраняет записи источника; changed - добавленная или измененная запись."""
+
+
+class JSONUserStore(UserStore):
+    """Пользователи в JSON-файле: [{"id": ..., "login": ..., "password_hash": ...}, ...]."""
+
+    def __init__(self, path, check_interval=1.0):
+        super().__init__(check_interval)
+        self.path = path
+
+    def _mtime_of_source(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _read(self):
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path, encoding='utf-8') as f:
+            return [UserRecord(item['id'], item['login'], item['password_hash']) for item in json.load(f)]
+
+    def _write(self, records, changed):
+        data = [{'id': record.id, 'login': record.login, 'password_hash': record.password_hash} for record in records]
+        # Запись во временный файл и замена: другие процессы не увидят файл наполовину записанным
+        temporary = f'{self.path}.tmp'
+        with open(temporary, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(temporary, self.path)
+
+
+class SQLiteUserStore(UserStore):
+    """Пользователи в таблице users (id, login, password_hash) базы SQLite."""
+
+    def __init__(self, path, check_interval=1.0):
+        super().__init__(check_interval)
+        self.path = path
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path)
+        connection.execute('CREATE TABLE IF NOT EXISTS users (id INTEGER PRIMARY KEY, login TEXT NOT NULL UNIQUE, '
+                           'password_hash TEXT NOT NULL)')
+        return connection
+
+    def _mtime_of_source(self):
+        # В режиме WAL изменения сначала попадают в файл -wal
+        mtimes = []
+        for path in (self.path, f'{self.path}-wal'):
+            try:
+                mtimes.append(os.stat(path).st_mtime_ns)
+            except FileNotFoundError:
+                mtimes.append(None)
+        return tuple(mtimes)
+
+    def _read(self):
+        connection = self._connect()
+        try:
+            return [UserRecord(*row) for row in connection.execute('SELECT id, login, password_hash FROM users')]
+        finally:
+            connection.close()
+
+    def _write(self, records, changed):
+        # В базе меняется одна строка, остальные уже там
+        connection = self._connect()
+        try:
+            with connection:
+                connection.execute('INSERT INTO users (id, login, password_hash) VALUES (?, ?, ?) '
+                                   'ON CONFLICT (id) DO UPDATE SET login = excluded.login, '
+                                   'password_hash = excluded.password_hash',
+                                   (int(changed.id), changed.login, changed.password_hash))
+        finally:
+            connection.close()
+
+
+def make_store(source, check_interval=1.0):
+    """Хранилище по USER_STORE: путь к .json или sqlite:///путь."""
+    if source.startswith('sqlite:///'):
+        return SQLiteUserStore(source[len('sqlite:///'):], check_interval)
+    return JSONUserStore(source, check_interval)
+
+
+@click.command('add-user')
+@click.argument('login')
+@click.password_option()
+@with_appcontext
+def add_user_command(login, password):
+    """Добавляет пользователя в хранилище или меняет его пароль."""
+    record = current_app.extensions['user_store'].add(login, password)
+    click.echo(f'Пользователь {record.login} (id {record.id}) сохранен')
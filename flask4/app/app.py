@@ -5,15 +5,32 @@ from flask_migrate import Migrate
 from models import db, Role, User
 from routes import routes_bp
 from flask_login import LoginManager
+from permissions import current_permissions
+from user_search import rebuild_user_search_command
+from passwords import password_hasher, calibrate_password_hash_command
+from login_limiter import login_limiter
+from user_transfer import import_users_command, export_users_command
 
 
 app = Flask(__name__)
 
 # Конфигурация базы данных
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///users.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///users.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', '3266a513ac62f8c4be0670900e7fd71342a62f0fc685d900c38985938f49ca39')
 
+# Поиск пользователей по нескольким словам через FTS5 (если SQLite собран с ней)
+app.config['USER_SEARCH_FTS'] = os.environ.get('USER_SEARCH_FTS', '1') == '1'
+
+# Хеширование паролей в пуле потоков; параметры подбирает flask calibrate-password-hash
+app.config['PASSWORD_HASH_METHOD'] = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+app.config['PASSWORD_HASH_POOL'] = os.environ.get('PASSWORD_HASH_POOL', 'thread')
+password_hasher.init_app(app)
+
+# Лимит неудачных входов; LOGIN_LIMIT_STORAGE - файл SQLite, общий для воркеров gunicorn
+app.config['LOGIN_LIMIT_STORAGE'] = os.environ.get('LOGIN_LIMIT_STORAGE')
+login_limiter.init_app(app)
+
 # Инициализация SQLAlchemy
 db.init_app(app)
 
@@ -29,10 +46,24 @@ login_manager.login_message = "У вас нет прав доступа к эт
 # Регистрация blueprint с маршрутами
 app.register_blueprint(routes_bp)
 
+# Пересчет поисковых столбцов и FTS5 пользователей: flask rebuild-user-search
+app.cli.add_command(rebuild_user_search_command)
+app.cli.add_command(calibrate_password_hash_command)
+
+# Массовая загрузка и выгрузка пользователей: flask import-users, flask export-users
+app.cli.add_command(import_users_command)
+app.cli.add_command(export_users_command)
+
 # Функция для загрузки пользователя (необходима для Flask-Login)
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    # Роль загружается тем же запросом: она нужна check_rights и шаблонам
+    return db.session.get(User, int(user_id), options=[db.joinedload(User.role)])
+
+# Права текущего пользователя в шаблонах, разобранные один раз за запрос
+@app.context_processor
+def inject_permissions():
+    return {'current_permissions': current_permissions()}
 
 # Создание таблиц базы данных и ролей/пользователей
 def create_app():
@@ -52,7 +83,7 @@ def create_app():
                 'edit_user': True,
                 'delete_user': True,
                 'view_user': True,
-                'view_logs': True,
+                'visit_log': True,
                 'view_self': True,
                 'edit_self': True
             })
@@ -67,7 +98,7 @@ def create_app():
             user_role.set_permissions({
                 'view_self': True,
                 'edit_self': True,
-                'view_logs': True
+                'visit_log': True
             })
             db.session.add(user_role)
             print("Роль Пользователь создана")
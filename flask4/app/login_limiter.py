@@ -0,0 +1,202 @@
+# login_limiter.py
+import math
+import os
+import sqlite3
+import threading
+import time
+
+from flask import request
+
+
+def _estimate(previous, current, elapsed, period):
+    """Скользящее окно по двум фиксированным: прошлое окно учитывается на долю, еще не вышедшую из окна."""
+    return previous * (1 - elapsed / period) + current
+
+
+class MemoryStore:
+    """Счетчики в словаре процесса: ключ -> [номер окна, прошлое окно, текущее окно, истекает].
+
+    На ключ - четыре числа. Просроченные ключи удаляются при переполнении и
+    каждые 1000 записей; если их не хватает, уходят самые давние ключи.
+    """
+
+    def __init__(self, max_keys=100_000):
+        self.max_keys = max_keys
+        self._data = {}
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def counts(self, key, period, now):
+        index = int(now // period)
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return 0, 0
+            return self._roll(entry, index, period)[1:3]
+
+    def incr(self, key, period, now):
+        index = int(now // period)
+        with self._lock:
+            # Ключ переставляется в конец: в начале словаря остаются давно не обновлявшиеся
+            entry = self._data.pop(key, None) or [index, 0, 0, 0]
+            self._roll(entry, index, period)
+            entry[2] += 1
+            self._data[key] = entry
+            self._writes += 1
+            if len(self._data) > self.max_keys or self._writes % 1000 == 0:
+                self._sweep(now)
+            return entry[1], entry[2]
+
+    def clear(self, key=None):
+        with self._lock:
+            if key is None:
+                self._data.clear()
+            else:
+                self._data.pop(key, None)
+
+    def __len__(self):
+        return len(self._data)
+
+    @staticmethod
+    def _roll(entry, index, period):
+        if entry[0] != index:
+            entry[1] = entry[2] if entry[0] == index - 1 else 0
+            entry[2] = 0
+            entry[0] = index
+        entry[3] = (index + 2) * period
+        return entry
+
+    def _sweep(self, now):
+        for key in [key for key, entry in self._data.items() if entry[3] <= now]:
+            del self._data[key]
+        while len(self._data) > self.max_keys:
+            del self._data[next(iter(self._data))]
+
+
+class SQLiteStore:
+    """Счетчики в отдельном файле SQLite, общие для всех воркеров на машине."""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._writes = 0
+
+    def counts(self, key, period, now):
+        index = int(now // period)
+        rows = dict(self._connection().execute(
+            'SELECT slot, count FROM login_limits WHERE key = ? AND slot >= ?', (key, index - 1)))
+        return rows.get(index - 1, 0), rows.get(index, 0)
+
+    def incr(self, key, period, now):
+        index = int(now // period)
+        connection = self._connection()
+        connection.execute(
+            'INSERT INTO login_limits (key, slot, count, expires) VALUES (?, ?, 1, ?) '
+            'ON CONFLICT (key, slot) DO UPDATE SET count = count + 1', (key, index, (index + 2) * period))
+        self._writes += 1
+        if self._writes % 1000 == 0:
+            connection.execute('DELETE FROM login_limits WHERE expires <= ?', (now,))
+        return self.counts(key, period, now)
+
+    def clear(self, key=None):
+        if key is None:
+            self._connection().execute('DELETE FROM login_limits')
+        else:
+            self._connection().execute('DELETE FROM login_limits WHERE key = ?', (key,))
+
+    def __len__(self):
+        return self._connection().execute('SELECT count(DISTINCT key) FROM login_limits').fetchone()[0]
+
+    def _connection(self):
+        # Соединение свое у каждого потока и процесса (после fork старое не используем)
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=1, isolation_level=None, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode = WAL')
+            connection.execute('PRAGMA synchronous = NORMAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS login_limits (key TEXT NOT NULL, slot INTEGER NOT NULL, '
+                               'count INTEGER NOT NULL, expires REAL NOT NULL, PRIMARY KEY (key, slot)) WITHOUT ROWID')
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+
+class LoginLimiter:
+    """Ограничение неудачных входов по IP и по логину в скользящем окне.
+
+    Проверка идет до проверки пароля, поэтому подбор паролей упирается в
+    лимит, а не в процессор. Счетчики по умолчанию в памяти процесса; при
+    LOGIN_LIMIT_STORAGE (путь к файлу SQLite) общие для всех воркеров.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.store = MemoryStore()
+        self.hits = 0  # Попыток, отклоненных лимитом
+        self.misses = 0  # Попыток, пропущенных к проверке пароля
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('LOGIN_LIMIT_ENABLED', True)
+        app.config.setdefault('LOGIN_LIMIT_PER_LOGIN', (5, 300))  # Неудачных входов в логин за секунд
+        app.config.setdefault('LOGIN_LIMIT_PER_IP', (50, 300))  # Неудачных входов с одного IP за секунд
+        app.config.setdefault('LOGIN_LIMIT_STORAGE', None)
+        app.config.setdefault('LOGIN_LIMIT_MAX_KEYS', 100_000)
+        self.app = app
+        if app.config['LOGIN_LIMIT_STORAGE']:
+            self.store = SQLiteStore(app.config['LOGIN_LIMIT_STORAGE'])
+        else:
+            self.store = MemoryStore(app.config['LOGIN_LIMIT_MAX_KEYS'])
+        app.extensions['login_limiter'] = self
+
+    def _limits(self, login, ip):
+        config = self.app.config
+        ip = ip or request.remote_addr or 'unknown'
+        return [(f'ip:{ip}', config['LOGIN_LIMIT_PER_IP']),
+                (f'login:{(login or "").casefold()}', config['LOGIN_LIMIT_PER_LOGIN'])]
+
+    def retry_after(self, login, ip=None, now=None):
+        """Через сколько секунд можно повторить вход; 0 - попытку можно проверять."""
+        if not self.app.config['LOGIN_LIMIT_ENABLED']:
+            return 0
+        now = now or time.time()
+        limited, wait = False, 0
+        for key, (limit, period) in self._limits(login, ip):
+            previous, current = self.store.counts(key, period, now)
+            elapsed = now % period
+            if _estimate(previous, current, elapsed, period) < limit:
+                continue
+            limited = True
+            if current >= limit:
+                # Ждем конца окна, а потом пока его доля в следующем окне не опустится ниже лимита
+                wait = max(wait, period - elapsed + period * (1 - limit / current))
+            else:
+                wait = max(wait, period * (1 - (limit - current) / previous) - elapsed)
+        if limited:
+            self.hits += 1
+            return max(math.ceil(wait), 1)
+        self.misses += 1
+        return 0
+
+    def failure(self, login, ip=None, now=None):
+        if not self.app.config['LOGIN_LIMIT_ENABLED']:
+            return
+        now = now or time.time()
+        for key, (limit, period) in self._limits(login, ip):
+            self.store.incr(key, period, now)
+
+    def success(self, login, ip=None):
+        """Успешный вход обнуляет счетчик логина; счетчик IP остается."""
+        key, _ = self._limits(login, ip)[1]
+        self.store.clear(key)
+
+    def clear(self):
+        self.store.clear()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'keys': len(self.store),
+                'storage': 'sqlite' if isinstance(self.store, SQLiteStore) else 'memory'}
+
+
+login_limiter = LoginLimiter()
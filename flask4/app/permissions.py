@@ -0,0 +1,94 @@
+# permissions.py
+import threading
+
+from flask import g, has_app_context
+from flask_login import current_user
+from sqlalchemy import event
+
+from models import ALL_PERMISSIONS, Role, permission_bit
+
+ADMIN_ROLE = 'Администратор'
+
+
+class RolePermissions:
+    """Права роли, скомпилированные в битовую маску; проверка права - одна операция AND."""
+
+    __slots__ = ('role_id', 'name', 'version', 'mask')
+
+    def __init__(self, role_id, name, version, mask):
+        self.role_id = role_id
+        self.name = name
+        self.version = version
+        self.mask = mask
+
+    @property
+    def is_admin(self):
+        return self.name == ADMIN_ROLE
+
+    def allows(self, permission):
+        return bool(self.mask & permission_bit(permission))
+
+    def covers(self, other):
+        """Есть ли у этой роли все права роли other."""
+        return other.mask & ~self.mask == 0
+
+
+# Права гостя и ролей, которым ничего не показывается
+NO_PERMISSIONS = RolePermissions(None, None, 0, 0)
+
+# id роли -> RolePermissions; общий для всех запросов процесса
+_cache = {}
+_lock = threading.Lock()
+
+
+def role_permissions(role):
+    """Права роли из кэша; маска пересобирается, если у роли сменилась версия."""
+    if role is None:
+        return None
+    cached = _cache.get(role.id)
+    if cached is not None and cached.version == role.version:
+        return cached
+    # Администратору доступно все, даже права, добавленные в реестр позже
+    mask = ALL_PERMISSIONS if role.name == ADMIN_ROLE else role.permission_mask()
+    resolved = RolePermissions(role.id, role.name, role.version, mask)
+    with _lock:
+        _cache[role.id] = resolved
+    return resolved
+
+
+def current_permissions():
+    """Права текущего пользователя, один раз за запрос (роль загружена вместе с пользователем)."""
+    if 'current_permissions' not in g:
+        g.current_permissions = role_permissions(current_user.role) if current_user.is_authenticated else None
+    return g.current_permissions
+
+
+def assignable_roles(grantor=None, keep_role_id=None):
+    """Роли (id, название), которые может назначить grantor: не шире его собственных прав.
+
+    keep_role_id - текущая роль редактируемого пользователя, она остается в списке.
+    """
+    choices = []
+    for role in Role.query.order_by(Role.id):
+        resolved = role_permissions(role)
+        if grantor is None or grantor.is_admin or grantor.covers(resolved) or role.id == keep_role_id:
+            choices.append((role.id, role.name))
+    return choices
+
+
+def invalidate_permissions(role_id=None):
+    """Сбрасывает права роли (или все) в кэше процесса и в текущем запросе."""
+    with _lock:
+        if role_id is None:
+            _cache.clear()
+        else:
+            _cache.pop(role_id, None)
+    if has_app_context():
+        g.pop('current_permissions', None)
+
+
+@event.listens_for(Role, 'after_update')
+@event.listens_for(Role, 'after_delete')
+def _role_changed(mapper, connection, role):
+    # Другие процессы увидят новую версию роли при следующей загрузке пользователя
+    invalidate_permissions(role.id)
@@ -1,9 +1,13 @@
-from flask import Blueprint, render_template, request, session, redirect, url_for, flash, send_file
+from flask import Blueprint, render_template, request, session, redirect, url_for, flash, send_file, jsonify
 from forms import LoginForm, RegistrationForm, EditUserForm, ChangePasswordForm
-from models import db, User, Role, VisitLog
-from werkzeug.security import generate_password_hash, check_password_hash
+from models import db, User, Role, VisitLog, permission_bit
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
 from functools import wraps
+from sqlalchemy.orm import joinedload, load_only
+from permissions import NO_PERMISSIONS, current_permissions, invalidate_permissions
+from user_search import search_users
+from passwords import password_hasher
+from login_limiter import login_limiter
 import json
 from datetime import datetime
 from collections import Counter
@@ -12,22 +16,56 @@ import io
 
 routes_bp = Blueprint('routes', __name__)
 
+# Пользователей на одной странице списка
+USERS_PER_PAGE = 20
+
+
+def user_directory(page):
+    """Страница списка пользователей: только нужные столбцы, роли - тем же запросом."""
+    query = User.query.options(
+        load_only(User.id, User.first_name, User.last_name, User.middle_name, User.role_id),
+        joinedload(User.role).load_only(Role.name),
+    ).order_by(User.id)
+    pagination = query.paginate(page=page, per_page=USERS_PER_PAGE, error_out=False, count=False)
+    counts = role_counts()
+    # Общее число - сумма по ролям, отдельный COUNT(*) не нужен
+    pagination.total = sum(count for _, count in counts)
+    return pagination, counts
+
+
+def role_counts():
+    """Число пользователей по ролям одним агрегатным запросом; None - пользователи без роли."""
+    total = db.func.count(User.id)
+    return db.session.query(Role.name, total).select_from(User) \
+        .outerjoin(Role, Role.id == User.role_id) \
+        .group_by(Role.name).order_by(total.desc()).all()
+
+
+def user_listing():
+    """Данные для списка пользователей: результаты поиска (?q=) или страница каталога (?page=)."""
+    query = request.args.get('q', '').strip()
+    if query:
+        return dict(users=search_users(query), pagination=None, role_counts=role_counts(), query=query)
+    pagination, counts = user_directory(request.args.get('page', 1, type=int))
+    return dict(users=pagination.items, pagination=pagination, role_counts=counts, query='')
+
 def check_rights(permission):
+    required = permission_bit(permission)  # Неизвестное право - ошибка уже при импорте модуля
+
     def decorator(f):
         @wraps(f)
         def decorated_function(*args, **kwargs):
             if current_user.is_authenticated:
-                user = User.query.get(current_user.get_id())
-                role = Role.query.get(user.role_id)
-                if role:
-                    permissions = role.get_permissions()
+                # Пользователь и роль уже загружены в load_user, права берутся из кэша
+                access = current_permissions()
+                if access:
                     # Если пользователь - администратор, разрешаем доступ
-                    if role.name == 'Администратор':
+                    if access.is_admin:
                         return f(*args, **kwargs)
                     # Если user_id текущего пользователя совпадает с user_id в запросе, разрешаем доступ
-                    if 'user_id' in kwargs and str(user.id) == kwargs['user_id']:
+                    if 'user_id' in kwargs and str(current_user.id) == kwargs['user_id']:
                         return f(*args, **kwargs)
-                    if permission in permissions and permissions[permission]:
+                    if access.mask & required:
                         return f(*args, **kwargs)
                     else:
                         flash('У вас нет прав для просмотра этой страницы.', 'danger')
@@ -44,16 +82,10 @@ def check_rights(permission):
 
 @routes_bp.route('/')
 def index():
-    user = current_user if current_user.is_authenticated else None
-    if user:
-        role = Role.query.get(user.role_id)
-        current_user_permissions = role.get_permissions() if role else {}
-    else:
-        current_user_permissions = {}
-    users = User.query.all()
+    current_user_permissions = current_permissions() or NO_PERMISSIONS
     current_user_id = current_user.get_id() if current_user.is_authenticated else None
-    return render_template('index.html', users=users, current_user_permissions=current_user_permissions,
-                              current_user_id=current_user_id, current_user=current_user)
+    return render_template('index.html', current_user_permissions=current_user_permissions,
+                           current_user_id=current_user_id, current_user=current_user, **user_listing())
 
 @routes_bp.route('/login', methods=['GET', 'POST'])
 def login():
@@ -61,14 +93,23 @@ def login():
         return redirect(url_for('routes.index'))  # views.index -> routes.index
     form = LoginForm()
     if form.validate_on_submit():
+        # Лимит проверяется до хеширования пароля: перебор не нагружает процессор
+        retry_after = login_limiter.retry_after(form.login.data)
+        if retry_after:
+            flash(f'Слишком много неудачных попыток входа. Повторите через {retry_after} с.', 'danger')
+            return render_template('login.html', title='Sign In', form=form), 429, {'Retry-After': str(retry_after)}
         user = User.query.filter_by(login=form.login.data).first()
         if user and user.check_password(form.password.data):
+            login_limiter.success(form.login.data)
             login_user(user)
+            # check_password мог пересчитать хеш с устаревшими параметрами
+            db.session.commit()
 
             # Записываем в сессию информацию о посещении страницы
             session['last_visited'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
             return redirect(url_for('routes.index'))  # views.index -> routes.index
+        login_limiter.failure(form.login.data)
         flash('Неверный логин или пароль', 'danger')
     return render_template('login.html', title='Sign In', form=form)
 
@@ -86,7 +127,7 @@ def logout():
 def create_user():
     form = RegistrationForm()
     if form.validate_on_submit():
-        hashed_password = generate_password_hash(form.password.data)
+        hashed_password = password_hasher.hash(form.password.data)
         role = Role.query.get(form.role.data)
         user = User(login=form.login.data, password_hash=hashed_password, first_name=form.first_name.data,
                     last_name=form.last_name.data, middle_name=form.middle_name.data, role=role)
@@ -118,15 +159,13 @@ def edit_user(user_id):
         user.middle_name = form.middle_name.data
         user.role_id = form.role.data
         db.session.commit()
+        # Роль могла смениться: права будут разобраны заново
+        invalidate_permissions()
         flash('Профиль пользователя успешно обновлен!', 'success')
         return redirect(url_for('routes.user_details', user_id=user.id))
 
     # Получаем current_user_permissions
-    current_user_permissions = {}
-    if current_user.is_authenticated:
-        role = Role.query.get(current_user.role_id)
-        if role:
-            current_user_permissions = role.get_permissions()
+    current_user_permissions = current_permissions() or NO_PERMISSIONS
 
     return render_template('edit_user.html', title='Edit User', form=form, user=user,
                            current_user_permissions=current_user_permissions)
@@ -155,4 +194,14 @@ def change_password():
             return redirect(url_for('routes.index'))  # views.index -> routes.index
         else:
             flash('Неверный старый пароль', 'danger')
-    return render_template('change_password.html', title='Change Password', form=form)
\ No newline at end of file
+    return render_template('change_password.html', title='Change Password', form=form)
+
+@routes_bp.route('/users/search')
+@login_required
+@check_rights('view_user')
+def search_users_json():
+    """Подсказки для поля поиска: пользователи по началу логина, фамилии или имени."""
+    limit = min(max(request.args.get('limit', 20, type=int), 1), 100)
+    users = search_users(request.args.get('q'), limit=limit)
+    return jsonify([{'id': user.id, 'login': user.login, 'full_name': user.get_full_name(),
+                     'role': user.role.name if user.role else None} for user in users])
@@ -0,0 +1,262 @@
+# user_transfer.py
+import concurrent.futures
+import csv
+import functools
+import json
+import os
+import re
+import sys
+import time
+import types
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import insert, select
+from werkzeug.security import generate_password_hash
+from wtforms.validators import ValidationError
+
+from forms import validate_login, validate_password
+from models import Role, User, db
+from passwords import password_hasher
+from user_search import FOLDED_COLUMNS, fold, index_users
+
+# Столбцы файла выгрузки; password_hash - только с --with-hashes
+EXPORT_FIELDS = ('login', 'last_name', 'first_name', 'middle_name', 'role')
+# Хеши werkzeug, которые понимает check_password_hash: метод$соль$хеш
+HASH_FORMAT = re.compile(r'(scrypt(:\d+:\d+:\d+)?|pbkdf2:\w+(:\d+)?)\$[^$]+\$[0-9a-f]+')
+
+
+def detect_format(path, fmt=None):
+    if fmt:
+        return fmt
+    return 'jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv'
+
+
+class RowError(ValueError):
+    """Строку файла нельзя загрузить; текст - для отчета об ошибках."""
+
+
+def read_rows(stream, fmt):
+    """Строки файла по одной: (номер строки, словарь полей или RowError для нечитаемой строки)."""
+    if fmt == 'jsonl':
+        for number, line in enumerate(stream, 1):
+            if not line.strip():
+                continue
+            try:
+                yield number, json.loads(line)
+            except ValueError as error:
+                yield number, RowError(f'Некорректный JSON: {error}')
+    else:
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+
+
+def _check(validator, value):
+    try:
+        validator(None, types.SimpleNamespace(data=value))
+    except ValidationError as error:
+        return str(error)
+    return None
+
+
+def field(row, name):
+    """Значение поля строкой ('' для пустого); RowError, если в JSON там не строка."""
+    value = row.get(name)
+    if value is None:
+        return ''
+    if not isinstance(value, str):
+        raise RowError(f'Поле {name} должно быть строкой.')
+    return value
+
+
+def validate_row(row, roles, default_role=None):
+    """Поля пользователя для вставки (без хеша) или текст ошибки - те же правила, что в форме создания."""
+    if isinstance(row, RowError):
+        return None, str(row)
+    if not isinstance(row, dict):
+        return None, 'Строка должна быть объектом JSON.'
+    try:
+        return _validate_fields(row, roles, default_role)
+    except RowError as error:
+        return None, str(error)
+
+
+def _validate_fields(row, roles, default_role):
+    login = field(row, 'login').strip()
+    error = _check(validate_login, login)
+    if error:
+        return None, error
+    password_hash = field(row, 'password_hash')
+    if password_hash:
+        if not HASH_FORMAT.fullmatch(password_hash):
+            return None, 'Некорректный хеш пароля.'
+    else:
+        error = _check(validate_password, field(row, 'password'))
+        if error:
+            return None, error
+    first_name = field(row, 'first_name').strip()
+    last_name = field(row, 'last_name').strip()
+    if not first_name or not last_name:
+        return None, 'Не указаны имя или фамилия.'
+    role_name = field(row, 'role').strip() or default_role
+    if role_name and role_name not in roles:
+        return None, f'Неизвестная роль: {role_name}'
+    return {
+        'login': login,
+        'first_name': first_name,
+        'last_name': last_name,
+        'middle_name': field(row, 'middle_name').strip(),
+        'role_id': roles.get(role_name),
+    }, None
+
+
+class UserImport:
+    """Загрузка пользователей пачками: проверка, хеширование в пуле процессов, одна вставка на пачку.
+
+    Каждая пачка - отдельная транзакция, поэтому при ошибке остаются
+    загруженными все предыдущие пачки; повторный запуск пропустит их
+    как уже существующие логины.
+    """
+
+    def __init__(self, batch_size=1000, workers=None, default_role=None, dry_run=False, echo=click.echo):
+        self.batch_size = batch_size
+        self.workers = os.cpu_count() if workers is None else workers
+        self.default_role = default_role
+        self.dry_run = dry_run
+        self.echo = echo
+        self.imported = 0
+        self.skipped = 0
+        self.errors = []
+        # Роли читаются один раз: название -> id
+        self.roles = {name: role_id for role_id, name in db.session.execute(select(Role.id, Role.name))}
+        self._hash = functools.partial(generate_password_hash, method=password_hasher.method,
+                                       salt_length=password_hasher.config.get('PASSWORD_HASH_SALT_LENGTH', 16))
+
+    def run(self, rows):
+        started = time.perf_counter()
+        executor = concurrent.futures.ProcessPoolExecutor(self.workers) if self.workers > 0 else None
+        try:
+            batch = []
+            seen = set()
+            for number, row in rows:
+                values, error = validate_row(row, self.roles, self.default_role)
+                if values is None:
+                    self.errors.append((number, error))
+                    continue
+                if values['login'] in seen:
+                    self.errors.append((number, f'Логин {values["login"]} уже встречался в файле.'))
+                    continue
+                seen.add(values['login'])
+                # Поля уже проверены validate_row
+                batch.append((values, field(row, 'password_hash') or None, field(row, 'password')))
+                if len(batch) >= self.batch_size:
+                    self._flush(batch, executor, started)
+                    batch = []
+            if batch:
+                self._flush(batch, executor, started)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        return self.imported
+
+    def _flush(self, batch, executor, started):
+        # Логины, которые уже есть в базе, пропускаются без ошибки
+        existing = set(db.session.scalars(select(User.login).where(User.login.in_([values['login'] for values, _, _ in batch]))))
+        batch = [item for item in batch if item[0]['login'] not in existing]
+        self.skipped += len(existing)
+
+        passwords = [password for _, password_hash, password in batch if not password_hash]
+        if executor is not None:
+            chunk = max(len(passwords) // (self.workers * 4), 1)
+            hashes = iter(executor.map(self._hash, passwords, chunksize=chunk))
+        else:
+            hashes = iter(map(self._hash, passwords))
+
+        rows = []
+        for values, password_hash, _ in batch:
+            values['password_hash'] = password_hash or next(hashes)
+            for column, folded in FOLDED_COLUMNS:
+                values[folded] = fold(values[column])
+            rows.append(values)
+
+        if rows and not self.dry_run:
+            try:
+                # Вставка в обход событий ORM: поисковые столбцы заполнены выше, FTS5 - по id
+                user_ids = db.session.scalars(insert(User).returning(User.id), rows).all()
+                index_users(user_ids)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+        self.imported += len(rows)
+        elapsed = time.perf_counter() - started
+        self.echo(f'Загружено: {self.imported}, пропущено: {self.skipped}, ошибок: {len(self.errors)} '
+                  f'({self.imported / elapsed if elapsed else 0:.0f} в секунду)')
+
+
+def export_rows(batch_size=1000, with_hashes=False):
+    """Пользователи по порядку id, в памяти не больше одной пачки строк."""
+    columns = [User.login, User.last_name, User.first_name, User.middle_name, Role.name]
+    if with_hashes:
+        columns.append(User.password_hash)
+    query = select(*columns).outerjoin(Role, Role.id == User.role_id).order_by(User.id) \
+        .execution_options(yield_per=batch_size)
+    fields = EXPORT_FIELDS + (('password_hash',) if with_hashes else ())
+    for row in db.session.execute(query):
+        yield dict(zip(fields, row))
+
+
+def write_rows(stream, rows, fmt, with_hashes=False):
+    count = 0
+    if fmt == 'jsonl':
+        for row in rows:
+            stream.write(json.dumps(row, ensure_ascii=False) + '\n')
+            count += 1
+    else:
+        writer = csv.DictWriter(stream, EXPORT_FIELDS + (('password_hash',) if with_hashes else ()))
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    return count
+
+
+@click.command('import-users')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']), help='По умолчанию - по расширению файла.')
+@click.option('--batch-size', default=1000, show_default=True, help='Пользователей в одной транзакции.')
+@click.option('--workers', type=int, help='Процессов для хеширования паролей (0 - без пула). По умолчанию - число ядер.')
+@click.option('--default-role', help='Роль для строк без столбца role.')
+@click.option('--dry-run', is_flag=True, help='Только проверить файл и посчитать хеши, ничего не записывать.')
+@with_appcontext
+def import_users_command(path, fmt, batch_size, workers, default_role, dry_run):
+    """Загружает пользователей из CSV (login, password, last_name, first_name, middle_name, role) или JSONL."""
+    job = UserImport(batch_size=batch_size, workers=workers, default_role=default_role, dry_run=dry_run)
+    with open(path, encoding='utf-8-sig', newline='') as stream:
+        job.run(read_rows(stream, detect_format(path, fmt)))
+    for number, error in job.errors[:50]:
+        click.echo(f'Строка {number}: {error}', err=True)
+    if len(job.errors) > 50:
+        click.echo(f'... и еще {len(job.errors) - 50} ошибок', err=True)
+    click.echo(f'Итого загружено: {job.imported}, пропущено существующих: {job.skipped}, ошибок: {len(job.errors)}')
+    if job.errors:
+        sys.exit(1)
+
+
+@click.command('export-users')
+@click.argument('path', default='-')
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']), help='По умолчанию - по расширению файла.')
+@click.option('--batch-size', default=1000, show_default=True, help='Строк, читаемых из базы за раз.')
+@click.option('--with-hashes', is_flag=True, help='Добавить хеши паролей (для переноса в другую базу).')
+@with_appcontext
+def export_users_command(path, fmt, batch_size, with_hashes):
+    """Выгружает пользователей в CSV или JSONL (PATH '-' - в стандартный вывод)."""
+    fmt = detect_format(path, fmt)
+    rows = export_rows(batch_size, with_hashes)
+    if path == '-':
+        count = write_rows(click.get_text_stream('stdout'), rows, fmt, with_hashes)
+    else:
+        with open(path, 'w', encoding='utf-8', newline='') as stream:
+            count = write_rows(stream, rows, fmt, with_hashes)
+        click.echo(f'Выгружено пользователей: {count}')
@@ -1,16 +1,22 @@
+import os
+import sys
 import pytest
 from flask import template_rendered
 from contextlib import contextmanager
-from app import create_app, db
-from app.models import User, Role
-from werkzeug.security import generate_password_hash,check_password_hash
+
+# Модули приложения импортируются без пакета (from models import ...), как при запуске app.py
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'app')))
+# Движок базы создается при импорте приложения, поэтому адрес задаем заранее
+os.environ.setdefault('DATABASE_URL', 'sqlite:///:memory:')
+
+from app import app as application
+from models import User, Role, db
 
 
 @pytest.fixture(scope='session')
 def app():
-    app = create_app()
+    app = application
     app.config['TESTING'] = True
-    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
     app.config['WTF_CSRF_ENABLED'] = False
 
     with app.app_context():
@@ -20,13 +26,13 @@ def app():
             db.session.add(role)
             db.session.commit()
 
-            hashed_pw = generate_password_hash('password').decode('utf-8')
             admin = User(
                 login='admin',
-                password_hash=hashed_pw,
                 first_name='Admin',
+                last_name='Admin',
                 role_id=role.id
             )
+            admin.set_password('password')
             db.session.add(admin)
             db.session.commit()
 
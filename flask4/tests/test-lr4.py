@@ -1,5 +1,4 @@
-from app.models import User, Role
-from app import db, create_app
+from models import User, Role, db
 import pytest
 from flask.testing import FlaskClient
 from werkzeug.security import generate_password_hash
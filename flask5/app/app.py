@@ -7,22 +7,77 @@ from models import db, Role, User
 from routes import routes_bp
 from flask_login import LoginManager
 from routes_reports import reports_bp
-from flask import request
+from flask import request, g
 from flask_login import current_user
-from models import VisitLog, db
-import datetime
+from visit_writer import visit_writer
+from visit_rollups import backfill_rollups_command
+from visit_archive import archive_visits_command
+from visit_spool import visit_spool, ingest_visits_command
+from visit_live import visit_ring
+from permissions import current_permissions
+from user_search import rebuild_user_search_command
+from passwords import password_hasher, calibrate_password_hash_command
+from login_limiter import login_limiter
+from server_session import server_session
+from user_transfer import import_users_command, export_users_command
+from visit_sketches import visit_sketches
+from visit_policy import visit_policy
+from visit_latency import count_query
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+import time
 
 
 app = Flask(__name__)
 
 # Конфигурация базы данных
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///users.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///users.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Число записей под журналом посещений: exact, cached, estimate или none
+app.config['VISIT_LOG_TOTAL'] = os.environ.get('VISIT_LOG_TOTAL', 'cached')
+app.config['VISIT_LOG_TOTAL_TTL'] = 60  # Секунд хранения посчитанного количества
+# Записи журнала старше срока хранения переносятся в архив: flask archive-visits
+app.config['VISIT_LOG_RETENTION_DAYS'] = int(os.environ.get('VISIT_LOG_RETENTION_DAYS', 90))
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', '3266a513ac62f8c4be0670900e7fd71342a62f0fc685d900c38985938f49ca39')
 
 # Инициализация SQLAlchemy
 db.init_app(app)
 
+# Фоновая запись журнала посещений
+visit_writer.init_app(app)
+
+# Оценки уникальных посетителей и популярных страниц, сохраняются тем же потоком
+visit_sketches.init_app(app)
+visit_writer.periodic.append(visit_sketches.persist_if_due)
+
+# Фильтр путей и выборочное журналирование; при VISIT_LOG_ADAPTIVE выборка зависит от скорости записи
+visit_policy.init_app(app)
+visit_writer.flush_listeners.append(visit_policy.adjust)
+
+# При VISIT_LOG_SPOOL посещения пишутся в локальные файлы, в базу их загружает flask ingest-visits
+app.config['VISIT_LOG_SPOOL'] = os.environ.get('VISIT_LOG_SPOOL') == '1'
+visit_spool.init_app(app)
+visit_writer.spool = visit_spool
+
+# Поиск пользователей по нескольким словам через FTS5 (если SQLite собран с ней)
+app.config['USER_SEARCH_FTS'] = os.environ.get('USER_SEARCH_FTS', '1') == '1'
+
+# Хеширование паролей в пуле потоков; параметры подбирает flask calibrate-password-hash
+app.config['PASSWORD_HASH_METHOD'] = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+app.config['PASSWORD_HASH_POOL'] = os.environ.get('PASSWORD_HASH_POOL', 'thread')
+password_hasher.init_app(app)
+
+# Лимит неудачных входов; LOGIN_LIMIT_STORAGE - файл SQLite, общий для воркеров gunicorn
+app.config['LOGIN_LIMIT_STORAGE'] = os.environ.get('LOGIN_LIMIT_STORAGE')
+login_limiter.init_app(app)
+
+# Сессии хранятся на сервере (SQLite + LRU-кэш), в cookie только идентификатор
+app.config['SESSION_STORE_PATH'] = os.environ.get('SESSION_STORE_PATH', os.path.join(app.instance_path, 'sessions.db'))
+server_session.init_app(app)
+
+# Последние посещения воркера для живой ленты /reports/live
+visit_ring.init_app(app)
+
 # Инициализация Flask-Migrate для миграций базы данных
 migrate = Migrate(app, db)
 
@@ -33,35 +88,75 @@ login_manager.login_view = 'routes.login'
 login_manager.login_message = "У вас нет прав доступа к этой странице."
 login_manager.login_message_category = "danger"
 
+# Подсчет запросов к базе для журнала посещений
+event.listen(Engine, 'before_cursor_execute', count_query)
+
 # Регистрация blueprint с маршрутами
 app.register_blueprint(routes_bp)
 
 app.register_blueprint(reports_bp)
 
+# Команды обслуживания журнала посещений: flask backfill-visit-rollups, flask archive-visits, flask ingest-visits
+app.cli.add_command(backfill_rollups_command)
+app.cli.add_command(archive_visits_command)
+app.cli.add_command(ingest_visits_command)
+
+# Пересчет поисковых столбцов и FTS5 пользователей: flask rebuild-user-search
+app.cli.add_command(rebuild_user_search_command)
+app.cli.add_command(calibrate_password_hash_command)
+
+# Массовая загрузка и выгрузка пользователей: flask import-users, flask export-users
+app.cli.add_command(import_users_command)
+app.cli.add_command(export_users_command)
+
 # запускается перед каждым запросом к приложению Flask.
 @app.before_request
 def before_request_func():
+    g.visit_started = time.perf_counter()
+    g.visit_queries = 0
     if request.method != 'GET':
         return
 
     path = request.path
+    weight = visit_policy.weight(path)
+    if weight is None:
+        return  # Статика и другие исключенные пути не журналируются
+
     if current_user.is_authenticated:
         user_id = current_user.id
     else:
         user_id = None
 
-    visit = VisitLog(
-        path=path,
-        user_id=user_id,
-        created_at=datetime.datetime.now(datetime.UTC)
-    )
-    db.session.add(visit)
-    db.session.commit()
+    visit_sketches.add(path, f'user:{user_id}' if user_id else f'ip:{request.remote_addr}')
+    # Пропущенные выборкой посещения в журнал не пишутся, но в живой ленте видны
+    g.visit = (path, user_id, weight)
+
+# Посещение записывается после ответа, когда известны код и время обработки
+@app.after_request
+def after_request_func(response):
+    visit = g.pop('visit', None)
+    if visit:
+        path, user_id, weight = visit
+        duration_ms = (time.perf_counter() - g.visit_started) * 1000
+        # Запись не блокирует запрос: посещение уходит в очередь фонового потока
+        if weight:
+            visit_writer.enqueue(path, user_id, weight=weight, duration_ms=duration_ms,
+                                 status_code=response.status_code, query_count=g.visit_queries)
+        # Пользователь уже загружен Flask-Login, лента не делает запросов к базе
+        user = current_user.login if current_user.is_authenticated else None
+        visit_ring.publish(path, user, response.status_code, duration_ms)
+    return response
 
 # Функция для загрузки пользователя
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    # Роль загружается тем же запросом: она нужна check_rights и шаблонам
+    return db.session.get(User, int(user_id), options=[db.joinedload(User.role)])
+
+# Права текущего пользователя в шаблонах, разобранные один раз за запрос
+@app.context_processor
+def inject_permissions():
+    return {'current_permissions': current_permissions()}
 
 # Создание таблиц базы данных и ролей/пользователей
 def create_app():
@@ -81,7 +176,9 @@ def create_app():
                 'edit_user': True,
                 'delete_user': True,
                 'view_user': True,
-                'visit_logs': True,
+                'visit_log': True,
+                'page_visits': True,
+                'user_visits': True,
                 'view_self': True,
                 'edit_self': True
             })
@@ -96,7 +193,7 @@ def create_app():
             user_role.set_permissions({
                 'view_self': True,
                 'edit_self': True,
-                'visit_logs': True
+                'visit_log': True
             })
             db.session.add(user_role)
             print("Роль Пользователь создана")
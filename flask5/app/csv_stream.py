@@ -0,0 +1,51 @@
+# csv_stream.py
+import csv
+import io
+import zlib
+
+from flask import Response, stream_with_context
+
+# Сколько строк накапливать перед отправкой очередного фрагмента
+ROWS_PER_CHUNK = 500
+
+
+def iter_csv(header, rows):
+    """Построчно превращает данные в CSV, отдавая текст фрагментами."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter=';', quoting=csv.QUOTE_MINIMAL)
+    writer.writerow(header)
+    for number, row in enumerate(rows, start=1):
+        writer.writerow(row)
+        if number % ROWS_PER_CHUNK == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def _gzip(chunks):
+    # wbits=31 - формат gzip (заголовок и контрольная сумма)
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def stream_csv(filename, header, rows, compress=False):
+    """Ответ с CSV, который формируется по мере чтения строк из базы.
+
+    rows - итератор (например, запрос с yield_per), целиком в память он не загружается.
+    """
+    chunks = iter_csv(header, rows)
+    if compress:
+        body = _gzip(chunks)
+        mimetype = 'application/gzip'
+        filename += '.gz'
+    else:
+        body = (chunk.encode('utf-8') for chunk in chunks)
+        mimetype = 'text/csv'
+    response = Response(stream_with_context(body), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename={filename}'
+    return response
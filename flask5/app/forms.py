@@ -1,7 +1,7 @@
 from flask_wtf import FlaskForm
 from wtforms import StringField, PasswordField, SubmitField, SelectField
 from wtforms.validators import DataRequired, Length, EqualTo, ValidationError, Regexp
-from models import Role
+from permissions import assignable_roles, current_permissions
 import re
 
 def validate_login(form, field):
@@ -43,8 +43,8 @@ class RegistrationForm(FlaskForm):
 
     def __init__(self, *args, **kwargs):
         super(RegistrationForm, self).__init__(*args, **kwargs)
-        # Заполняем choices для SelectField ролями из базы данных
-        self.role.choices = [(role.id, role.name) for role in Role.query.all()]
+        # Заполняем choices для SelectField ролями, которые текущий пользователь может назначить
+        self.role.choices = assignable_roles(current_permissions())
 
 
 class LoginForm(FlaskForm):
@@ -62,7 +62,8 @@ class EditUserForm(FlaskForm):
 
     def __init__(self, *args, **kwargs):
         super(EditUserForm, self).__init__(*args, **kwargs)
-        self.role.choices = [(role.id, role.name) for role in Role.query.all()]
+        user = kwargs.get('obj')
+        self.role.choices = assignable_roles(current_permissions(), keep_role_id=user.role_id if user else None)
 
 
 class ChangePasswordForm(FlaskForm):
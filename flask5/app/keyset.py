@@ -0,0 +1,96 @@
+# keyset.py
+import base64
+import collections
+import datetime
+import time
+
+from models import VisitLog, db
+
+# Кэш количества записей: ключ -> (время вычисления, значение); давно не нужные ключи вытесняются
+_count_cache = collections.OrderedDict()
+COUNT_CACHE_SIZE = 1000
+
+
+def encode_cursor(visit, position):
+    """Непрозрачный токен позиции: (created_at, id) записи и ее порядковый номер."""
+    raw = f'{visit.created_at.isoformat()}|{visit.id}|{position}'
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token):
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode('utf-8')
+        created_at, visit_id, position = raw.split('|')
+        return datetime.datetime.fromisoformat(created_at), int(visit_id), int(position)
+    except ValueError:
+        return None
+
+
+class KeysetPage:
+    """Страница журнала, выбранная по ключу (created_at, id) без OFFSET."""
+
+    def __init__(self, items, start, has_next, has_prev):
+        self.items = items
+        self.start = start  # Порядковый номер первой записи
+        self.has_next = has_next and bool(items)
+        self.has_prev = has_prev and bool(items)
+        self.next_token = encode_cursor(items[-1], start + len(items)) if self.has_next else None
+        self.prev_token = encode_cursor(items[0], start - 1) if self.has_prev else None
+
+    def enumerated(self):
+        return enumerate(self.items, start=self.start)
+
+
+def keyset_paginate(query, per_page, after=None, before=None):
+    """Страница записей по убыванию (created_at, id).
+
+    after - токен последней записи предыдущей страницы (движение вперед),
+    before - токен первой записи следующей страницы (движение назад).
+    """
+    key = db.tuple_(VisitLog.created_at, VisitLog.id)
+    query = query.filter(VisitLog.created_at.isnot(None))
+    after, before = decode_cursor(after), decode_cursor(before)
+
+    if before:
+        created_at, visit_id, position = before
+        rows = query.filter(key > db.tuple_(created_at, visit_id)) \
+            .order_by(VisitLog.created_at.asc(), VisitLog.id.asc()) \
+            .limit(per_page + 1).all()
+        has_prev = len(rows) > per_page
+        items = rows[:per_page][::-1]
+        return KeysetPage(items, max(position - len(items) + 1, 1), has_next=True, has_prev=has_prev)
+
+    start = 1
+    if after:
+        created_at, visit_id, start = after
+        query = query.filter(key < db.tuple_(created_at, visit_id))
+    rows = query.order_by(VisitLog.created_at.desc(), VisitLog.id.desc()).limit(per_page + 1).all()
+    return KeysetPage(rows[:per_page], start, has_next=len(rows) > per_page, has_prev=after is not None)
+
+
+def visit_total(query, cache_key, mode, ttl=60):
+    """Число записей для подписи под журналом.
+
+    mode: 'exact' - COUNT(*) на каждый запрос, 'cached' - COUNT(*) не чаще раза в ttl секунд,
+    'estimate' - по максимальному id (только для всего журнала), 'none' - не считать.
+    """
+    if mode == 'none':
+        return None
+    if mode == 'estimate' and cache_key == 'all':
+        return db.session.query(db.func.max(VisitLog.id)).scalar() or 0
+    if mode == 'exact':
+        return query.count()
+
+    now = time.monotonic()
+    cached = _count_cache.get(cache_key)
+    if cached and now - cached[0] < ttl:
+        _count_cache.move_to_end(cache_key)
+        return cached[1]
+    total = query.count()
+    _count_cache[cache_key] = (now, total)
+    _count_cache.move_to_end(cache_key)
+    while len(_count_cache) > COUNT_CACHE_SIZE:
+        _count_cache.popitem(last=False)
+    return total
@@ -0,0 +1,128 @@
+"""visit path dictionary
+
+Revision ID: 2a9e5c3f8b16
+Revises: f4c07b8d2a61
+Create Date: 2026-10-18 15:02:47.611534
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2a9e5c3f8b16'
+down_revision = 'f4c07b8d2a61'
+branch_labels = None
+depends_on = None
+
+# Строк журнала, получающих path_id за один UPDATE
+BATCH_SIZE = 10000
+
+LATENCY_COLUMNS = 'hour, count, total_ms, total_queries, errors, histogram'
+
+
+def _fill_in_batches(statement):
+    """Выполняет UPDATE по диапазонам id, чтобы не держать одну огромную транзакцию."""
+    bind = op.get_bind()
+    max_id = bind.execute(sa.text('SELECT max(id) FROM visit_log')).scalar() or 0
+    for start in range(0, max_id, BATCH_SIZE):
+        bind.execute(sa.text(statement), {'start': start, 'end': start + BATCH_SIZE})
+
+
+def _rollup_columns(key):
+    return [key,
+            sa.Column('hour', sa.DateTime(), nullable=False),
+            sa.Column('count', sa.Integer(), nullable=False)]
+
+
+def _latency_columns(key):
+    return [key,
+            sa.Column('hour', sa.DateTime(), nullable=False),
+            sa.Column('count', sa.Integer(), nullable=False),
+            sa.Column('total_ms', sa.Float(), nullable=False),
+            sa.Column('total_queries', sa.Integer(), nullable=False),
+            sa.Column('errors', sa.Integer(), nullable=False),
+            sa.Column('histogram', sa.LargeBinary(), nullable=False)]
+
+
+def _replace_table(name, columns, primary_key, insert_select, index):
+    """Пересоздает таблицу агрегатов с новым ключом, копируя данные через INSERT ... SELECT."""
+    op.create_table(f'{name}_new', *columns, sa.PrimaryKeyConstraint(*primary_key))
+    op.execute(f'INSERT INTO {name}_new {insert_select}')
+    with op.batch_alter_table(name, schema=None) as batch_op:
+        batch_op.drop_index(index)
+    op.drop_table(name)
+    op.rename_table(f'{name}_new', name)
+    with op.batch_alter_table(name, schema=None) as batch_op:
+        batch_op.create_index(index, ['hour'], unique=False)
+
+
+def upgrade():
+    op.create_table('visit_path',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('path', sa.String(length=100), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('path')
+    )
+
+    # Словарь заполняется всеми путями из журнала и агрегатов
+    op.execute('INSERT INTO visit_path (path) '
+               'SELECT path FROM visit_log WHERE path IS NOT NULL '
+               'UNION SELECT path FROM page_visit_rollup '
+               'UNION SELECT path FROM page_latency_rollup')
+
+    with op.batch_alter_table('visit_log', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('path_id', sa.Integer(), nullable=True))
+
+    _fill_in_batches('UPDATE visit_log SET path_id = '
+                     '(SELECT id FROM visit_path WHERE visit_path.path = visit_log.path) '
+                     'WHERE id > :start AND id <= :end')
+
+    with op.batch_alter_table('visit_log', schema=None) as batch_op:
+        batch_op.drop_index('ix_visit_log_path')
+        batch_op.drop_column('path')
+        batch_op.create_index(batch_op.f('ix_visit_log_path_id'), ['path_id'], unique=False)
+        batch_op.create_foreign_key('fk_visit_log_path_id_visit_path', 'visit_path', ['path_id'], ['id'])
+
+    _replace_table('page_visit_rollup',
+                   _rollup_columns(sa.Column('path_id', sa.Integer(), sa.ForeignKey('visit_path.id'), nullable=False)),
+                   ['path_id', 'hour'],
+                   'SELECT visit_path.id, hour, count FROM page_visit_rollup '
+                   'JOIN visit_path ON visit_path.path = page_visit_rollup.path',
+                   'ix_page_visit_rollup_hour')
+    _replace_table('page_latency_rollup',
+                   _latency_columns(sa.Column('path_id', sa.Integer(), sa.ForeignKey('visit_path.id'), nullable=False)),
+                   ['path_id', 'hour'],
+                   f'SELECT visit_path.id, {LATENCY_COLUMNS} FROM page_latency_rollup '
+                   'JOIN visit_path ON visit_path.path = page_latency_rollup.path',
+                   'ix_page_latency_rollup_hour')
+
+
+def downgrade():
+    _replace_table('page_latency_rollup',
+                   _latency_columns(sa.Column('path', sa.String(length=100), nullable=False)),
+                   ['path', 'hour'],
+                   f'SELECT visit_path.path, {LATENCY_COLUMNS} FROM page_latency_rollup '
+                   'JOIN visit_path ON visit_path.id = page_latency_rollup.path_id',
+                   'ix_page_latency_rollup_hour')
+    _replace_table('page_visit_rollup',
+                   _rollup_columns(sa.Column('path', sa.String(length=100), nullable=False)),
+                   ['path', 'hour'],
+                   'SELECT visit_path.path, hour, count FROM page_visit_rollup '
+                   'JOIN visit_path ON visit_path.id = page_visit_rollup.path_id',
+                   'ix_page_visit_rollup_hour')
+
+    with op.batch_alter_table('visit_log', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('path', sa.String(length=100), nullable=True))
+
+    _fill_in_batches('UPDATE visit_log SET path = '
+                     '(SELECT path FROM visit_path WHERE visit_path.id = visit_log.path_id) '
+                     'WHERE id > :start AND id <= :end')
+
+    with op.batch_alter_table('visit_log', schema=None) as batch_op:
+        batch_op.drop_constraint('fk_visit_log_path_id_visit_path', type_='foreignkey')
+        batch_op.drop_index(batch_op.f('ix_visit_log_path_id'))
+        batch_op.drop_column('path_id')
+        batch_op.create_index(batch_op.f('ix_visit_log_path'), ['path'], unique=False)
+
+    op.drop_table('visit_path')
@@ -0,0 +1,33 @@
+"""widen user password_hash
+
+Revision ID: 4d7f2a8c6e19
+Revises: c6e1d4a9b270
+Create Date: 2026-10-18 19:48:05.772013
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4d7f2a8c6e19'
+down_revision = 'c6e1d4a9b270'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Хеш scrypt с параметрами длиннее 120 символов
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.alter_column('password_hash',
+               existing_type=sa.String(length=120),
+               type_=sa.String(length=255),
+               existing_nullable=False)
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.alter_column('password_hash',
+               existing_type=sa.String(length=255),
+               type_=sa.String(length=120),
+               existing_nullable=False)
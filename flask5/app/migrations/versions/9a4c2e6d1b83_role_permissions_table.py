@@ -0,0 +1,59 @@
+"""role permissions table
+
+Revision ID: 9a4c2e6d1b83
+Revises: 7e3b9f2c4a10
+Create Date: 2026-10-18 18:31:52.067419
+
+"""
+import json
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9a4c2e6d1b83'
+down_revision = '7e3b9f2c4a10'
+branch_labels = None
+depends_on = None
+
+# Старые ключи JSON, которые в разных версиях create_app означали одно право
+ALIASES = {'view_logs': 'visit_log', 'visit_logs': 'visit_log'}
+
+role = sa.table('role', sa.column('id', sa.Integer), sa.column('permissions', sa.Text))
+role_permissions = sa.table('role_permissions', sa.column('role_id', sa.Integer), sa.column('permission', sa.String))
+
+
+def upgrade():
+    op.create_table('role_permissions',
+    sa.Column('role_id', sa.Integer(), nullable=False),
+    sa.Column('permission', sa.String(length=50), nullable=False),
+    sa.ForeignKeyConstraint(['role_id'], ['role.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('role_id', 'permission')
+    )
+
+    bind = op.get_bind()
+    rows = []
+    for role_id, permissions in bind.execute(sa.select(role.c.id, role.c.permissions)):
+        names = {ALIASES.get(name, name) for name, allowed in json.loads(permissions or '{}').items() if allowed}
+        rows += [{'role_id': role_id, 'permission': name} for name in sorted(names)]
+    if rows:
+        op.bulk_insert(role_permissions, rows)
+
+    with op.batch_alter_table('role', schema=None) as batch_op:
+        batch_op.drop_column('permissions')
+
+
+def downgrade():
+    with op.batch_alter_table('role', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('permissions', sa.Text(), nullable=True))
+
+    bind = op.get_bind()
+    permissions = {}
+    for role_id, name in bind.execute(sa.select(role_permissions.c.role_id, role_permissions.c.permission)):
+        permissions.setdefault(role_id, {})[name] = True
+    for role_id, in bind.execute(sa.select(role.c.id)):
+        bind.execute(role.update().where(role.c.id == role_id)
+                     .values(permissions=json.dumps(permissions.get(role_id, {}))))
+
+    op.drop_table('role_permissions')
@@ -0,0 +1,56 @@
+"""user search columns
+
+Revision ID: c6e1d4a9b270
+Revises: 9a4c2e6d1b83
+Create Date: 2026-10-18 19:12:40.318215
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c6e1d4a9b270'
+down_revision = '9a4c2e6d1b83'
+branch_labels = None
+depends_on = None
+
+FOLDED_COLUMNS = (('login', 'login_folded'), ('last_name', 'last_name_folded'), ('first_name', 'first_name_folded'))
+FTS_COLUMNS = ('login', 'last_name', 'first_name', 'middle_name')
+
+user = sa.table('user', sa.column('id', sa.Integer), *[sa.column(name, sa.String) for pair in FOLDED_COLUMNS for name in pair])
+
+
+def fts5_available(bind):
+    if bind.dialect.name != 'sqlite':
+        return False
+    return 'ENABLE_FTS5' in {row[0] for row in bind.exec_driver_sql('PRAGMA compile_options')}
+
+
+def upgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        for _, folded in FOLDED_COLUMNS:
+            batch_op.add_column(sa.Column(folded, sa.String(length=80), nullable=True))
+            batch_op.create_index(batch_op.f(f'ix_user_{folded}'), [folded], unique=False)
+
+    # casefold в Python: lower() в SQLite не меняет регистр кириллицы
+    bind = op.get_bind()
+    for row in bind.execute(sa.select(user)).mappings().all():
+        bind.execute(user.update().where(user.c.id == row['id'])
+                     .values({folded: (row[column] or '').casefold() for column, folded in FOLDED_COLUMNS}))
+
+    if fts5_available(bind):
+        op.execute(f'CREATE VIRTUAL TABLE IF NOT EXISTS user_fts USING fts5({", ".join(FTS_COLUMNS)}, '
+                   f'tokenize = "unicode61 remove_diacritics 2", prefix = \'2 3\')')
+        values = ', '.join(f"coalesce({column}, '')" for column in FTS_COLUMNS)
+        op.execute(f'INSERT INTO user_fts (rowid, {", ".join(FTS_COLUMNS)}) SELECT id, {values} FROM user')
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'sqlite':
+        op.execute('DROP TABLE IF EXISTS user_fts')
+
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        for _, folded in reversed(FOLDED_COLUMNS):
+            batch_op.drop_index(batch_op.f(f'ix_user_{folded}'))
+            batch_op.drop_column(folded)
@@ -1,23 +1,81 @@
 # models.py
 from flask_sqlalchemy import SQLAlchemy
-from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import UserMixin
-import json
+from sqlalchemy.ext.hybrid import hybrid_property
 import datetime
 
+from passwords import password_hasher
+
 db = SQLAlchemy()
 
+# Реестр прав: у каждого права свой бит в маске роли
+PERMISSIONS = (
+    'create_user',
+    'edit_user',
+    'delete_user',
+    'view_user',
+    'view_self',
+    'edit_self',
+    'visit_log',
+    'page_visits',
+    'user_visits',
+)
+PERMISSION_BITS = {name: 1 << index for index, name in enumerate(PERMISSIONS)}
+ALL_PERMISSIONS = (1 << len(PERMISSIONS)) - 1
+# Старые названия прав из ранних версий create_app
+PERMISSION_ALIASES = {'view_logs': 'visit_log', 'visit_logs': 'visit_log'}
+
+
+def permission_name(name):
+    """Каноническое имя права; неизвестное имя - ошибка."""
+    name = PERMISSION_ALIASES.get(name, name)
+    if name not in PERMISSION_BITS:
+        raise ValueError(f'Неизвестное право: {name}')
+    return name
+
+
+def permission_bit(name):
+    return PERMISSION_BITS[permission_name(name)]
+
+
+class RolePermission(db.Model):
+    __tablename__ = 'role_permissions'
+    role_id = db.Column(db.Integer, db.ForeignKey('role.id', ondelete='CASCADE'), primary_key=True)
+    permission = db.Column(db.String(50), primary_key=True)
+
+    def __repr__(self):
+        return f'<RolePermission {self.role_id} {self.permission}>'
+
 class Role(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(80), unique=True, nullable=False)
     description = db.Column(db.String(255))
-    permissions = db.Column(db.Text, default='{}')
+    # Растет при каждом изменении прав, по ней сбрасывается кэш разобранных прав
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    permission_rows = db.relationship('RolePermission', cascade='all, delete-orphan', lazy=True)
 
     def set_permissions(self, permissions):
-        self.permissions = json.dumps(permissions)
+        """permissions - словарь {право: bool} или список названий прав."""
+        if isinstance(permissions, dict):
+            permissions = [name for name, allowed in permissions.items() if allowed]
+        names = {permission_name(name) for name in permissions}
+        # Строки остальных прав не трогаем, чтобы не удалять и не вставлять их заново
+        self.permission_rows = [row for row in self.permission_rows if row.permission in names] + \
+            [RolePermission(permission=name) for name in sorted(names - self.permission_names())]
+        self.version = (self.version or 0) + 1
+
+    def permission_names(self):
+        return {row.permission for row in self.permission_rows}
 
     def get_permissions(self):
-        return json.loads(self.permissions)
+        return {name: True for name in self.permission_names()}
+
+    def permission_mask(self):
+        """Права роли одним числом: OR битов из PERMISSION_BITS."""
+        mask = 0
+        for name in self.permission_names():
+            mask |= PERMISSION_BITS.get(name, 0)
+        return mask
 
     def __repr__(self):
         return f'<Role {self.name}>'
@@ -25,18 +83,28 @@ class Role(db.Model):
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     login = db.Column(db.String(80), unique=True, nullable=False)
-    password_hash = db.Column(db.String(120), nullable=False)
+    password_hash = db.Column(db.String(255), nullable=False)
     first_name = db.Column(db.String(80))
     last_name = db.Column(db.String(80))
     middle_name = db.Column(db.String(80))
     role_id = db.Column(db.Integer, db.ForeignKey('role.id'))
     role = db.relationship('Role', backref=db.backref('users', lazy=True))
+    # Логин и имя в casefold для поиска по префиксу, заполняются в user_search.py
+    login_folded = db.Column(db.String(80), index=True)
+    last_name_folded = db.Column(db.String(80), index=True)
+    first_name_folded = db.Column(db.String(80), index=True)
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = password_hasher.hash(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        if not password_hasher.verify(self.password_hash, password):
+            return False
+        # Хеш со старыми параметрами пересчитывается при успешной проверке, сохраняет вызывающий код
+        if password_hasher.needs_rehash(self.password_hash):
+            self.set_password(password)
+            password_hasher.rehashed += 1
+        return True
 
     def get_full_name(self):
         return f"{self.last_name} {self.first_name} {self.middle_name}"
@@ -59,12 +127,97 @@ class User(UserMixin, db.Model):
     def get_id(self):
         return str(self.id)
 
+class VisitPath(db.Model):
+    """Словарь путей: в журнале и агрегатах хранится только целочисленный id."""
+    id = db.Column(db.Integer, primary_key=True)
+    path = db.Column(db.String(100), unique=True, nullable=False)
+
+    def __repr__(self):
+        return f'<VisitPath {self.id} {self.path}>'
+
 class VisitLog(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     user = db.relationship('User', backref=db.backref('visits', lazy=True))
     created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow, index=True)
-    path = db.Column(db.String(100), index=True)
+    path_id = db.Column(db.Integer, db.ForeignKey('visit_path.id'), index=True)
+    path_ref = db.relationship('VisitPath')
+    # Сколько посещений представляет запись при выборочном журналировании
+    weight = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    # Время обработки запроса на сервере, код ответа и число запросов к базе
+    duration_ms = db.Column(db.Float)
+    status_code = db.Column(db.Integer)
+    query_count = db.Column(db.Integer)
+
+    # Журнал пользователя: фильтр по user_id и обход по времени одним индексом
+    __table_args__ = (db.Index('ix_visit_log_user_id_created_at', 'user_id', 'created_at'),)
+
+    @hybrid_property
+    def path(self):
+        return self.path_ref.path if self.path_ref else None
+
+    @path.inplace.expression
+    @classmethod
+    def _path_expression(cls):
+        return db.select(VisitPath.path).where(VisitPath.id == cls.path_id).scalar_subquery()
+
+    def __repr__(self):
+        return f'<VisitLog {self.created_at} {self.path}>'
+
+class PageVisitRollup(db.Model):
+    """Количество посещений страницы за час."""
+    path_id = db.Column(db.Integer, db.ForeignKey('visit_path.id'), primary_key=True)
+    hour = db.Column(db.DateTime, primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    # Выборка по диапазону дат без учета страницы
+    __table_args__ = (db.Index('ix_page_visit_rollup_hour', 'hour'),)
+
+    def __repr__(self):
+        return f'<PageVisitRollup {self.hour} {self.path_id} {self.count}>'
+
+
+class UserVisitRollup(db.Model):
+    """Количество посещений пользователя за час."""
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    hour = db.Column(db.DateTime, primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<UserVisitRollup {self.hour} {self.user_id} {self.count}>'
+
+
+class PageLatencyRollup(db.Model):
+    """Гистограмма времени ответа страницы за час."""
+    path_id = db.Column(db.Integer, db.ForeignKey('visit_path.id'), primary_key=True)
+    hour = db.Column(db.DateTime, primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    total_ms = db.Column(db.Float, nullable=False, default=0.0)
+    total_queries = db.Column(db.Integer, nullable=False, default=0)
+    errors = db.Column(db.Integer, nullable=False, default=0)  # Ответы с кодом 5xx
+    histogram = db.Column(db.LargeBinary, nullable=False)  # Счетчики корзин LatencyHistogram
+
+    __table_args__ = (db.Index('ix_page_latency_rollup_hour', 'hour'),)
+
+    def __repr__(self):
+        return f'<PageLatencyRollup {self.hour} {self.path_id} {self.count}>'
+
+
+class VisitSketch(db.Model):
+    """Сериализованный вероятностный счетчик посещений за день."""
+    kind = db.Column(db.String(8), primary_key=True)  # hll, cms или topk
+    key = db.Column(db.String(100), primary_key=True)  # Путь для hll, иначе пустая строка
+    day = db.Column(db.String(10), primary_key=True)  # ГГГГ-ММ-ДД (UTC)
+    data = db.Column(db.LargeBinary, nullable=False)
+
+    def __repr__(self):
+        return f'<VisitSketch {self.kind} {self.day} {self.key}>'
+
+class VisitSpoolCheckpoint(db.Model):
+    """Сколько байт файла-сегмента спула уже загружено в журнал посещений."""
+    segment = db.Column(db.String(100), primary_key=True)  # Имя файла сегмента
+    offset = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
 
     def __repr__(self):
-        return f'<VisitLog {self.created_at} {self.path}>'
\ No newline at end of file
+        return f'<VisitSpoolCheckpoint {self.segment} {self.offset}>'
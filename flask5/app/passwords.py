@@ -0,0 +1,195 @@
+# passwords.py
+import concurrent.futures
+import os
+import statistics
+import threading
+import time
+
+import click
+from flask import current_app, has_app_context
+from flask.cli import with_appcontext
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, check_password_hash, generate_password_hash
+
+# Параметры werkzeug по умолчанию для коротких названий метода
+_DEFAULT_METHODS = {
+    'scrypt': 'scrypt:32768:8:1',
+    'pbkdf2': f'pbkdf2:sha256:{DEFAULT_PBKDF2_ITERATIONS}',
+    'pbkdf2:sha256': f'pbkdf2:sha256:{DEFAULT_PBKDF2_ITERATIONS}',
+}
+
+
+class PasswordHasherBusy(Exception):
+    """Очередь хеширования заполнена: запрос лучше повторить позже, чем ждать."""
+
+
+def normalize_method(method):
+    """Метод с явными параметрами, как он записывается в начало хеша."""
+    return _DEFAULT_METHODS.get(method, method)
+
+
+def hash_method(password_hash):
+    """Метод и параметры, с которыми посчитан хеш (часть до первого $)."""
+    return (password_hash or '').split('$', 1)[0]
+
+
+class PasswordHasher:
+    """Хеширование и проверка паролей в отдельном пуле.
+
+    Медленная функция хеширования не занимает поток запроса: он только ждет
+    результат. Пул ограничен PASSWORD_HASH_WORKERS потоками (или процессами),
+    очередь - PASSWORD_HASH_QUEUE заданиями; при переполнении запрос получает
+    503 вместо бесконечного ожидания. hashlib отпускает GIL на время scrypt и
+    pbkdf2, поэтому потоков обычно достаточно.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+        self._slots = None
+        self.hashed = 0
+        self.verified = 0
+        self.rehashed = 0
+        self.rejected = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+        app.config.setdefault('PASSWORD_HASH_SALT_LENGTH', 16)
+        app.config.setdefault('PASSWORD_HASH_POOL', 'thread')  # thread, process или inline (без пула)
+        app.config.setdefault('PASSWORD_HASH_WORKERS', min(4, os.cpu_count() or 1))
+        app.config.setdefault('PASSWORD_HASH_QUEUE', 32)  # Заданий сверх числа воркеров
+        app.config.setdefault('PASSWORD_HASH_QUEUE_TIMEOUT', 2.0)  # Секунд ожидания места в очереди
+        self.app = app
+        self._slots = threading.BoundedSemaphore(app.config['PASSWORD_HASH_WORKERS'] + app.config['PASSWORD_HASH_QUEUE'])
+        app.extensions['password_hasher'] = self
+        app.register_error_handler(PasswordHasherBusy, self._busy)
+
+    @property
+    def config(self):
+        if has_app_context():
+            return current_app.config
+        if self.app is not None:
+            return self.app.config
+        return {}
+
+    @property
+    def method(self):
+        return normalize_method(self.config.get('PASSWORD_HASH_METHOD', 'scrypt'))
+
+    def hash(self, password):
+        self.hashed += 1
+        return self._run(generate_password_hash, password, self.method, self.config.get('PASSWORD_HASH_SALT_LENGTH', 16))
+
+    def verify(self, password_hash, password):
+        self.verified += 1
+        return self._run(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        """Посчитан ли хеш с параметрами, отличными от текущих."""
+        return hash_method(password_hash) != self.method
+
+    def stats(self):
+        return {'method': self.method, 'pool': self.config.get('PASSWORD_HASH_POOL', 'inline'),
+                'hashed': self.hashed, 'verified': self.verified,
+                'rehashed': self.rehashed, 'rejected': self.rejected}
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def _run(self, func, *args):
+        executor = self._get_executor()
+        if executor is None:
+            return func(*args)
+        if not self._slots.acquire(timeout=self.config['PASSWORD_HASH_QUEUE_TIMEOUT']):
+            self.rejected += 1
+            raise PasswordHasherBusy()
+        try:
+            future = executor.submit(func, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future.result()
+
+    def _get_executor(self):
+        pool = self.config.get('PASSWORD_HASH_POOL', 'inline')
+        if pool == 'inline' or self.app is None:
+            return None
+        # После fork пул родителя не работает: у каждого процесса свой
+        if self._executor is None or self._pid != os.getpid():
+            with self._lock:
+                if self._executor is None or self._pid != os.getpid():
+                    workers = self.config['PASSWORD_HASH_WORKERS']
+                    if pool == 'process':
+                        self._executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+                    else:
+                        self._executor = concurrent.futures.ThreadPoolExecutor(
+                            max_workers=workers, thread_name_prefix='password-hash')
+                    self._pid = os.getpid()
+        return self._executor
+
+    def _busy(self, error):
+        return 'Слишком много одновременных входов. Повторите попытку через несколько секунд.', 503, {'Retry-After': '2'}
+
+
+password_hasher = PasswordHasher()
+
+
+def _measure(method, rounds):
+    timings = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        generate_password_hash('calibration-password', method)
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+# Память scrypt при наименьшем проверяемом n = 2**14 и r = 8
+SCRYPT_MIN_MEMORY_MB = 16
+
+
+def calibrate(target_ms, algorithm='scrypt', max_memory_mb=64, rounds=3):
+    """Самые сильные параметры, при которых хеширование укладывается в target_ms.
+
+    Возвращает (метод, миллисекунд на хеш).
+    """
+    if algorithm == 'pbkdf2':
+        # Время pbkdf2 линейно зависит от числа итераций
+        sample = 100_000
+        elapsed = _measure(f'pbkdf2:sha256:{sample}', rounds)
+        iterations = max(int(sample * target_ms / elapsed) // 10_000 * 10_000, 10_000)
+        method = f'pbkdf2:sha256:{iterations}'
+        return method, _measure(method, rounds)
+
+    # scrypt: n - степень двойки, память 128 * n * r байт
+    if max_memory_mb < SCRYPT_MIN_MEMORY_MB:
+        raise ValueError(f'scrypt требует не меньше {SCRYPT_MIN_MEMORY_MB} МБ на хеш')
+    best = None
+    n = 2 ** 14
+    while 128 * n * 8 <= max_memory_mb * 1024 * 1024:
+        method = f'scrypt:{n}:8:1'
+        elapsed = _measure(method, rounds)
+        if best is not None and elapsed > target_ms:
+            break
+        best = (method, elapsed)
+        n *= 2
+    return best
+
+
+@click.command('calibrate-password-hash')
+@click.option('--target-ms', default=250, show_default=True, help='Желаемое время одного хеширования.')
+@click.option('--algorithm', type=click.Choice(['scrypt', 'pbkdf2']), default='scrypt', show_default=True)
+@click.option('--max-memory-mb', default=64, show_default=True, type=click.IntRange(min=SCRYPT_MIN_MEMORY_MB),
+              help='Предел памяти scrypt на один хеш.')
+@with_appcontext
+def calibrate_password_hash_command(target_ms, algorithm, max_memory_mb):
+    """Подбирает параметры хеширования паролей под текущее железо."""
+    method, elapsed = calibrate(target_ms, algorithm, max_memory_mb)
+    click.echo(f'{method}: {elapsed:.0f} мс на хеш (сейчас {password_hasher.method})')
+    click.echo(f'PASSWORD_HASH_METHOD={method}')
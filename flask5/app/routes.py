@@ -1,10 +1,14 @@
 # routes.py
-from flask import Blueprint, render_template, request, session, redirect, url_for, flash, send_file
+from flask import Blueprint, render_template, request, session, redirect, url_for, flash, send_file, jsonify
 from forms import LoginForm, RegistrationForm, EditUserForm, ChangePasswordForm
-from models import db, User, Role, VisitLog
-from werkzeug.security import generate_password_hash, check_password_hash
+from models import db, User, Role, VisitLog, permission_bit
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
 from functools import wraps
+from sqlalchemy.orm import joinedload, load_only
+from permissions import NO_PERMISSIONS, current_permissions, invalidate_permissions
+from user_search import search_users
+from passwords import password_hasher
+from login_limiter import login_limiter
 import json
 from datetime import datetime
 from collections import Counter
@@ -13,22 +17,56 @@ import io
 
 routes_bp = Blueprint('routes', __name__)
 
+# Пользователей на одной странице списка
+USERS_PER_PAGE = 20
+
+
+def user_directory(page):
+    """Страница списка пользователей: только нужные столбцы, роли - тем же запросом."""
+    query = User.query.options(
+        load_only(User.id, User.first_name, User.last_name, User.middle_name, User.role_id),
+        joinedload(User.role).load_only(Role.name),
+    ).order_by(User.id)
+    pagination = query.paginate(page=page, per_page=USERS_PER_PAGE, error_out=False, count=False)
+    counts = role_counts()
+    # Общее число - сумма по ролям, отдельный COUNT(*) не нужен
+    pagination.total = sum(count for _, count in counts)
+    return pagination, counts
+
+
+def role_counts():
+    """Число пользователей по ролям одним агрегатным запросом; None - пользователи без роли."""
+    total = db.func.count(User.id)
+    return db.session.query(Role.name, total).select_from(User) \
+        .outerjoin(Role, Role.id == User.role_id) \
+        .group_by(Role.name).order_by(total.desc()).all()
+
+
+def user_listing():
+    """Данные для списка пользователей: результаты поиска (?q=) или страница каталога (?page=)."""
+    query = request.args.get('q', '').strip()
+    if query:
+        return dict(users=search_users(query), pagination=None, role_counts=role_counts(), query=query)
+    pagination, counts = user_directory(request.args.get('page', 1, type=int))
+    return dict(users=pagination.items, pagination=pagination, role_counts=counts, query='')
+
 def check_rights(permission):
+    required = permission_bit(permission)  # Неизвестное право - ошибка уже при импорте модуля
+
     def decorator(f):
         @wraps(f)
         def decorated_function(*args, **kwargs):
             if current_user.is_authenticated:
-                user = User.query.get(current_user.get_id())
-                role = Role.query.get(user.role_id)
-                if role:
-                    permissions = role.get_permissions()
+                # Пользователь и роль уже загружены в load_user, права берутся из кэша
+                access = current_permissions()
+                if access:
                     # Если пользователь - администратор, разрешаем доступ
-                    if role.name == 'Администратор':
+                    if access.is_admin:
                         return f(*args, **kwargs)
                     # Если user_id текущего пользователя совпадает с user_id в запросе, разрешаем доступ
-                    if 'user_id' in kwargs and str(user.id) == kwargs['user_id']:
+                    if 'user_id' in kwargs and str(current_user.id) == kwargs['user_id']:
                         return f(*args, **kwargs)
-                    if permission in permissions and permissions[permission]:
+                    if access.mask & required:
                         return f(*args, **kwargs)
                     else:
                         flash('У вас нет прав для просмотра этой страницы.', 'danger')
@@ -47,13 +85,14 @@ def check_rights(permission):
 
 @routes_bp.route('/')
 def index():
+    directory = user_listing()
     if current_user.is_authenticated:
-        role = Role.query.get(current_user.role_id)
-        if role and role.name == 'Администратор':
-            return render_template('index.html', users=User.query.all(), current_user_permissions=role.get_permissions(), current_user_id=current_user.id, current_user=current_user)
-        elif role and role.name == 'Пользователь':
-            return render_template('index.html', users=User.query.all(), current_user_permissions={}, current_user_id=current_user.id, current_user=current_user)
-    return render_template('index.html', users=User.query.all(), current_user_permissions={}, current_user_id=None, current_user=current_user)
+        access = current_permissions()
+        if access and access.is_admin:
+            return render_template('index.html', current_user_permissions=access, current_user_id=current_user.id, current_user=current_user, **directory)
+        elif access and access.name == 'Пользователь':
+            return render_template('index.html', current_user_permissions=NO_PERMISSIONS, current_user_id=current_user.id, current_user=current_user, **directory)
+    return render_template('index.html', current_user_permissions=NO_PERMISSIONS, current_user_id=None, current_user=current_user, **directory)
 
 
 @routes_bp.route('/login', methods=['GET', 'POST'])
@@ -62,14 +101,24 @@ def login():
         return redirect(url_for('routes.index'))
     form = LoginForm()
     if form.validate_on_submit():
+        # Лимит проверяется до хеширования пароля: перебор не нагружает процессор
+        retry_after = login_limiter.retry_after(form.login.data)
+        if retry_after:
+            flash(f'Слишком много неудачных попыток входа. Повторите через {retry_after} с.', 'danger')
+            return render_template('login.html', title='Sign In', form=form), 429, {'Retry-After': str(retry_after)}
         user = User.query.filter_by(login=form.login.data).first()
         if user and user.check_password(form.password.data):
+            login_limiter.success(form.login.data)
+            session.regenerate()  # Новый sid после входа: старый мог быть известен атакующему
             login_user(user)
+            # check_password мог пересчитать хеш с устаревшими параметрами
+            db.session.commit()
 
             # Записываем в сессию информацию о посещении страницы
             session['last_visited'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
             return redirect(url_for('routes.index'))
+        login_limiter.failure(form.login.data)
         flash('Неверный логин или пароль', 'danger')
     return render_template('login.html', title='Sign In', form=form)
 
@@ -88,7 +137,7 @@ def logout():
 def create_user():
     form = RegistrationForm()
     if form.validate_on_submit():
-        hashed_password = generate_password_hash(form.password.data)
+        hashed_password = password_hasher.hash(form.password.data)
         role = Role.query.get(form.role.data)
         user = User(login=form.login.data, password_hash=hashed_password, first_name=form.first_name.data,
                     last_name=form.last_name.data, middle_name=form.middle_name.data, role=role)
@@ -114,7 +163,7 @@ def edit_user(user_id):
     user = User.query.get(user_id)
     form = EditUserForm(obj=user)
     is_editing_self = str(current_user.id) == user_id  # Проверяем, редактирует ли пользователь свой профиль
-    current_user_role = Role.query.get(current_user.role_id) # Получаем роль текущего пользователя
+    current_user_role = current_permissions() # Получаем роль текущего пользователя
 
     if is_editing_self and current_user_role.name == 'Пользователь':
         # Пользователь редактирует свой профиль и он "Пользователь"
@@ -129,6 +178,8 @@ def edit_user(user_id):
             #Если не редактирует сам или Админ, то меняем роль
             user.role_id = form.role.data
         db.session.commit()
+        # Роль могла смениться: права будут разобраны заново
+        invalidate_permissions()
         flash('Профиль пользователя успешно обновлен!', 'success')
         return redirect(url_for('routes.user_details', user_id=user.id))
 
@@ -161,4 +212,12 @@ def change_password():
             flash('Неверный старый пароль', 'danger')
     return render_template('change_password.html', title='Change Password', form=form)
 
-
+@routes_bp.route('/users/search')
+@login_required
+@check_rights('view_user')
+def search_users_json():
+    """Подсказки для поля поиска: пользователи по началу логина, фамилии или имени."""
+    limit = min(max(request.args.get('limit', 20, type=int), 1), 100)
+    users = search_users(request.args.get('q'), limit=limit)
+    return jsonify([{'id': user.id, 'login': user.login, 'full_name': user.get_full_name(),
+                     'role': user.role.name if user.role else None} for user in users])
@@ -5,38 +5,78 @@ from models import VisitLog, db
 from flask_login import login_required
 from flask import Blueprint, render_template, request, make_response
 from flask_login import login_required, current_user
-import csv
-import io
-from models import VisitLog, db, User
+from models import VisitLog, VisitPath, db, User, PageVisitRollup, UserVisitRollup
+from flask import jsonify
+import datetime
+import itertools
+from visit_writer import visit_writer
+from csv_stream import stream_csv
+from keyset import keyset_paginate, visit_total
+from visit_archive import iter_visits
+from visit_sketches import visit_sketches
+from visit_policy import visit_policy
+from visit_latency import latency_report
+from visit_live import visit_ring
+from flask import current_app, Response
+
+# Размер порции строк, читаемых из базы при выгрузке
+EXPORT_YIELD_PER = 1000
 
 
 reports_bp = Blueprint('reports', __name__, url_prefix='/reports')
 
 
+def get_date_range():
+    """Диапазон дат из параметров date_from/date_to (включительно, ГГГГ-ММ-ДД)."""
+    def parse(name):
+        try:
+            return datetime.datetime.strptime(request.args.get(name, ''), '%Y-%m-%d')
+        except ValueError:
+            return None
+
+    date_from = parse('date_from')
+    date_to = parse('date_to')
+    if date_to:
+        date_to += datetime.timedelta(days=1)  # Последний день входит в отчет целиком
+    return date_from, date_to
+
+
+def date_range_args():
+    """Параметры фильтра для ссылок пагинации и экспорта."""
+    return {name: request.args[name] for name in ('date_from', 'date_to') if request.args.get(name)}
+
+
+def date_filters(column, date_from, date_to):
+    conditions = []
+    if date_from:
+        conditions.append(column >= date_from)
+    if date_to:
+        conditions.append(column < date_to)
+    return conditions
+
+
 @reports_bp.route('/')
 @login_required
 @check_rights('visit_log')
 def visit_log():
-    page = request.args.get('page', 1, type=int)
     per_page = 10
-    visits = VisitLog.query.order_by(VisitLog.created_at.desc()).paginate(page=page, per_page=per_page)
-
-    # Создаем пронумерованный список записей
-    enumerated_visits = enumerate(visits.items, start=(page - 1) * per_page + 1)
-
-    # Передаем оба объекта в шаблон
-    return render_template('reports/visit_log.html', visits=enumerated_visits, pagination=visits)
-
-def export_page_visits_to_csv(data):
-    si = io.StringIO()  # Создаем строковый буфер для записи CSV данных
-    cw = csv.writer(si, delimiter=';', quoting=csv.QUOTE_MINIMAL)  # Создаем CSV writer
-    cw.writerow(['Path', 'Count'])  # Записываем заголовок CSV
-    for row in data:
-        cw.writerow([row.path, row.count])  # Записываем данные в CSV
-    response = make_response(si.getvalue())  # Создаем Response из CSV данных
-    response.headers['Content-Disposition'] = 'attachment; filename=page_visits.csv'  # Устанавливаем заголовок для скачивания файла
-    response.headers['Content-Type'] = 'text/csv'  # Устанавливаем MIME-тип
-    return response
+    # Страницы выбираются по ключу (created_at, id), без OFFSET
+    visits = keyset_paginate(VisitLog.query.options(db.joinedload(VisitLog.user), db.joinedload(VisitLog.path_ref)), per_page,
+                             after=request.args.get('after'), before=request.args.get('before'))
+    total = visit_total(VisitLog.query, 'all', current_app.config['VISIT_LOG_TOTAL'],
+                        current_app.config['VISIT_LOG_TOTAL_TTL'])
+
+    # Передаем пронумерованный список и объект страницы в шаблон
+    return render_template('reports/visit_log.html', visits=visits.enumerated(), pagination=visits, total=total)
+
+def export_compressed():
+    """Нужно ли сжимать выгрузку (параметр gzip=1)."""
+    return bool(request.args.get('gzip'))
+
+def export_page_visits_to_csv(query):
+    # Выгружается весь отчет, строки читаются из базы порциями
+    rows = ([row.path, row.count] for row in query.yield_per(EXPORT_YIELD_PER))
+    return stream_csv('page_visits.csv', ['Path', 'Count'], rows, compress=export_compressed())
 
 @reports_bp.route('/page_visits')
 @login_required
@@ -44,30 +84,33 @@ def export_page_visits_to_csv(data):
 def page_visits():
     page = request.args.get('page', 1, type=int)
     per_page = 10
-    page_visits_data = db.session.query(VisitLog.path, db.func.count(VisitLog.id).label('count')) \
-        .group_by(VisitLog.path) \
-        .order_by(db.func.count(VisitLog.id).desc()) \
-        .paginate(page=page, per_page=per_page)
+    date_from, date_to = get_date_range()
+    # Считаем по часовым агрегатам, а не по всему журналу
+    total = db.func.sum(PageVisitRollup.count)
+    # Группировка по целочисленному id пути, текст пути берется из словаря
+    query = db.session.query(VisitPath.path, total.label('count')) \
+        .join(VisitPath, VisitPath.id == PageVisitRollup.path_id) \
+        .filter(*date_filters(PageVisitRollup.hour, date_from, date_to)) \
+        .group_by(PageVisitRollup.path_id, VisitPath.path) \
+        .order_by(total.desc())
+
+    if request.args.get('export_csv'):
+        return export_page_visits_to_csv(query)
+
+    page_visits_data = query.paginate(page=page, per_page=per_page)
 
     # Создаем пронумерованный список
     enumerated_page_visits = enumerate(page_visits_data.items, start=(page - 1) * per_page + 1)
 
-    if request.args.get('export_csv'):
-        return export_page_visits_to_csv(page_visits_data.items)
-
-    return render_template('reports/page_visits.html', page_visits=enumerated_page_visits, pagination=page_visits_data)  # Передаем и пронумерованный список, и объект пагинации
-
-def export_user_visits_to_csv(data):
-    si = io.StringIO()
-    cw = csv.writer(si, delimiter=';', quoting=csv.QUOTE_MINIMAL)  # Изменено: quoting=csv.QUOTE_MINIMAL
-    cw.writerow(['User', 'Count'])
-    for row in data:
-        user_name = f"{row.first_name} {row.last_name} {row.middle_name}" if row.first_name else "Неаутентифицированный пользователь"
-        cw.writerow([user_name, row.count])
-    response = make_response(si.getvalue())
-    response.headers['Content-Disposition'] = 'attachment; filename=user_visits.csv'
-    response.headers['Content-Type'] = 'text/csv'
-    return response
+    return render_template('reports/page_visits.html', page_visits=enumerated_page_visits, pagination=page_visits_data,
+                           filter_args=date_range_args())  # Передаем и пронумерованный список, и объект пагинации
+
+def export_user_visits_to_csv(query):
+    def rows():
+        for row in query.yield_per(EXPORT_YIELD_PER):
+            user_name = f"{row.first_name} {row.last_name} {row.middle_name}" if row.first_name else "Неаутентифицированный пользователь"
+            yield [user_name, row.count]
+    return stream_csv('user_visits.csv', ['User', 'Count'], rows(), compress=export_compressed())
 
 @reports_bp.route('/user_visits')
 @login_required
@@ -75,26 +118,123 @@ def export_user_visits_to_csv(data):
 def user_visits():
     page = request.args.get('page', 1, type=int)
     per_page = 10
-    user_visits_data = db.session.query(
+    date_from, date_to = get_date_range()
+    total = db.func.coalesce(db.func.sum(UserVisitRollup.count), 0)
+    # Фильтр по датам в условии JOIN, чтобы пользователи без посещений остались в отчете
+    join_on = db.and_(User.id == UserVisitRollup.user_id,
+                      *date_filters(UserVisitRollup.hour, date_from, date_to))
+    query = db.session.query(
         User.id,
         User.first_name,
         User.last_name,
         User.middle_name,
-        db.func.count(VisitLog.id).label('count')
-    ).join(VisitLog, User.id == VisitLog.user_id, isouter=True).group_by(User.id, User.first_name, User.last_name, User.middle_name).order_by(db.func.count(VisitLog.id).desc()).paginate(page=page, per_page=per_page)
+        total.label('count')
+    ).join(UserVisitRollup, join_on, isouter=True).group_by(User.id, User.first_name, User.last_name, User.middle_name).order_by(total.desc())
 
+    if request.args.get('export_csv'):
+        return export_user_visits_to_csv(query)
+
+    user_visits_data = query.paginate(page=page, per_page=per_page)
     enumerated_user_visits = enumerate(user_visits_data.items, start=(page - 1) * per_page + 1)
 
-    if request.args.get('export_csv'):
-        return export_user_visits_to_csv(user_visits_data.items)
+    return render_template('reports/user_visits.html', user_visits=enumerated_user_visits, pagination = user_visits_data,
+                           filter_args=date_range_args())
 
-    return render_template('reports/user_visits.html', user_visits=enumerated_user_visits, pagination = user_visits_data)
+@reports_bp.route('/export')
+@login_required
+@check_rights('visit_log')
+def export_visit_log():
+    """Выгрузка журнала посещений за период (date_from/date_to), включая архив."""
+    date_from, date_to = get_date_range()
+
+    def rows():
+        visits = iter_visits(date_from, date_to, EXPORT_YIELD_PER)
+        # Архивные записи хранят только user_id: ФИО читаются одним запросом на порцию строк
+        while chunk := list(itertools.islice(visits, EXPORT_YIELD_PER)):
+            user_ids = {user_id for _, _, user_id, _ in chunk if user_id is not None}
+            names = {user.id: user.get_full_name()
+                     for user in db.session.scalars(db.select(User).where(User.id.in_(user_ids)))} if user_ids else {}
+            for visit_id, created_at, user_id, path in chunk:
+                if user_id is None:
+                    name = "Гость"
+                else:
+                    name = names.get(user_id, "Удаленный пользователь")
+                yield [created_at.strftime('%d.%m.%Y %H:%M:%S'), name, path]
+    return stream_csv('visit_log.csv', ['Time', 'User', 'Path'], rows(), compress=export_compressed())
 
 @reports_bp.route('/user_visit_log')
 @login_required
 def user_visit_log():
-    page = request.args.get('page', 1, type=int)
     per_page = 10
-    visits = VisitLog.query.filter_by(user_id=current_user.id).order_by(VisitLog.created_at.desc()).paginate(page=page, per_page=per_page)
-    enumerated_visits = enumerate(visits.items, start=(page - 1) * per_page + 1)
-    return render_template('reports/user_visit_log.html', visits=enumerated_visits, pagination=visits)
\ No newline at end of file
+    query = VisitLog.query.options(db.joinedload(VisitLog.path_ref)).filter_by(user_id=current_user.id)
+    visits = keyset_paginate(query, per_page, after=request.args.get('after'), before=request.args.get('before'))
+    total = visit_total(query, f'user:{current_user.id}', current_app.config['VISIT_LOG_TOTAL'],
+                        current_app.config['VISIT_LOG_TOTAL_TTL'])
+    return render_template('reports/user_visit_log.html', visits=visits.enumerated(), pagination=visits, total=total)
+
+
+@reports_bp.route('/latency')
+@login_required
+@check_rights('visit_log')
+def page_latency():
+    """Самые медленные страницы: квантили времени ответа из часовых гистограмм."""
+    date_from, date_to = get_date_range()
+    hours = request.args.get('hours', 24, type=int)
+    if not date_from and not date_to:
+        # По умолчанию - последние сутки
+        now = datetime.datetime.now(datetime.UTC).replace(tzinfo=None)
+        date_from = now.replace(minute=0, second=0, microsecond=0) - datetime.timedelta(hours=max(hours - 1, 0))
+    report = latency_report(date_from, date_to)
+
+    if request.args.get('export_csv'):
+        rows = ([page['path'], page['count'], page['p50'], page['p95'], page['p99'], page['avg_ms'],
+                 page['avg_queries'], page['errors']] for page in report)
+        return stream_csv('page_latency.csv', ['Path', 'Count', 'P50 ms', 'P95 ms', 'P99 ms', 'Avg ms',
+                                               'Avg queries', 'Errors'], rows, compress=export_compressed())
+
+    filter_args = date_range_args()
+    if not filter_args:
+        filter_args = {'hours': hours}
+    return render_template('reports/latency.html', pages=enumerate(report, start=1), filter_args=filter_args)
+
+
+@reports_bp.route('/estimates')
+@login_required
+@check_rights('visit_log')
+def visit_estimates():
+    """Оценки уникальных посетителей и популярных страниц за день без чтения журнала."""
+    day = request.args.get('day') or datetime.datetime.now(datetime.UTC).strftime('%Y-%m-%d')
+    try:
+        datetime.datetime.strptime(day, '%Y-%m-%d')
+    except ValueError:
+        day = datetime.datetime.now(datetime.UTC).strftime('%Y-%m-%d')
+    sketch = visit_sketches.day(day)
+    return render_template('reports/estimates.html', day=day, top_pages=enumerate(sketch.top(), start=1),
+                           unique_visitors=sketch.unique_visitors())
+
+
+@reports_bp.route('/visit_writer')
+@login_required
+@check_rights('visit_log')
+def visit_writer_stats():
+    # Глубина очереди, отброшенные записи и время сброса пакетов
+    return jsonify(dict(visit_writer.stats(), sample_multiplier=visit_policy.multiplier))
+
+
+@reports_bp.route('/live')
+@login_required
+@check_rights('visit_log')
+def live_visits():
+    return render_template('reports/live.html', buffer_size=current_app.config['VISIT_LIVE_BUFFER'])
+
+
+@reports_bp.route('/live/stream')
+@login_required
+@check_rights('visit_log')
+def live_visits_stream():
+    """Поток Server-Sent Events из кольцевого буфера воркера, без запросов к базе."""
+    last_id = request.headers.get('Last-Event-ID', type=int) or request.args.get('after', type=int)
+    response = Response(visit_ring.stream(last_id), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # nginx не должен копить поток
+    return response
@@ -0,0 +1,229 @@
+# server_session.py
+import collections
+import os
+import re
+import secrets
+import sqlite3
+import threading
+import time
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+# Идентификатор сессии в cookie: 32 случайных байта в base64url
+_SID = re.compile(r'^[A-Za-z0-9_-]{43}$')
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    """Данные сессии на сервере; в cookie только sid."""
+
+    def __init__(self, initial=None, sid=None, new=False, version=None):
+        def on_update(session):
+            session.modified = True
+        super().__init__(initial, on_update)
+        self.sid = sid or secrets.token_urlsafe(32)
+        self.version = version  # Версия строки в хранилище, с которой прочитаны данные
+        self.new = new
+        self.modified = False
+        self.previous_sid = None
+
+    def regenerate(self):
+        """Новый sid с теми же данными (после входа, против фиксации сессии)."""
+        self.previous_sid = self.previous_sid or self.sid
+        self.sid = secrets.token_urlsafe(32)
+        self.version = None
+        self.modified = True
+
+
+class SQLiteSessionStore:
+    """Сессии в таблице SQLite с LRU-кэшем процесса перед ней.
+
+    У каждой строки есть версия, которая растет при каждой записи. Запись из
+    кэша сверяется с версией в базе (чтение двух чисел по первичному ключу
+    вместо данных) не чаще раза в check_interval секунд для каждого sid,
+    поэтому выход и смена sid в другом воркере видны здесь не позже чем
+    через check_interval. Запись выполняется только поверх той версии, с
+    которой сессия была прочитана: устаревшие данные не возвращают удаленную
+    сессию и не затирают чужие изменения.
+    """
+
+    def __init__(self, path, cache_size=10_000, check_interval=5):
+        self.path = path
+        self.cache_size = cache_size
+        self.check_interval = check_interval
+        self._cache = collections.OrderedDict()  # sid -> (данные, истекает, версия, когда сверена версия)
+        self._lock = threading.Lock()
+        self._connection = None
+        self._pid = None
+        self.reads = 0
+        self.writes = 0
+        self.cache_hits = 0  # Ответы из кэша без обращения к базе
+        self.version_checks = 0  # Ответы из кэша после сверки версии
+        self.conflicts = 0
+
+    def get(self, sid, now):
+        """(данные, версия) действующей сессии или None."""
+        with self._lock:
+            cached = self._cache.get(sid)
+            if cached is not None and cached[1] > now and now - cached[3] < self.check_interval:
+                self._cache.move_to_end(sid)
+                self.cache_hits += 1
+                return cached[0], cached[2]
+            if cached is not None:
+                row = self._db().execute('SELECT version, expires FROM sessions WHERE id = ?', (sid,)).fetchone()
+                if row is None or row[1] <= now:
+                    del self._cache[sid]
+                    return None
+                if row[0] == cached[2]:
+                    self._remember(sid, cached[0], row[1], row[0], now)
+                    self.version_checks += 1
+                    return cached[0], cached[2]
+            self.reads += 1
+            row = self._db().execute('SELECT data, expires, version FROM sessions WHERE id = ?', (sid,)).fetchone()
+            if row is None or row[1] <= now:
+                self._cache.pop(sid, None)
+                return None
+            self._remember(sid, *row, now)
+            return row[0], row[2]
+
+    def expires(self, sid):
+        with self._lock:
+            cached = self._cache.get(sid)
+            return cached[1] if cached is not None else None
+
+    def set(self, sid, data, expires, version=None):
+        """Сохраняет сессию, прочитанную с версией version (None - новая). False, если строка уже изменилась."""
+        with self._lock:
+            if version is None:
+                stored = self._db().execute('INSERT INTO sessions (id, data, expires, version) VALUES (?, ?, ?, 1) '
+                                            'ON CONFLICT (id) DO NOTHING', (sid, data, expires)).rowcount
+            else:
+                stored = self._db().execute('UPDATE sessions SET data = ?, expires = ?, version = version + 1 '
+                                            'WHERE id = ? AND version = ?', (data, expires, sid, version)).rowcount
+            if not stored:
+                # Сессию удалили (выход) или изменили в другом воркере: ее данные у нас устарели
+                self.conflicts += 1
+                self._cache.pop(sid, None)
+                return False
+            self.writes += 1
+            self._remember(sid, data, expires, 1 if version is None else version + 1, time.time())
+            return True
+
+    def delete(self, sid):
+        with self._lock:
+            self._cache.pop(sid, None)
+            self._db().execute('DELETE FROM sessions WHERE id = ?', (sid,))
+
+    def sweep(self, now):
+        """Удаляет просроченные сессии; возвращает их число."""
+        with self._lock:
+            for sid in [sid for sid, cached in self._cache.items() if cached[1] <= now]:
+                del self._cache[sid]
+            return self._db().execute('DELETE FROM sessions WHERE expires <= ?', (now,)).rowcount
+
+    def _remember(self, sid, data, expires, version, checked_at):
+        self._cache[sid] = (data, expires, version, checked_at)
+        self._cache.move_to_end(sid)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def _db(self):
+        # Одно соединение на процесс; после fork открываем свое
+        if self._connection is None or self._pid != os.getpid():
+            self._connection = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            if self.path != ':memory:':
+                self._connection.execute('PRAGMA journal_mode = WAL')
+                self._connection.execute('PRAGMA synchronous = NORMAL')
+            self._connection.execute('CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, data TEXT NOT NULL, '
+                                     'expires REAL NOT NULL, version INTEGER NOT NULL DEFAULT 1) WITHOUT ROWID')
+            columns = {row[1] for row in self._connection.execute('PRAGMA table_info(sessions)')}
+            if 'version' not in columns:
+                # Таблица из версии без счетчика изменений
+                self._connection.execute('ALTER TABLE sessions ADD COLUMN version INTEGER NOT NULL DEFAULT 1')
+            self._connection.execute('CREATE INDEX IF NOT EXISTS ix_sessions_expires ON sessions (expires)')
+            self._pid = os.getpid()
+            self._cache.clear()
+        return self._connection
+
+
+class ServerSessionInterface(SessionInterface):
+    """Сессии на сервере вместо подписанной cookie с данными.
+
+    Сессия сохраняется один раз в конце запроса и только если изменилась;
+    неизмененная сессия продлевается, когда прошла половина срока. Если
+    строку за время запроса изменили или удалили, сохранение пропускается.
+    Просроченные сессии удаляются раз в SESSION_SWEEP_INTERVAL секунд.
+    """
+
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self):
+        self.store = None
+        self._swept_at = time.time()
+
+    def init_app(self, app):
+        app.config.setdefault('SESSION_STORE_PATH', os.path.join(app.instance_path, 'sessions.db'))
+        app.config.setdefault('SESSION_CACHE_SIZE', 10_000)
+        # Как часто сессия из кэша сверяется с базой: столько секунд выход в другом воркере может быть не виден
+        app.config.setdefault('SESSION_VERSION_CHECK_INTERVAL', 5)
+        app.config.setdefault('SESSION_SWEEP_INTERVAL', 300)
+        app.session_interface = self
+
+    def get_store(self, app):
+        # Создается при первом запросе: тесты успевают поменять SESSION_STORE_PATH
+        if self.store is None:
+            path = app.config['SESSION_STORE_PATH']
+            if path != ':memory:':
+                os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            self.store = SQLiteSessionStore(path, app.config['SESSION_CACHE_SIZE'],
+                                            app.config['SESSION_VERSION_CHECK_INTERVAL'])
+        return self.store
+
+    def lifetime(self, app):
+        return app.permanent_session_lifetime.total_seconds()
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid and _SID.match(sid):
+            stored = self.get_store(app).get(sid, time.time())
+            if stored is not None:
+                data, version = stored
+                return ServerSession(self.serializer.loads(data), sid=sid, version=version)
+        return ServerSession(new=True)
+
+    def save_session(self, app, session, response):
+        store = self.get_store(app)
+        now = time.time()
+        if now - self._swept_at >= app.config['SESSION_SWEEP_INTERVAL']:
+            self._swept_at = now
+            store.sweep(now)
+
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if session.previous_sid:
+            store.delete(session.previous_sid)
+        if not session:
+            if not session.new:
+                store.delete(session.sid)
+            if session.modified or session.previous_sid:
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        expires = now + self.lifetime(app)
+        stored_expires = store.expires(session.sid)
+        # Неизмененную сессию перезаписываем только для продления срока
+        stale = stored_expires is None or stored_expires - now < self.lifetime(app) / 2
+        if session.modified or session.new or stale:
+            if not store.set(session.sid, self.serializer.dumps(dict(session)), expires, session.version):
+                return
+        elif not self.should_set_cookie(app, session):
+            return
+        response.vary.add('Cookie')
+        response.set_cookie(name, session.sid, expires=self.get_expiration_time(app, session),
+                            httponly=self.get_cookie_httponly(app), domain=domain, path=path,
+                            secure=self.get_cookie_secure(app), samesite=self.get_cookie_samesite(app))
+
+
+server_session = ServerSessionInterface()
@@ -3,6 +3,10 @@ import sys
 import pytest
 from contextlib import contextmanager
 from flask import template_rendered
+
+# Движок базы создается при импорте приложения, поэтому адрес задаем заранее
+os.environ.setdefault('DATABASE_URL', 'sqlite:///:memory:')
+
 from app import app as application  # Импортируем экземпляр Flask
 from models import User, Role, db  # Импортируем модели
 
@@ -19,6 +23,8 @@ def app():
         'SQLALCHEMY_DATABASE_URI': 'sqlite:///:memory:',  # Используем базу данных в памяти
         'SQLALCHEMY_TRACK_MODIFICATIONS': False,
         'WTF_CSRF_ENABLED': False,  # Отключаем CSRF защиту в тестах
+        'VISIT_LOG_ASYNC': False,  # Журнал посещений пишется сразу, без фонового потока
+        'SESSION_STORE_PATH': ':memory:',  # Сессии тестов не попадают в instance/sessions.db
         'SERVER_NAME': 'localhost'  # Добавляем SERVER_NAME
     })
 
@@ -138,3 +138,574 @@ def test_successful_login(client: FlaskClient):
         'password': 'admin'
     }, follow_redirects=True)
     assert response.status_code == 200
+
+
+def test_visit_writer_flushes_batch_on_stop(app):
+    """Посещения из очереди записываются одним пакетом при остановке потока."""
+    from models import VisitLog
+    from visit_writer import visit_writer
+    with app.app_context():
+        before = VisitLog.query.count()
+        app.config['VISIT_LOG_ASYNC'] = True
+        try:
+            for i in range(5):
+                assert visit_writer.enqueue(f'/batch/{i}', None)
+            visit_writer.stop()
+        finally:
+            app.config['VISIT_LOG_ASYNC'] = False
+        assert VisitLog.query.count() == before + 5
+        assert visit_writer.stats()['queue_depth'] == 0
+
+
+def test_backfill_rollups_matches_visit_log(app, runner):
+    """Пересчет агрегатов дает те же суммы, что и журнал посещений."""
+    from models import VisitLog, VisitPath, PageVisitRollup
+    from visit_writer import visit_writer
+    with app.app_context():
+        visit_writer.enqueue('/rollup', None)
+        incremental = db.session.query(db.func.sum(PageVisitRollup.count)) \
+            .join(VisitPath, VisitPath.id == PageVisitRollup.path_id).filter(VisitPath.path == '/rollup').scalar()
+        assert incremental == VisitLog.query.filter_by(path='/rollup').count()
+
+        result = runner.invoke(args=['backfill-visit-rollups'])
+        assert result.exit_code == 0
+        total = db.session.query(db.func.sum(PageVisitRollup.count)).scalar()
+        assert total == db.session.query(db.func.sum(VisitLog.weight)).filter(VisitLog.created_at.isnot(None)).scalar()
+
+
+def test_backfill_rollups_keeps_archived_months(app, runner, tmp_path):
+    """Пересчет после архивации не теряет часы, которых уже нет в рабочей таблице."""
+    import datetime
+    from models import PageVisitRollup, UserVisitRollup
+    from visit_archive import archive_old_visits
+    from visit_writer import visit_writer
+    with app.app_context():
+        app.config['VISIT_ARCHIVE_DIR'] = str(tmp_path)
+        try:
+            admin = User.query.filter_by(login='admin').first()
+            visit_writer.enqueue('/rollup-archived', admin.id, created_at=datetime.datetime(2018, 2, 10, 9, 30))
+            visit_writer.enqueue('/rollup-archived', None, created_at=datetime.datetime(2018, 2, 11, 9, 30))
+            archive_old_visits(retention_days=90)
+
+            def totals():
+                return (db.session.query(db.func.sum(PageVisitRollup.count)).scalar(),
+                        db.session.query(db.func.sum(UserVisitRollup.count)).scalar())
+            before = totals()
+            assert runner.invoke(args=['backfill-visit-rollups']).exit_code == 0
+            assert totals() == before
+            assert PageVisitRollup.query.filter(PageVisitRollup.hour < datetime.datetime(2018, 3, 1)).count() >= 1
+        finally:
+            del app.config['VISIT_ARCHIVE_DIR']
+
+
+def test_export_visit_log_streams_all_rows(app, client):
+    """Выгрузка журнала отдается потоком и содержит все записи, а не одну страницу."""
+    import gzip
+    from models import VisitLog
+    with app.app_context():
+        client.post('/login', data={'login': 'admin', 'password': 'admin'})
+
+        response = client.get(url_for('reports.export_visit_log'))
+        assert response.status_code == 200
+        assert response.is_streamed
+        lines = response.get_data(as_text=True).splitlines()
+        assert lines[0] == 'Time;User;Path'
+        assert len(lines) - 1 == VisitLog.query.count()
+
+        response = client.get(url_for('reports.export_visit_log', gzip=1))
+        assert gzip.decompress(response.data).decode('utf-8').startswith('Time;User;Path')
+
+
+def test_keyset_pagination_walks_forward_and_back(app):
+    """Переход вперед и назад по токенам возвращает те же записи, что и сортировка целиком."""
+    import datetime
+    from models import VisitLog
+    from keyset import keyset_paginate
+    from visit_writer import visit_writer
+    with app.app_context():
+        moment = datetime.datetime(2024, 1, 1, 12, 0, 0)
+        for i in range(12):
+            # Две записи на одну секунду: порядок определяет id
+            visit_writer.enqueue('/keyset', None, created_at=moment + datetime.timedelta(seconds=i // 2))
+        query = VisitLog.query.filter_by(path='/keyset')
+        expected = query.order_by(VisitLog.created_at.desc(), VisitLog.id.desc()).all()
+
+        first = keyset_paginate(query, 5)
+        second = keyset_paginate(query, 5, after=first.next_token)
+        third = keyset_paginate(query, 5, after=second.next_token)
+        assert first.items + second.items + third.items == expected
+        assert not third.has_next
+        assert [number for number, _ in third.enumerated()] == [11, 12]
+
+        back = keyset_paginate(query, 5, before=third.prev_token)
+        assert back.items == second.items
+        assert back.start == 6
+
+
+def test_archive_moves_old_months_out_of_hot_table(app, client, tmp_path):
+    """Старые месяцы уходят в сжатые разделы, но остаются в выгрузке журнала."""
+    import datetime
+    from models import VisitLog
+    from visit_archive import archive_old_visits
+    from visit_writer import visit_writer
+    with app.app_context():
+        app.config['VISIT_ARCHIVE_DIR'] = str(tmp_path)
+        try:
+            visit_writer.enqueue('/archived', None, created_at=datetime.datetime(2020, 3, 15, 10, 0))
+            visit_writer.enqueue('/archived', None, created_at=datetime.datetime(2020, 4, 1, 0, 0))
+
+            result = archive_old_visits(retention_days=90)
+            assert result['2020-03'] >= 1 and result['2020-04'] >= 1
+            assert VisitLog.query.filter_by(path='/archived').count() == 0
+            assert len(list(tmp_path.glob('visit_log-2020-0*.csv.gz'))) == 2
+
+            client.post('/login', data={'login': 'admin', 'password': 'admin'})
+            response = client.get(url_for('reports.export_visit_log', date_from='2020-03-01', date_to='2020-03-31'))
+            lines = response.get_data(as_text=True).splitlines()
+            assert lines[1:] == ['15.03.2020 10:00:00;Гость;/archived']
+        finally:
+            del app.config['VISIT_ARCHIVE_DIR']
+
+
+def test_archive_rerun_after_crash_does_not_duplicate(app, client, tmp_path, monkeypatch):
+    """Повторный запуск после сбоя посреди удаления оставляет один раздел без дублей."""
+    import datetime
+    import visit_archive
+    from models import VisitLog
+    from visit_writer import visit_writer
+    with app.app_context():
+        app.config['VISIT_ARCHIVE_DIR'] = str(tmp_path)
+        try:
+            for day in (1, 2, 3):
+                visit_writer.enqueue('/crash', None, created_at=datetime.datetime(2019, 5, day, 10, 0))
+            commit = db.session.commit
+            calls = []
+
+            def failing_commit():
+                calls.append(1)
+                if len(calls) > 1:
+                    raise RuntimeError('сбой')
+                commit()
+
+            monkeypatch.setattr(visit_archive, 'DELETE_BATCH', 1)
+            monkeypatch.setattr(db.session, 'commit', failing_commit)
+            with pytest.raises(RuntimeError):
+                visit_archive.archive_month(datetime.datetime(2019, 5, 1))
+            monkeypatch.undo()
+            db.session.rollback()
+            # Раздел записан, из таблицы удалена только первая порция
+            assert VisitLog.query.filter(VisitLog.created_at >= datetime.datetime(2019, 5, 1),
+                                         VisitLog.created_at < datetime.datetime(2019, 6, 1)).count() == 2
+
+            visit_archive.archive_month(datetime.datetime(2019, 5, 1))
+            assert [path.name for path in tmp_path.glob('visit_log-2019-05*')] == ['visit_log-2019-05.csv.gz']
+            client.post('/login', data={'login': 'admin', 'password': 'admin'})
+            response = client.get(url_for('reports.export_visit_log', date_from='2019-05-01', date_to='2019-05-31'))
+            assert response.get_data(as_text=True).splitlines()[1:] == [
+                f'0{day}.05.2019 10:00:00;Гость;/crash' for day in (1, 2, 3)]
+        finally:
+            del app.config['VISIT_ARCHIVE_DIR']
+
+
+def test_visit_sketches_estimate_and_merge(app):
+    """Оценки скетчей близки к точным и не удваиваются при слиянии сохраненного и локального."""
+    import datetime
+    import uuid
+    from visit_sketches import HyperLogLog, visit_sketches
+    hll = HyperLogLog()
+    for i in range(10000):
+        hll.add(f'visitor-{i}')
+    assert abs(hll.count() - 10000) < 500
+
+    with app.app_context():
+        day = datetime.datetime(2021, 5, 1)
+        hot = f'/sketch/{uuid.uuid4().hex}'
+        for i in range(30):
+            visit_sketches.add(hot, f'visitor-{i % 10}', moment=day)
+        visit_sketches.add('/sketch/cold', 'visitor-1', moment=day)
+        visit_sketches.persist()
+        visit_sketches.add(hot, 'visitor-100', moment=day)
+
+        top = {path: (hits, uniques) for path, hits, uniques in visit_sketches.day('2021-05-01').top()}
+        assert top[hot] == (31, 11)
+
+
+def test_day_sketch_caps_per_path_hll():
+    """HyperLogLog заводятся не больше чем для max_paths страниц, частые страницы - всегда."""
+    from visit_sketches import ALL_PATHS, DaySketch
+    sketch = DaySketch(top_k=1, max_paths=2)
+    for i in range(50):
+        sketch.add(f'/rare/{i}', 'visitor')
+    for i in range(10):
+        sketch.add('/hot', f'visitor-{i}')
+    assert len(sketch.uniques) <= 2 + 1 + 1  # Лимит, все страницы и top_k частых
+    assert ALL_PATHS in sketch.uniques and '/hot' in sketch.uniques
+    assert sketch.top()[0][:2] == ('/hot', 10)
+
+
+def test_visit_policy_excludes_and_weights_samples(app, client):
+    """Исключенные пути не журналируются, а выборочные записи несут вес 1/вероятность."""
+    from models import VisitLog
+    from visit_policy import visit_policy
+    with app.app_context():
+        app.config['VISIT_LOG_SAMPLE_EVERY'] = {'/sampled/*': 4}
+        try:
+            assert visit_policy.weight('/static/styles.css') is None
+            weights = [visit_policy.weight('/sampled/page') for _ in range(2000)]
+            assert set(weights) == {0, 4}
+            assert 300 < weights.count(4) < 700
+
+            client.get('/static/missing.css')
+            assert VisitLog.query.filter_by(path='/static/missing.css').count() == 0
+        finally:
+            app.config['VISIT_LOG_SAMPLE_EVERY'] = {}
+
+        app.config['VISIT_LOG_ADAPTIVE'] = True
+        try:
+            visit_policy.adjust(1000)
+            visit_policy.adjust(1000)
+            assert visit_policy.multiplier == 4
+            visit_policy.adjust(1)
+            assert visit_policy.multiplier == 2
+        finally:
+            app.config['VISIT_LOG_ADAPTIVE'] = False
+            visit_policy.adjust(0)
+        assert visit_policy.multiplier == 1
+
+
+def test_latency_report_from_histograms(app, client):
+    """Запросы пишут время ответа, код и число запросов к базе; отчет строится по гистограммам."""
+    from models import VisitLog
+    from visit_latency import LatencyHistogram
+    histogram = LatencyHistogram()
+    for duration in range(1, 101):
+        histogram.add(duration)
+    assert 50 <= histogram.quantile(0.5) <= 50 * 1.15
+    assert 99 <= histogram.quantile(0.99) <= 99 * 1.15
+
+    with app.app_context():
+        client.post('/login', data={'login': 'admin', 'password': 'admin'})
+        client.get('/reports/user_visit_log')
+        visit = VisitLog.query.filter_by(path='/reports/user_visit_log').order_by(VisitLog.id.desc()).first()
+        assert visit.status_code == 200
+        assert visit.duration_ms > 0
+        assert visit.query_count >= 1
+
+        response = client.get(url_for('reports.page_latency'))
+        assert response.status_code == 200
+        assert '/reports/user_visit_log' in response.get_data(as_text=True)
+        csv_lines = client.get(url_for('reports.page_latency', export_csv=1)).get_data(as_text=True).splitlines()
+        assert csv_lines[0].startswith('Path;Count;P50 ms')
+
+
+def test_visit_paths_are_interned(app):
+    """Путь хранится в словаре один раз, записи журнала ссылаются на него по id."""
+    from models import VisitLog, VisitPath
+    from visit_writer import visit_writer
+    from visit_paths import path_cache
+    with app.app_context():
+        visit_writer.enqueue('/interned', None)
+        path_cache.clear()
+        visit_writer.enqueue('/interned', None)
+        visit_writer.enqueue('/interned', None)
+        assert VisitPath.query.filter_by(path='/interned').count() == 1
+        path_id = VisitPath.query.filter_by(path='/interned').one().id
+        visits = VisitLog.query.filter_by(path='/interned').all()
+        assert len(visits) == 3
+        assert {visit.path_id for visit in visits} == {path_id}
+        assert visits[0].path == '/interned'
+        assert path_cache.get('/interned') == path_id
+
+
+def test_visit_spool_ingest(app, runner, tmp_path):
+    """Посещения из спула загружаются в журнал один раз, недописанная запись ждет следующей загрузки."""
+    from models import VisitLog
+    from visit_writer import visit_writer
+    from visit_spool import visit_spool
+    app.config.update(VISIT_LOG_SPOOL=True, VISIT_SPOOL_DIR=str(tmp_path))
+    try:
+        with app.app_context():
+            before = VisitLog.query.filter_by(path='/spooled').count()
+            for _ in range(3):
+                visit_writer.enqueue('/spooled', None, duration_ms=1.5, status_code=200)
+            assert VisitLog.query.filter_by(path='/spooled').count() == before
+            segment = visit_spool.stats()['segment']
+            with open(tmp_path / segment, 'ab') as f:
+                f.write(b'\x20\x00')  # Обрыв записи посреди заголовка
+
+            result = runner.invoke(args=['ingest-visits'])
+            assert result.exit_code == 0
+            assert VisitLog.query.filter_by(path='/spooled').count() == before + 3
+            runner.invoke(args=['ingest-visits'])
+            assert VisitLog.query.filter_by(path='/spooled').count() == before + 3
+
+            visit_spool.close()
+            runner.invoke(args=['ingest-visits'])
+            assert list(tmp_path.iterdir()) == []
+    finally:
+        app.config.update(VISIT_LOG_SPOOL=False, VISIT_SPOOL_DIR=None)
+
+
+def test_visit_spool_reads_in_chunks_and_skips_renamed(app, tmp_path, monkeypatch):
+    """Сегмент читается порциями; сегмент, закрытый владельцем во время загрузки, ждет следующего запуска."""
+    import datetime
+    import visit_spool as spool
+    records = [{'path': f'/chunk/{i}', 'user_id': None, 'created_at': datetime.datetime(2024, 1, 1), 'weight': 1,
+                'duration_ms': None, 'status_code': 200, 'query_count': 1} for i in range(20)]
+    segment = tmp_path / 'visits-1-1.seg'
+    segment.write_bytes(b''.join(spool.encode_record(record) for record in records) + b'\x20\x00')
+    whole = list(spool.read_records(str(segment)))
+    monkeypatch.setattr(spool, 'READ_CHUNK', 7)
+    assert list(spool.read_records(str(segment))) == whole
+    assert [record['path'] for record, _ in whole] == [record['path'] for record in records]
+    assert list(spool.read_records(str(segment), whole[9][1])) == whole[10:]
+
+    with app.app_context():
+        monkeypatch.setattr(spool.visit_spool, 'segments', lambda: [(str(tmp_path / 'visits-2-2.open'), False)])
+        assert spool.visit_spool.ingest() == 0
+
+
+def test_live_stream_sends_buffer_tail(app, client):
+    """Поздний подписчик сразу получает последние посещения, после Last-Event-ID - только новые."""
+    import json
+    app.config['VISIT_LIVE_STREAM_SECONDS'] = 0
+    try:
+        with app.app_context():
+            client.post('/login', data={'login': 'admin', 'password': 'admin'})
+            client.get('/')
+            body = client.get('/reports/live/stream').get_data(as_text=True)
+            events = [json.loads(block.split('data: ', 1)[1]) for block in body.split('\n\n')
+                      if block.startswith('id: ')]
+            visit = [event for event in events if event['path'] == '/'][-1]
+            assert visit['user'] == 'admin' and visit['status'] == 200
+            assert 'event: counters' in body
+
+            last_id = events[-1]['id']
+            body = client.get('/reports/live/stream', headers={'Last-Event-ID': str(last_id)}).get_data(as_text=True)
+            assert f'id: {last_id}\n' not in body
+    finally:
+        app.config['VISIT_LIVE_STREAM_SECONDS'] = 20
+
+
+def test_permission_cache_follows_role_changes(app):
+    """Права роли кэшируются, но изменение прав роли действует со следующего запроса."""
+    from permissions import role_permissions
+    with app.app_context():
+        client = app.test_client()
+        client.post('/login', data={'login': 'user', 'password': 'user'})
+        role = Role.query.filter_by(name='Пользователь').first()
+        admin_id = User.query.filter_by(login='admin').first().id
+        url = url_for('routes.user_details', user_id=admin_id)
+
+        assert client.get(url).status_code == 302
+        assert role_permissions(role) is role_permissions(role)
+
+        role.set_permissions({'view_user': True})
+        db.session.commit()
+        assert client.get(url).status_code == 200
+
+        role.set_permissions({})
+        db.session.commit()
+        assert client.get(url).status_code == 302
+
+
+def test_role_permissions_compile_to_mask(app):
+    """Права роли хранятся строками role_permissions и сводятся к битовой маске."""
+    from models import PERMISSION_BITS, RolePermission
+    from permissions import assignable_roles, role_permissions
+    with app.app_context():
+        role = Role(name='Аудитор', description='Только журнал')
+        role.set_permissions({'visit_logs': True, 'view_user': True, 'edit_user': False})
+        db.session.add(role)
+        db.session.commit()
+        assert {row.permission for row in RolePermission.query.filter_by(role_id=role.id)} == {'visit_log', 'view_user'}
+
+        resolved = role_permissions(role)
+        assert resolved.mask == PERMISSION_BITS['visit_log'] | PERMISSION_BITS['view_user']
+        assert resolved.allows('view_logs') and not resolved.allows('edit_user')
+        with pytest.raises(ValueError):
+            role.set_permissions(['no_such_right'])
+
+        # Назначить можно только роли, права которых не шире собственных
+        admin = role_permissions(Role.query.filter_by(name='Администратор').first())
+        assert (admin.role_id, admin.name) not in assignable_roles(resolved)
+        assert (role.id, role.name) in assignable_roles(resolved)
+        assert (admin.role_id, admin.name) in assignable_roles(admin)
+        db.session.delete(role)
+        db.session.commit()
+
+
+def test_index_is_paginated_with_constant_queries(app):
+    """Главная страница показывает одну страницу пользователей, роли загружаются без запроса на строку."""
+    from sqlalchemy import event
+    from routes import USERS_PER_PAGE
+    with app.app_context():
+        role = Role.query.filter_by(name='Пользователь').first()
+        for index in range(USERS_PER_PAGE + 5):
+            user = User(login=f'paged{index}', first_name='Paged', last_name=str(index), middle_name='', role=role)
+            user.password_hash = 'x'
+            db.session.add(user)
+        db.session.commit()
+
+        statements = []
+        def count(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', count)
+        try:
+            response = app.test_client().get('/?page=2')
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count)
+
+        html = response.get_data(as_text=True)
+        assert response.status_code == 200
+        assert f'Всего пользователей: {User.query.count()}' in html
+        assert html.count('<tr>') <= USERS_PER_PAGE + 1
+        # Страница пользователей с ролями и сводка по ролям; запись посещения сюда не входит
+        assert len([s for s in statements if 'FROM user' in s or 'FROM role' in s]) == 2
+
+
+def test_user_search_prefix_and_tokens(app):
+    """Поиск без учета регистра по началу логина и ФИО; индекс следует за правками и удалением."""
+    from user_search import search_users
+    with app.app_context():
+        role = Role.query.filter_by(name='Пользователь').first()
+        user = User(login='ivanov_s', first_name='Сергей', last_name='Иванов', middle_name='Петрович', role=role)
+        user.password_hash = 'x'
+        db.session.add(user)
+        db.session.commit()
+
+        assert user.last_name_folded == 'иванов'
+        assert user in search_users('ИВАН')
+        assert user in search_users('iva')
+        assert user in search_users('иванов серг')
+
+        user.last_name = 'Смирнов'
+        db.session.commit()
+        assert user not in search_users('иван')
+        assert user in search_users('смирнов серг')
+
+        anonymous = app.test_client()
+        assert anonymous.get('/users/search?q=смир').status_code == 302  # Логины только после входа
+
+        admin = app.test_client()
+        admin.post('/login', data={'login': 'admin', 'password': 'admin'})
+        response = admin.get('/users/search?q=смир')
+        assert response.json[0]['login'] == 'ivanov_s'
+
+        db.session.delete(user)
+        db.session.commit()
+        assert search_users('смирнов серг') == []
+
+
+def test_login_rehashes_outdated_password_hash(app):
+    """Успешный вход пересчитывает хеш со старыми параметрами, переполненная очередь дает 503."""
+    from flask import Flask
+    from passwords import PasswordHasher, PasswordHasherBusy, password_hasher, hash_method
+    with app.app_context():
+        role = Role.query.filter_by(name='Пользователь').first()
+        user = User(login='legacy_hash', first_name='Old', last_name='Hash', middle_name='', role=role,
+                    password_hash=generate_password_hash('Secret123', 'pbkdf2:sha256:1000'))
+        db.session.add(user)
+        db.session.commit()
+
+        response = app.test_client().post('/login', data={'login': 'legacy_hash', 'password': 'Secret123'})
+        assert response.status_code == 302
+        db.session.refresh(user)
+        assert hash_method(user.password_hash) == password_hasher.method
+        assert user.check_password('Secret123')
+
+    busy_app = Flask(__name__)
+    busy_app.config.update(PASSWORD_HASH_WORKERS=1, PASSWORD_HASH_QUEUE=0, PASSWORD_HASH_QUEUE_TIMEOUT=0)
+    hasher = PasswordHasher(busy_app)
+    with busy_app.app_context():
+        hasher._slots.acquire()  # Единственное место в пуле занято
+        with pytest.raises(PasswordHasherBusy):
+            hasher.verify(user.password_hash, 'Secret123')
+    hasher.shutdown()
+
+
+def test_calibrate_rejects_too_little_scrypt_memory(app, runner):
+    """Предел памяти меньше наименьшего n scrypt - понятная ошибка, а не падение CLI."""
+    from passwords import calibrate
+    with pytest.raises(ValueError):
+        calibrate(250, max_memory_mb=8)
+    with app.app_context():
+        result = runner.invoke(args=['calibrate-password-hash', '--max-memory-mb', '8'])
+    assert result.exit_code == 2 and '--max-memory-mb' in result.output
+
+
+def test_import_and_export_users(app, runner, tmp_path):
+    """Массовая загрузка проверяет строки по правилам формы, повторный запуск пропускает загруженных."""
+    from user_search import search_users
+    source = tmp_path / 'users.csv'
+    source.write_text('login,password,last_name,first_name,middle_name,role\n'
+                      'bulkuser1,Passw0rd!,Булкин,Борис,,Пользователь\n'
+                      'bulkuser2,Passw0rd!,Булкина,Белла,,\n'
+                      'bad,short,Плохой,Логин,,\n', encoding='utf-8')
+    with app.app_context():
+        result = runner.invoke(args=['import-users', str(source), '--workers', '0', '--default-role', 'Пользователь'])
+        assert result.exit_code == 1
+        assert 'Строка 4' in result.output
+        user = User.query.filter_by(login='bulkuser2').first()
+        assert user.role.name == 'Пользователь'
+        assert user.check_password('Passw0rd!')
+        assert user in search_users('булкина бел')
+
+        result = runner.invoke(args=['import-users', str(source), '--workers', '0'])
+        assert 'пропущено существующих: 2' in result.output
+
+        import json
+        target = tmp_path / 'users.jsonl'
+        runner.invoke(args=['export-users', str(target)])
+        logins = [json.loads(line)['login'] for line in target.read_text(encoding='utf-8').splitlines()]
+        assert logins == [login for login, in db.session.query(User.login).order_by(User.id)]
+
+        # Испорченные строки JSONL попадают в отчет, остальные загружаются
+        broken = tmp_path / 'broken.jsonl'
+        broken.write_text('{"login": "jsonuser1", "password": "Passw0rd!", "last_name": "Джейсонов", "first_name": "Иван"}\n'
+                          '{"login": \n'
+                          '["not", "an", "object"]\n'
+                          '{"login": 42, "password": "Passw0rd!", "last_name": "Числов", "first_name": "Петр"}\n'
+                          '{"login": "jsonuser2", "password_hash": "md5$abc", "last_name": "Хешев", "first_name": "Иван"}\n',
+                          encoding='utf-8')
+        result = runner.invoke(args=['import-users', str(broken), '--workers', '0'])
+        assert result.exit_code == 1
+        assert 'Итого загружено: 1' in result.output
+        for number in (2, 3, 4, 5):
+            assert f'Строка {number}:' in result.output
+        assert 'Некорректный хеш пароля' in result.output
+
+
+def test_login_limiter_refuses_before_hashing(app, tmp_path):
+    """После лимита неудачных входов попытка отклоняется с 429, пароль при этом не проверяется."""
+    from flask import Flask
+    from login_limiter import LoginLimiter, login_limiter
+    from passwords import password_hasher
+    login_limiter.clear()
+    limit, _ = app.config['LOGIN_LIMIT_PER_LOGIN']
+    try:
+        with app.app_context():  # Свой контекст: без пользователя, вошедшего в других тестах
+            client = app.test_client()
+            for _ in range(limit):
+                response = client.post('/login', data={'login': 'admin', 'password': 'wrong'})
+                assert response.status_code == 200
+            verified = password_hasher.verified
+            response = client.post('/login', data={'login': 'admin', 'password': 'admin'})
+            assert response.status_code == 429
+            assert int(response.headers['Retry-After']) > 0
+            assert password_hasher.verified == verified
+            assert login_limiter.stats()['hits'] >= 1
+    finally:
+        login_limiter.clear()
+
+    # Два воркера с общим файлом видят одни и те же счетчики
+    workers = []
+    for _ in range(2):
+        worker_app = Flask(__name__)
+        worker_app.config.update(LOGIN_LIMIT_STORAGE=str(tmp_path / 'limits.db'), LOGIN_LIMIT_PER_LOGIN=(2, 60))
+        workers.append(LoginLimiter(worker_app))
+    workers[0].failure('shared', ip='10.0.0.1', now=1000)
+    workers[1].failure('shared', ip='10.0.0.2', now=1001)
+    assert workers[0].retry_after('shared', ip='10.0.0.3', now=1002) > 0
+    workers[1].success('shared', ip='10.0.0.3')
+    assert workers[0].retry_after('shared', ip='10.0.0.3', now=1002) == 0
@@ -0,0 +1,165 @@
+# user_search.py
+import re
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import DDL, bindparam, event, text
+from sqlalchemy.orm import joinedload, load_only
+
+from models import Role, User, db
+
+# Исходный столбец -> столбец с casefold-значением для поиска по префиксу
+FOLDED_COLUMNS = (('login', 'login_folded'), ('last_name', 'last_name_folded'), ('first_name', 'first_name_folded'))
+# Символ больше любого другого: верхняя граница диапазона для префикса
+_MAX_CHAR = '\U0010ffff'
+
+FTS_TABLE = 'user_fts'
+_FTS_COLUMNS = ('login', 'last_name', 'first_name', 'middle_name')
+
+
+def fold(value):
+    return (value or '').casefold()
+
+
+def _fts5_available(connection):
+    options = {row[0] for row in connection.exec_driver_sql('PRAGMA compile_options')}
+    return 'ENABLE_FTS5' in options
+
+
+# Таблица полнотекстового поиска создается и удаляется вместе с таблицей user (только SQLite с FTS5)
+event.listen(User.__table__, 'after_create', DDL(
+    f'CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5('
+    f'{", ".join(_FTS_COLUMNS)}, tokenize = "unicode61 remove_diacritics 2", prefix = \'2 3\')'
+).execute_if(dialect='sqlite', callable_=lambda ddl, target, bind, **kw: _fts5_available(bind)))
+event.listen(User.__table__, 'before_drop', DDL(f'DROP TABLE IF EXISTS {FTS_TABLE}').execute_if(dialect='sqlite'))
+
+
+def fts_enabled(connection=None):
+    """Включен ли поиск по словам (USER_SEARCH_FTS) и существует ли таблица FTS5."""
+    if not current_app.config.get('USER_SEARCH_FTS', True):
+        return False
+    connection = connection or db.session.connection()
+    return connection.execute(text('SELECT 1 FROM sqlite_master WHERE type = :type AND name = :name'),
+                              {'type': 'table', 'name': FTS_TABLE}).first() is not None
+
+
+@event.listens_for(User, 'before_insert')
+@event.listens_for(User, 'before_update')
+def _sync_folded(mapper, connection, user):
+    for column, folded in FOLDED_COLUMNS:
+        setattr(user, folded, fold(getattr(user, column)))
+
+
+@event.listens_for(User, 'after_insert')
+@event.listens_for(User, 'after_update')
+def _sync_fts(mapper, connection, user):
+    state = db.inspect(user)
+    if not any(state.attrs[column].history.has_changes() for column in _FTS_COLUMNS):
+        return  # Смена пароля или роли индекс не затрагивает
+    if not fts_enabled(connection):
+        return
+    connection.execute(text(f'DELETE FROM {FTS_TABLE} WHERE rowid = :id'), {'id': user.id})
+    connection.execute(text(f'INSERT INTO {FTS_TABLE} (rowid, {", ".join(_FTS_COLUMNS)}) '
+                            f'VALUES (:id, {", ".join(":" + column for column in _FTS_COLUMNS)})'),
+                       {'id': user.id, **{column: getattr(user, column) or '' for column in _FTS_COLUMNS}})
+
+
+@event.listens_for(User, 'after_delete')
+def _delete_fts(mapper, connection, user):
+    if fts_enabled(connection):
+        connection.execute(text(f'DELETE FROM {FTS_TABLE} WHERE rowid = :id'), {'id': user.id})
+
+
+def _load_users(ids):
+    """Пользователи в порядке ids, только столбцы списка и название роли."""
+    if not ids:
+        return []
+    users = User.query.options(
+        load_only(User.id, User.login, User.first_name, User.last_name, User.middle_name, User.role_id),
+        joinedload(User.role).load_only(Role.name),
+    ).filter(User.id.in_(ids)).all()
+    by_id = {user.id: user for user in users}
+    return [by_id[user_id] for user_id in ids if user_id in by_id]
+
+
+def prefix_search(term, limit=20):
+    """Пользователи, у которых логин, фамилия или имя начинаются с term (без учета регистра).
+
+    Каждый столбец - диапазон по своему индексу (folded >= term AND folded < term + максимальный символ),
+    поэтому время не зависит от числа пользователей.
+    """
+    prefix = fold(term)
+    ids = []
+    for _, folded in FOLDED_COLUMNS:
+        column = getattr(User, folded)
+        rows = db.session.query(User.id).filter(column >= prefix, column < prefix + _MAX_CHAR) \
+            .order_by(column, User.id).limit(limit)
+        ids += [user_id for user_id, in rows if user_id not in ids]
+        if len(ids) >= limit:
+            break
+    return _load_users(ids[:limit])
+
+
+def token_search(term, limit=20):
+    """Поиск по началу каждого слова запроса в логине и ФИО через FTS5, лучшие совпадения первыми."""
+    tokens = re.findall(r'\w+', term)
+    if not tokens:
+        return []
+    match = ' '.join(f'"{token}"*' for token in tokens)
+    rows = db.session.execute(text(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :match '
+                                   f'ORDER BY rank LIMIT :limit'), {'match': match, 'limit': limit})
+    return _load_users([user_id for user_id, in rows])
+
+
+def search_users(term, limit=20):
+    """Одно слово - поиск по префиксу по индексам, несколько слов - по FTS5, если она есть."""
+    term = (term or '').strip()
+    if not term:
+        return []
+    if len(term.split()) > 1 and fts_enabled():
+        return token_search(term, limit)
+    return prefix_search(term, limit)
+
+
+def _fts_insert_select(where=''):
+    values = ', '.join(f"coalesce({column}, '')" for column in _FTS_COLUMNS)
+    return text(f'INSERT INTO {FTS_TABLE} (rowid, {", ".join(_FTS_COLUMNS)}) SELECT id, {values} FROM user {where}')
+
+
+def index_users(user_ids):
+    """Добавляет в FTS5 пользователей, вставленных в обход событий ORM (массовая загрузка).
+
+    casefold-столбцы такие строки должны заполнить сами (fold).
+    """
+    if not user_ids or not fts_enabled():
+        return
+    db.session.execute(_fts_insert_select('WHERE id IN :ids').bindparams(bindparam('ids', expanding=True)),
+                       {'ids': list(user_ids)})
+
+
+def rebuild_user_search(batch_size=5000):
+    """Пересчитывает casefold-столбцы и таблицу FTS5 по всем пользователям."""
+    last_id = 0
+    while True:
+        users = User.query.filter(User.id > last_id).order_by(User.id).limit(batch_size).all()
+        if not users:
+            break
+        for user in users:
+            for column, folded in FOLDED_COLUMNS:
+                setattr(user, folded, fold(getattr(user, column)))
+        last_id = users[-1].id
+        db.session.commit()
+    if fts_enabled():
+        db.session.execute(text(f'DELETE FROM {FTS_TABLE}'))
+        db.session.execute(_fts_insert_select())
+        db.session.commit()
+
+
+@click.command('rebuild-user-search')
+@click.option('--batch-size', default=5000, show_default=True, help='Пользователей в одной транзакции.')
+@with_appcontext
+def rebuild_user_search_command(batch_size):
+    """Заполняет поисковые столбцы и таблицу FTS5 для существующих пользователей."""
+    rebuild_user_search(batch_size)
+    click.echo(f'Пользователей: {User.query.count()}, FTS5: {"да" if fts_enabled() else "нет"}')
@@ -0,0 +1,162 @@
+# visit_archive.py
+import csv
+import datetime
+import glob
+import gzip
+import os
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from models import VisitLog, VisitPath, db
+
+# Строк журнала, удаляемых из рабочей таблицы за одну транзакцию
+DELETE_BATCH = 5000
+
+
+def month_start(moment):
+    return moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def next_month(month):
+    return (month + datetime.timedelta(days=32)).replace(day=1)
+
+
+def archive_dir():
+    path = current_app.config.get('VISIT_ARCHIVE_DIR') or os.path.join(current_app.instance_path, 'visit_archive')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def retention_cutoff(retention_days=None):
+    """Начало месяца, до которого записи уходят в архив (только целые месяцы)."""
+    if retention_days is None:
+        retention_days = current_app.config['VISIT_LOG_RETENTION_DAYS']
+    now = datetime.datetime.now(datetime.UTC).replace(tzinfo=None)
+    return month_start(now - datetime.timedelta(days=retention_days))
+
+
+def _partition_id(path):
+    # Разделы прежнего формата: visit_log-ГГГГ-ММ.<первый id>-<последний id>.csv.gz
+    name = os.path.basename(path)[len('visit_log-YYYY-MM'):]
+    return int(name[1:].split('-')[0]) if name.startswith('.') and name[1:2].isdigit() else 0
+
+
+def archived_until():
+    """Начало первого месяца после последнего архивного раздела; None, если архива нет.
+
+    Записи раньше этой границы есть только в архиве (или в архиве и в
+    таблице, если удаление прервалось).
+    """
+    months = [datetime.datetime.strptime(os.path.basename(path)[len('visit_log-'):][:7], '%Y-%m')
+              for path in glob.glob(os.path.join(archive_dir(), 'visit_log-*.csv.gz'))]
+    return next_month(max(months)) if months else None
+
+
+def archive_month(month):
+    """Переносит записи за месяц из рабочей таблицы в сжатый файл-раздел.
+
+    Раздел один на месяц: новые записи дописываются к уже заархивированным.
+    Из старого файла берутся только строки с id меньше первого id в рабочей
+    таблице, поэтому повторный запуск после сбоя посреди удаления не
+    дублирует строки, которые остались и в файле, и в таблице.
+    """
+    in_month = db.and_(VisitLog.created_at >= month, VisitLog.created_at < next_month(month))
+    first_id, last_id = db.session.query(db.func.min(VisitLog.id), db.func.max(VisitLog.id)).filter(in_month).one()
+    if first_id is None:
+        return 0
+
+    path = os.path.join(archive_dir(), f'visit_log-{month:%Y-%m}.csv.gz')
+    previous = sorted(glob.glob(os.path.join(archive_dir(), f'visit_log-{month:%Y-%m}.*csv.gz')), key=_partition_id)
+    archived = 0
+    with gzip.open(path + '.part', 'wt', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        written_id = 0
+        for old_path in previous:
+            with gzip.open(old_path, 'rt', encoding='utf-8', newline='') as old:
+                for row in csv.reader(old):
+                    if written_id < int(row[0]) < first_id:
+                        writer.writerow(row)
+                        written_id = int(row[0])
+        query = db.session.query(VisitLog.id, VisitLog.created_at, VisitLog.user_id, VisitPath.path, VisitLog.weight,
+                                 VisitLog.duration_ms, VisitLog.status_code, VisitLog.query_count) \
+            .outerjoin(VisitPath, VisitPath.id == VisitLog.path_id) \
+            .filter(in_month, VisitLog.id <= last_id).order_by(VisitLog.id)
+        for row in query.yield_per(DELETE_BATCH):
+            writer.writerow([row.id, row.created_at.isoformat(), row.user_id or '', row.path, row.weight,
+                             row.duration_ms, row.status_code, row.query_count])
+            archived += 1
+    os.replace(path + '.part', path)
+    for old_path in previous:
+        if old_path != path:
+            os.remove(old_path)
+
+    # Удаляем из рабочей таблицы только то, что уже лежит в файле
+    while True:
+        ids = [visit_id for visit_id, in db.session.query(VisitLog.id)
+               .filter(in_month, VisitLog.id <= last_id).limit(DELETE_BATCH)]
+        if not ids:
+            break
+        VisitLog.query.filter(VisitLog.id.in_(ids)).delete(synchronize_session=False)
+        db.session.commit()
+    return archived
+
+
+def archive_old_visits(retention_days=None):
+    """Архивирует все месяцы старше срока хранения. Возвращает {месяц: строк}."""
+    cutoff = retention_cutoff(retention_days)
+    oldest = db.session.query(db.func.min(VisitLog.created_at)).scalar()
+    result = {}
+    if oldest is None:
+        return result
+    month = month_start(oldest)
+    while month < cutoff:
+        count = archive_month(month)
+        if count:
+            result[f'{month:%Y-%m}'] = count
+        month = next_month(month)
+    return result
+
+
+def _read_partition(path):
+    with gzip.open(path, 'rt', encoding='utf-8', newline='') as f:
+        for visit_id, created_at, user_id, visit_path, *_ in csv.reader(f):
+            yield int(visit_id), datetime.datetime.fromisoformat(created_at), int(user_id) if user_id else None, visit_path
+
+
+def iter_visits(date_from=None, date_to=None, chunk_size=1000):
+    """Записи журнала (id, created_at, user_id, path) за период из архива и рабочей таблицы.
+
+    Читаются только разделы, пересекающиеся с периодом; порядок - по возрастанию id.
+    """
+    for path in sorted(glob.glob(os.path.join(archive_dir(), 'visit_log-*.csv.gz'))):
+        month = datetime.datetime.strptime(os.path.basename(path)[len('visit_log-'):][:7], '%Y-%m')
+        if (date_to and month >= date_to) or (date_from and next_month(month) <= date_from):
+            continue
+        for row in _read_partition(path):
+            if (date_from and row[1] < date_from) or (date_to and row[1] >= date_to):
+                continue
+            yield row
+
+    query = db.session.query(VisitLog.id, VisitLog.created_at, VisitLog.user_id, VisitPath.path) \
+        .outerjoin(VisitPath, VisitPath.id == VisitLog.path_id) \
+        .filter(VisitLog.created_at.isnot(None))
+    if date_from:
+        query = query.filter(VisitLog.created_at >= date_from)
+    if date_to:
+        query = query.filter(VisitLog.created_at < date_to)
+    for row in query.order_by(VisitLog.id).yield_per(chunk_size):
+        yield tuple(row)
+
+
+@click.command('archive-visits')
+@click.option('--retention-days', type=int, default=None,
+              help='Сколько дней хранить записи в рабочей таблице (по умолчанию VISIT_LOG_RETENTION_DAYS).')
+@with_appcontext
+def archive_visits_command(retention_days):
+    """Переносит старые записи журнала посещений в помесячные архивы."""
+    result = archive_old_visits(retention_days)
+    for month, count in result.items():
+        click.echo(f'{month}: {count}')
+    click.echo(f'Архив: {archive_dir()}')
@@ -0,0 +1,140 @@
+# visit_latency.py
+import math
+from array import array
+
+from flask import g, has_request_context
+
+from models import PageLatencyRollup, db
+from visit_paths import path_names
+from visit_rollups import hour_bucket
+
+# Логарифмические корзины: от 0.1 мс с шагом 15%, последняя - все, что дольше ~100 с
+HISTOGRAM_MIN_MS = 0.1
+HISTOGRAM_RATIO = 1.15
+HISTOGRAM_BUCKETS = 100
+
+
+class LatencyHistogram:
+    """Гистограмма длительностей с относительной ошибкой квантилей не больше 15%."""
+
+    def __init__(self, data=None):
+        self.counts = array('Q')
+        if data:
+            self.counts.frombytes(data)
+        else:
+            self.counts.frombytes(bytes(8 * HISTOGRAM_BUCKETS))
+
+    @staticmethod
+    def bucket(duration_ms):
+        if duration_ms <= HISTOGRAM_MIN_MS:
+            return 0
+        index = int(math.log(duration_ms / HISTOGRAM_MIN_MS, HISTOGRAM_RATIO)) + 1
+        return min(index, HISTOGRAM_BUCKETS - 1)
+
+    @staticmethod
+    def upper_bound(index):
+        return HISTOGRAM_MIN_MS * HISTOGRAM_RATIO ** index
+
+    def add(self, duration_ms, count=1):
+        self.counts[self.bucket(duration_ms)] += count
+
+    def merge(self, other):
+        for index, count in enumerate(other.counts):
+            self.counts[index] += count
+
+    def total(self):
+        return sum(self.counts)
+
+    def quantile(self, q):
+        """Верхняя граница корзины, в которую попадает квантиль q (0..1)."""
+        total = self.total()
+        if not total:
+            return None
+        rank = q * total
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return round(self.upper_bound(index), 1)
+        return round(self.upper_bound(HISTOGRAM_BUCKETS - 1), 1)
+
+    def to_bytes(self):
+        return self.counts.tobytes()
+
+
+def count_query(conn, cursor, statement, parameters, context, executemany):
+    """Обработчик before_cursor_execute: считает запросы к базе в текущем HTTP-запросе."""
+    if has_request_context() and 'visit_queries' in g:
+        g.visit_queries += 1
+
+
+def apply_latency(records):
+    """Добавляет длительности пакета посещений к часовым гистограммам в текущей транзакции."""
+    groups = {}
+    for record in records:
+        if record.get('duration_ms') is None:
+            continue
+        key = (record['path_id'], hour_bucket(record['created_at']))
+        group = groups.get(key)
+        if group is None:
+            group = groups[key] = {'histogram': LatencyHistogram(), 'count': 0, 'total_ms': 0.0,
+                                   'total_queries': 0, 'errors': 0}
+        weight = record.get('weight', 1)
+        group['histogram'].add(record['duration_ms'], weight)
+        group['count'] += weight
+        group['total_ms'] += record['duration_ms'] * weight
+        group['total_queries'] += (record.get('query_count') or 0) * weight
+        if (record.get('status_code') or 0) >= 500:
+            group['errors'] += weight
+
+    for (path_id, hour), group in groups.items():
+        row = db.session.get(PageLatencyRollup, (path_id, hour))
+        if row is None:
+            row = PageLatencyRollup(path_id=path_id, hour=hour, count=0, total_ms=0.0, total_queries=0, errors=0,
+                                    histogram=LatencyHistogram().to_bytes())
+            db.session.add(row)
+        histogram = LatencyHistogram(row.histogram)
+        histogram.merge(group['histogram'])
+        row.histogram = histogram.to_bytes()
+        row.count += group['count']
+        row.total_ms += group['total_ms']
+        row.total_queries += group['total_queries']
+        row.errors += group['errors']
+
+
+def latency_report(date_from=None, date_to=None):
+    """Квантили p50/p95/p99 по страницам за период, от самых медленных (по p95)."""
+    query = PageLatencyRollup.query
+    if date_from:
+        query = query.filter(PageLatencyRollup.hour >= date_from)
+    if date_to:
+        query = query.filter(PageLatencyRollup.hour < date_to)
+
+    pages = {}
+    for row in query.yield_per(1000):
+        page = pages.get(row.path_id)
+        if page is None:
+            page = pages[row.path_id] = {'histogram': LatencyHistogram(), 'count': 0, 'total_ms': 0.0,
+                                      'total_queries': 0, 'errors': 0}
+        page['histogram'].merge(LatencyHistogram(row.histogram))
+        page['count'] += row.count
+        page['total_ms'] += row.total_ms
+        page['total_queries'] += row.total_queries
+        page['errors'] += row.errors
+
+    names = path_names(pages)
+    report = []
+    for path_id, page in pages.items():
+        histogram = page['histogram']
+        report.append({
+            'path': names.get(path_id),
+            'count': page['count'],
+            'p50': histogram.quantile(0.50),
+            'p95': histogram.quantile(0.95),
+            'p99': histogram.quantile(0.99),
+            'avg_ms': round(page['total_ms'] / page['count'], 1) if page['count'] else None,
+            'avg_queries': round(page['total_queries'] / page['count'], 1) if page['count'] else None,
+            'errors': page['errors'],
+        })
+    report.sort(key=lambda page: page['p95'] or 0, reverse=True)
+    return report
@@ -0,0 +1,96 @@
+# visit_live.py
+import collections
+import json
+import threading
+import time
+
+
+class VisitRing:
+    """Последние посещения процесса в кольцевом буфере фиксированного размера.
+
+    Каждое событие получает возрастающий номер, по нему подписчик SSE
+    продолжает поток после переподключения (Last-Event-ID).
+    Буфер свой у каждого воркера, база данных не читается.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._condition = threading.Condition()
+        self._events = collections.deque(maxlen=200)
+        self._seconds = collections.deque(maxlen=60)  # [секунда, посещений] за последнюю минуту
+        self.seq = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('VISIT_LIVE_BUFFER', 200)  # Событий в буфере каждого воркера
+        # Поток держит воркер (при sync-воркерах gunicorn - целиком), поэтому соединение короткое:
+        # после него браузер переподключается сам через retry с Last-Event-ID и ничего не теряет
+        app.config.setdefault('VISIT_LIVE_STREAM_SECONDS', 20)
+        self.app = app
+        self._events = collections.deque(maxlen=app.config['VISIT_LIVE_BUFFER'])
+        app.extensions['visit_live'] = self
+
+    def publish(self, path, user, status_code, duration_ms, moment=None):
+        moment = moment or time.time()
+        second = int(moment)
+        with self._condition:
+            self.seq += 1
+            self._events.append({
+                'id': self.seq,
+                'time': moment,
+                'path': path,
+                'user': user,
+                'status': status_code,
+                'duration_ms': round(duration_ms, 1),
+            })
+            if self._seconds and self._seconds[-1][0] == second:
+                self._seconds[-1][1] += 1
+            else:
+                self._seconds.append([second, 1])
+            self._condition.notify_all()
+
+    def since(self, seq):
+        """События с номером больше seq (все, что осталось в буфере)."""
+        with self._condition:
+            return [event for event in self._events if event['id'] > seq]
+
+    def wait(self, seq, timeout):
+        """Ждет событие новее seq не дольше timeout секунд."""
+        with self._condition:
+            self._condition.wait_for(lambda: self.seq > seq, timeout)
+            return [event for event in self._events if event['id'] > seq]
+
+    def counters(self, now=None):
+        """Посещений в секунду за последнюю минуту: [[секунда, посещений], ...]."""
+        now = int(now or time.time())
+        with self._condition:
+            counts = {second: count for second, count in self._seconds}
+        return [[second, counts.get(second, 0)] for second in range(now - 59, now + 1)]
+
+    def stream(self, last_id=None):
+        """Генератор text/event-stream: хвост буфера, затем новые события и счетчики раз в секунду."""
+        config = self.app.config
+        deadline = time.monotonic() + config['VISIT_LIVE_STREAM_SECONDS']
+        seq = last_id or 0
+        if seq > self.seq:
+            # Номер из другого воркера или до перезапуска: отдаем весь буфер
+            seq = 0
+        yield 'retry: 2000\n\n'
+        events = self.since(seq)
+        last_sent = time.monotonic() - 1  # Первые счетчики - сразу вместе с хвостом буфера
+        while True:
+            for event in events:
+                seq = event['id']
+                yield f'id: {seq}\nevent: visit\ndata: {json.dumps(event, ensure_ascii=False)}\n\n'
+            now = time.monotonic()
+            # Счетчики раз в секунду, они же не дают прокси закрыть соединение
+            if now - last_sent >= 1:
+                yield f'event: counters\ndata: {json.dumps(self.counters())}\n\n'
+                last_sent = now
+            if now >= deadline:
+                return
+            events = self.wait(seq, timeout=min(1.0, max(deadline - now, 0)))
+
+
+visit_ring = VisitRing()
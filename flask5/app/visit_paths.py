@@ -0,0 +1,83 @@
+# visit_paths.py
+import threading
+from collections import OrderedDict
+
+from sqlalchemy.dialects.sqlite import insert
+
+from models import VisitPath, db
+
+# Путей в SQL-запросе за раз (ограничение SQLite на число параметров)
+_CHUNK = 500
+
+
+class PathCache:
+    """Словарь путь -> id для пути записи: LRU в памяти процесса, промахи - в таблицу visit_path.
+
+    id пути никогда не меняется, поэтому кэш не нужно сбрасывать между воркерами.
+    """
+
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self._ids = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, path):
+        with self._lock:
+            path_id = self._ids.get(path)
+            if path_id is not None:
+                self._ids.move_to_end(path)
+                self.hits += 1
+            return path_id
+
+    def put(self, path, path_id):
+        with self._lock:
+            self._ids[path] = path_id
+            self._ids.move_to_end(path)
+            while len(self._ids) > self.maxsize:
+                self._ids.popitem(last=False)
+
+    def resolve(self, paths):
+        """id для набора путей; недостающие пути добавляются в текущей транзакции."""
+        result = {}
+        missing = []
+        for path in set(paths):
+            path_id = self.get(path)
+            if path_id is None:
+                missing.append(path)
+            else:
+                result[path] = path_id
+        if not missing:
+            return result
+
+        with self._lock:
+            self.misses += len(missing)
+        for start in range(0, len(missing), _CHUNK):
+            chunk = missing[start:start + _CHUNK]
+            db.session.execute(insert(VisitPath).values([{'path': path} for path in chunk])
+                               .on_conflict_do_nothing(index_elements=['path']))
+            for path_id, path in db.session.query(VisitPath.id, VisitPath.path).filter(VisitPath.path.in_(chunk)):
+                result[path] = path_id
+                self.put(path, path_id)
+        return result
+
+    def clear(self):
+        with self._lock:
+            self._ids.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._ids), 'hits': self.hits, 'misses': self.misses}
+
+
+path_cache = PathCache()
+
+
+def path_names(path_ids):
+    """Обратное отображение id -> путь для отчетов."""
+    names = {}
+    path_ids = list(set(path_ids))
+    for start in range(0, len(path_ids), _CHUNK):
+        names.update(db.session.query(VisitPath.id, VisitPath.path).filter(VisitPath.id.in_(path_ids[start:start + _CHUNK])))
+    return names
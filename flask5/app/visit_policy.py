@@ -0,0 +1,81 @@
+# visit_policy.py
+import fnmatch
+import functools
+import random
+import re
+import threading
+
+
+@functools.lru_cache(maxsize=32)
+def _compile(patterns):
+    """Объединяет шаблоны вида /static/* в одно регулярное выражение."""
+    if not patterns:
+        return None
+    return re.compile('|'.join(f'(?:{fnmatch.translate(pattern)})' for pattern in patterns))
+
+
+class VisitPolicy:
+    """Какие посещения записывать в журнал и с каким весом.
+
+    Запись сохраняется с вероятностью 1/N и весом N, поэтому суммы весов
+    в отчетах остаются несмещенной оценкой числа посещений.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.multiplier = 1  # Множитель адаптивного прореживания (степень двойки)
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('VISIT_LOG_INCLUDE', ['*'])
+        app.config.setdefault('VISIT_LOG_EXCLUDE', ['/static/*', '/favicon.ico'])
+        app.config.setdefault('VISIT_LOG_SAMPLE_EVERY', {})  # {шаблон пути: N} - писать одно посещение из N
+        app.config.setdefault('VISIT_LOG_ADAPTIVE', False)
+        app.config.setdefault('VISIT_LOG_ADAPTIVE_TARGET_MS', 50)  # Целевое время сброса пакета
+        app.config.setdefault('VISIT_LOG_ADAPTIVE_MAX', 64)
+        self.app = app
+        app.extensions['visit_policy'] = self
+
+    def is_logged(self, path):
+        config = self.app.config
+        include = _compile(tuple(config['VISIT_LOG_INCLUDE']))
+        exclude = _compile(tuple(config['VISIT_LOG_EXCLUDE']))
+        if include is None or not include.match(path):
+            return False
+        return exclude is None or not exclude.match(path)
+
+    def sample_every(self, path):
+        """N для пути: первый подходящий шаблон из VISIT_LOG_SAMPLE_EVERY."""
+        every = 1
+        for pattern, value in self.app.config['VISIT_LOG_SAMPLE_EVERY'].items():
+            if fnmatch.fnmatchcase(path, pattern):
+                every = value
+                break
+        return max(int(every), 1) * self.multiplier
+
+    def weight(self, path):
+        """None - путь не журналируется, 0 - посещение пропущено выборкой, иначе вес записи."""
+        if not self.is_logged(path):
+            return None
+        every = self.sample_every(path)
+        if every > 1 and random.random() * every >= 1:
+            return 0
+        return every
+
+    def adjust(self, flush_ms):
+        """Удваивает прореживание при медленной записи и снижает, когда запись снова быстрая."""
+        config = self.app.config
+        if not config['VISIT_LOG_ADAPTIVE']:
+            self.multiplier = 1
+            return
+        target = config['VISIT_LOG_ADAPTIVE_TARGET_MS']
+        with self._lock:
+            if flush_ms > target:
+                self.multiplier = min(self.multiplier * 2, config['VISIT_LOG_ADAPTIVE_MAX'])
+            elif flush_ms < target / 2 and self.multiplier > 1:
+                self.multiplier //= 2
+
+
+visit_policy = VisitPolicy()
@@ -0,0 +1,95 @@
+# visit_rollups.py
+import datetime
+from collections import Counter
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy.dialects.sqlite import insert
+
+from models import PageVisitRollup, UserVisitRollup, VisitLog, db
+from visit_archive import archived_until
+
+
+def hour_bucket(created_at):
+    """Начало часа, к которому относится посещение (UTC, без tzinfo)."""
+    if created_at.tzinfo is not None:
+        created_at = created_at.astimezone(datetime.UTC).replace(tzinfo=None)
+    return created_at.replace(minute=0, second=0, microsecond=0)
+
+
+# Ограничение SQLite на число параметров в одном запросе
+UPSERT_CHUNK = 300
+
+
+def _upsert(model, key, counts):
+    rows = [{key: value, 'hour': hour, 'count': count} for (value, hour), count in counts.items()]
+    for start in range(0, len(rows), UPSERT_CHUNK):
+        stmt = insert(model.__table__).values(rows[start:start + UPSERT_CHUNK])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[key, 'hour'],
+            set_={'count': model.__table__.c.count + stmt.excluded.count},
+        )
+        db.session.execute(stmt)
+
+
+def apply_rollups(records):
+    """Добавляет пакет посещений к часовым агрегатам в текущей транзакции."""
+    pages = Counter()
+    users = Counter()
+    for record in records:
+        hour = hour_bucket(record['created_at'])
+        weight = record.get('weight', 1)
+        pages[(record['path_id'], hour)] += weight
+        # Гостевые посещения в отчет по пользователям не попадают
+        if record['user_id'] is not None:
+            users[(record['user_id'], hour)] += weight
+    _upsert(PageVisitRollup, 'path_id', pages)
+    _upsert(UserVisitRollup, 'user_id', users)
+
+
+def _rebuild(model, column, chunk_size, since=None):
+    hour_expr = db.func.strftime('%Y-%m-%d %H', VisitLog.created_at)
+    # Выборочные записи учитываются со своим весом
+    query = db.session.query(column, hour_expr, db.func.sum(db.func.coalesce(VisitLog.weight, 1))) \
+        .filter(VisitLog.created_at.isnot(None)) \
+        .group_by(column, hour_expr)
+    if since is not None:
+        query = query.filter(VisitLog.created_at >= since)
+    if model is UserVisitRollup:
+        query = query.filter(VisitLog.user_id.isnot(None))
+
+    key = column.key
+    counts = Counter()
+    for value, hour, count in query.yield_per(chunk_size):
+        counts[(value, datetime.datetime.strptime(hour, '%Y-%m-%d %H'))] = count
+        if len(counts) >= chunk_size:
+            _upsert(model, key, counts)
+            counts.clear()
+    _upsert(model, key, counts)
+
+
+def backfill_rollups(chunk_size=1000):
+    """Пересчитывает агрегаты по рабочей таблице журнала.
+
+    Часы заархивированных месяцев не трогаются: их записей в таблице уже
+    нет, и агрегаты остаются единственной сводкой по ним.
+    """
+    since = archived_until()
+    for model in (PageVisitRollup, UserVisitRollup):
+        query = db.session.query(model)
+        if since is not None:
+            query = query.filter(model.hour >= since)
+        query.delete(synchronize_session=False)
+    _rebuild(PageVisitRollup, VisitLog.path_id, chunk_size, since)
+    _rebuild(UserVisitRollup, VisitLog.user_id, chunk_size, since)
+    db.session.commit()
+
+
+@click.command('backfill-visit-rollups')
+@click.option('--chunk-size', default=1000, show_default=True, help='Строк агрегатов в одном INSERT.')
+@with_appcontext
+def backfill_rollups_command(chunk_size):
+    """Заполняет часовые агрегаты по записям журнала в рабочей таблице (архивные месяцы сохраняются)."""
+    backfill_rollups(chunk_size)
+    click.echo(f'Страниц-часов: {PageVisitRollup.query.count()}, '
+               f'пользователей-часов: {UserVisitRollup.query.count()}')
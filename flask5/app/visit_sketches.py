@@ -0,0 +1,278 @@
+# visit_sketches.py
+import datetime
+import hashlib
+import json
+import math
+import threading
+import time
+from array import array
+
+from models import VisitSketch, db
+
+# Ключ HyperLogLog по всем страницам сразу
+ALL_PATHS = '*'
+
+
+def _hash64(value, salt=b''):
+    return int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=8, salt=salt).digest(), 'big')
+
+
+class HyperLogLog:
+    """Оценка числа уникальных значений: 2**p однобайтовых регистров (4 КБ при p=12)."""
+
+    def __init__(self, p=12, registers=None):
+        self.p = p
+        self.m = 1 << p
+        self.registers = bytearray(registers) if registers is not None else bytearray(self.m)
+
+    def add(self, value):
+        x = _hash64(value)
+        index = x >> (64 - self.p)
+        rest = x & ((1 << (64 - self.p)) - 1)
+        rank = (64 - self.p) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def count(self):
+        alpha = 0.7213 / (1 + 1.079 / self.m)
+        estimate = alpha * self.m * self.m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * self.m and zeros:
+            # Поправка для малых значений (linear counting)
+            estimate = self.m * math.log(self.m / zeros)
+        return int(round(estimate))
+
+    def to_bytes(self):
+        return bytes(self.registers)
+
+    @classmethod
+    def from_bytes(cls, data):
+        return cls(p=int(math.log2(len(data))), registers=data)
+
+
+class CountMinSketch:
+    """Счетчики частот с ошибкой только в большую сторону."""
+
+    def __init__(self, width=2048, depth=4, table=None):
+        self.width = width
+        self.depth = depth
+        self.table = array('Q')
+        if table is not None:
+            self.table.frombytes(table)
+        else:
+            self.table.frombytes(bytes(8 * width * depth))
+
+    def _cells(self, value):
+        h1 = _hash64(value)
+        h2 = _hash64(value, salt=b'cms') | 1
+        return [row * self.width + (h1 + row * h2) % self.width for row in range(self.depth)]
+
+    def add(self, value, count=1):
+        for cell in self._cells(value):
+            self.table[cell] += count
+
+    def estimate(self, value):
+        return min(self.table[cell] for cell in self._cells(value))
+
+    def merge(self, other):
+        for cell, count in enumerate(other.table):
+            self.table[cell] += count
+
+    def to_bytes(self):
+        return self.table.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data, width=2048):
+        return cls(width=width, depth=len(data) // 8 // width, table=data)
+
+
+class DaySketch:
+    """Скетчи одного дня: уникальные посетители по страницам и частые страницы.
+
+    HyperLogLog (4 КБ) заводится не больше чем для max_paths страниц; сверх
+    этого - только для частых страниц, по которым строится отчет, и не
+    больше top_k штук.
+    """
+
+    def __init__(self, top_k, max_paths=1000):
+        self.top_k = top_k
+        self.max_paths = max_paths
+        self.uniques = {}  # путь -> HyperLogLog
+        self.stored_paths = 0  # HyperLogLog дня в базе, которые не загружены в uniques
+        self.hits = CountMinSketch()
+        self.candidates = {}  # путь -> оценка, не больше top_k записей
+
+    def _may_track(self, key):
+        tracked = len(self.uniques) + self.stored_paths
+        if key == ALL_PATHS or tracked <= self.max_paths:
+            return True
+        return key in self.candidates and tracked <= self.max_paths + self.top_k
+
+    def add(self, path, visitor):
+        # Страница становится кандидатом после offer, поэтому HyperLogLog сверх лимита - со следующего посещения
+        for key in (path, ALL_PATHS):
+            hll = self.uniques.get(key)
+            if hll is None:
+                if not self._may_track(key):
+                    continue
+                hll = self.uniques[key] = HyperLogLog()
+            hll.add(visitor)
+        self.hits.add(path)
+        self.offer(path, self.hits.estimate(path))
+
+    def offer(self, path, estimate):
+        self.candidates[path] = estimate
+        if len(self.candidates) > self.top_k:
+            # Вытесняем самого редкого кандидата
+            del self.candidates[min(self.candidates, key=self.candidates.get)]
+
+    def merge(self, other):
+        self.hits.merge(other.hits)
+        for path in set(self.candidates) | set(other.candidates):
+            self.offer(path, self.hits.estimate(path))
+        for key, hll in other.uniques.items():
+            if key in self.uniques:
+                self.uniques[key].merge(hll)
+            elif self._may_track(key):
+                self.uniques[key] = HyperLogLog(registers=hll.registers)
+
+    def top(self, limit=None):
+        paths = sorted(self.candidates, key=self.candidates.get, reverse=True)[:limit]
+        return [(path, self.hits.estimate(path), self.uniques[path].count() if path in self.uniques else 0)
+                for path in paths]
+
+    def unique_visitors(self):
+        hll = self.uniques.get(ALL_PATHS)
+        return hll.count() if hll else 0
+
+
+class VisitSketches:
+    """Скетчи посещений процесса с периодическим слиянием в базу.
+
+    В памяти копятся только изменения с последнего сохранения: HyperLogLog
+    сливается по максимуму, Count-Min - сложением, поэтому сохранения разных
+    воркеров gunicorn не мешают друг другу.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._lock = threading.Lock()
+        self._days = {}
+        self._last_persist = time.monotonic()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('VISIT_SKETCH_TOP_K', 20)
+        app.config.setdefault('VISIT_SKETCH_MAX_PATHS', 1000)  # Страниц с HyperLogLog за день, кроме частых
+        app.config.setdefault('VISIT_SKETCH_PERSIST_SECONDS', 30)
+        self.app = app
+        app.extensions['visit_sketches'] = self
+
+    def add(self, path, visitor, moment=None):
+        day = (moment or datetime.datetime.now(datetime.UTC)).strftime('%Y-%m-%d')
+        with self._lock:
+            sketch = self._days.get(day)
+            if sketch is None:
+                sketch = self._days[day] = self._new_day()
+            sketch.add(path, visitor)
+
+    def persist_if_due(self, final=False):
+        if final or time.monotonic() - self._last_persist >= self.app.config['VISIT_SKETCH_PERSIST_SECONDS']:
+            self.persist()
+
+    def persist(self):
+        """Сливает накопленное в базу; при ошибке изменения возвращаются в память."""
+        with self._lock:
+            pending, self._days = self._days, {}
+            self._last_persist = time.monotonic()
+        if not pending:
+            return
+        try:
+            self._lock_for_write()
+            for day, sketch in pending.items():
+                stored = self._load_day(day, paths=sketch.uniques.keys(), for_update=True)
+                stored.merge(sketch)
+                self._save_day(day, stored)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            self.app.logger.exception('Не удалось сохранить скетчи посещений')
+            with self._lock:
+                for day, sketch in pending.items():
+                    if day in self._days:
+                        sketch.merge(self._days[day])
+                    self._days[day] = sketch
+
+    def day(self, day):
+        """Скетч дня: сохраненное в базе плюс еще не сохраненное этим процессом.
+
+        HyperLogLog загружаются только для частых страниц, поэтому стоимость
+        не зависит ни от трафика, ни от числа разных страниц.
+        """
+        sketch = self._load_day(day, paths=())
+        with self._lock:
+            local = self._days.get(day)
+            if local is not None:
+                sketch.merge(local)
+        stored = self._load_day(day, paths=set(sketch.candidates) | {ALL_PATHS})
+        for key, hll in stored.uniques.items():
+            if key in sketch.uniques:
+                sketch.uniques[key].merge(hll)
+            else:
+                sketch.uniques[key] = hll
+        return sketch
+
+    def _new_day(self):
+        return DaySketch(self.app.config['VISIT_SKETCH_TOP_K'], self.app.config['VISIT_SKETCH_MAX_PATHS'])
+
+    def _lock_for_write(self):
+        """Блокировка записи до чтения скетчей, чтобы воркеры не затирали слияния друг друга."""
+        connection = db.session.connection()
+        if connection.dialect.name != 'sqlite':
+            return  # Строки cms и topk читаются FOR UPDATE в _load_day
+        # pysqlite открывает транзакцию только перед первой записью, и чтение шло бы без блокировки.
+        # Если транзакция уже открыта, в ней была запись и блокировка уже взята.
+        if not connection.connection.dbapi_connection.in_transaction:
+            connection.exec_driver_sql('BEGIN IMMEDIATE')
+
+    def _load_day(self, day, paths=None, for_update=False):
+        """Загружает скетч дня; paths ограничивает набор загружаемых HyperLogLog."""
+        sketch = self._new_day()
+        query = VisitSketch.query.filter(VisitSketch.day == day, VisitSketch.kind != 'hll')
+        rows = list(query.with_for_update() if for_update else query)
+        if paths is None:
+            rows += VisitSketch.query.filter_by(day=day, kind='hll').all()
+        else:
+            paths = list(paths)
+            for start in range(0, len(paths), 500):
+                rows += VisitSketch.query.filter(VisitSketch.day == day, VisitSketch.kind == 'hll',
+                                                 VisitSketch.key.in_(paths[start:start + 500])).all()
+            # Незагруженные HyperLogLog тоже считаются в лимит страниц
+            total = VisitSketch.query.filter_by(day=day, kind='hll').count()
+            sketch.stored_paths = total - sum(1 for row in rows if row.kind == 'hll')
+        for row in rows:
+            if row.kind == 'hll':
+                sketch.uniques[row.key] = HyperLogLog.from_bytes(row.data)
+            elif row.kind == 'cms':
+                sketch.hits = CountMinSketch.from_bytes(row.data)
+            elif row.kind == 'topk':
+                sketch.candidates = json.loads(row.data.decode('utf-8'))
+        return sketch
+
+    def _save_day(self, day, sketch):
+        rows = [('hll', key, hll.to_bytes()) for key, hll in sketch.uniques.items()]
+        rows.append(('cms', '', sketch.hits.to_bytes()))
+        rows.append(('topk', '', json.dumps(sketch.candidates).encode('utf-8')))
+        for kind, key, data in rows:
+            row = db.session.get(VisitSketch, (kind, key, day))
+            if row is None:
+                db.session.add(VisitSketch(kind=kind, key=key, day=day, data=data))
+            else:
+                row.data = data
+
+
+visit_sketches = VisitSketches()
@@ -0,0 +1,258 @@
+# visit_spool.py
+import atexit
+import datetime
+import glob
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+
+import click
+from flask.cli import with_appcontext
+
+from models import VisitSpoolCheckpoint, db
+from visit_paths import path_cache
+from visit_writer import store_visits
+
+# Заголовок записи: длина и CRC32 тела (little-endian)
+HEADER = struct.Struct('<II')
+# Порядок полей посещения в теле записи
+FIELDS = ('path', 'user_id', 'created_at', 'weight', 'duration_ms', 'status_code', 'query_count')
+# Активный сегмент дописывается процессом-владельцем, закрытый больше не меняется
+ACTIVE_SUFFIX = '.open'
+SEALED_SUFFIX = '.seg'
+# Сколько байт сегмента читается за раз
+READ_CHUNK = 1 << 20
+
+
+def encode_record(record):
+    values = [record[field] for field in FIELDS]
+    values[2] = values[2].isoformat()
+    body = json.dumps(values, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return HEADER.pack(len(body), zlib.crc32(body)) + body
+
+
+def decode_record(body):
+    record = dict(zip(FIELDS, json.loads(body.decode('utf-8'))))
+    record['created_at'] = datetime.datetime.fromisoformat(record['created_at'])
+    return record
+
+
+def read_records(path, offset=0):
+    """Записи сегмента начиная с offset: пары (запись, смещение после нее).
+
+    Чтение останавливается на недописанной или поврежденной записи. Файл
+    читается порциями по READ_CHUNK байт, в памяти - порция и хвост
+    незаконченной записи.
+    """
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        data = b''
+        eof = False
+        while not eof:
+            chunk = f.read(READ_CHUNK)
+            eof = not chunk
+            data += chunk
+            position = 0
+            while position + HEADER.size <= len(data):
+                length, crc = HEADER.unpack_from(data, position)
+                start = position + HEADER.size
+                if start + length > len(data):
+                    break  # Тело еще не прочитано
+                body = data[start:start + length]
+                if zlib.crc32(body) != crc:
+                    return
+                position = start + length
+                offset += HEADER.size + length
+                yield decode_record(body), offset
+            data = data[position:]
+
+
+def _segment_pid(name):
+    """pid процесса-владельца из имени visits-<pid>-<время>.open."""
+    try:
+        return int(name.split('-')[1])
+    except (IndexError, ValueError):
+        return None
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class VisitSpool:
+    """Журнал посещений в локальных файлах: одна запись - один вызов write.
+
+    Каждый процесс пишет в свой сегмент и закрывает его по достижении
+    VISIT_SPOOL_SEGMENT_BYTES. Загрузка в базу (flask ingest-visits) идет
+    отдельно и не задерживает обработку запросов.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._lock = threading.Lock()
+        self._fd = None
+        self._pid = None
+        self._path = None
+        self._size = 0
+        self.appended = 0
+        self.failed = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('VISIT_LOG_SPOOL', False)
+        app.config.setdefault('VISIT_SPOOL_DIR', None)  # По умолчанию instance/visit_spool
+        app.config.setdefault('VISIT_SPOOL_SEGMENT_BYTES', 16 * 1024 * 1024)
+        app.config.setdefault('VISIT_SPOOL_FSYNC', False)  # fsync после каждой записи (переживает сбой ОС)
+        self.app = app
+        app.extensions['visit_spool'] = self
+        atexit.register(self.close)
+
+    def spool_dir(self):
+        path = self.app.config['VISIT_SPOOL_DIR'] or os.path.join(self.app.instance_path, 'visit_spool')
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def append(self, record):
+        """Дописывает посещение в сегмент. Возвращает False при ошибке записи."""
+        data = encode_record(record)
+        with self._lock:
+            try:
+                if self._fd is None or self._pid != os.getpid():
+                    self._open()
+                os.write(self._fd, data)
+                if self.app.config['VISIT_SPOOL_FSYNC']:
+                    os.fsync(self._fd)
+                self._size += len(data)
+                self.appended += 1
+                if self._size >= self.app.config['VISIT_SPOOL_SEGMENT_BYTES']:
+                    self._seal()
+            except OSError:
+                self.failed += 1
+                self.app.logger.exception('Не удалось записать посещение в спул')
+                return False
+        return True
+
+    def close(self):
+        with self._lock:
+            if self._fd is not None and self._pid == os.getpid():
+                self._seal()
+
+    def stats(self):
+        with self._lock:
+            return {'segment': os.path.basename(self._path) if self._path else None, 'segment_bytes': self._size,
+                    'appended': self.appended, 'failed': self.failed}
+
+    def _open(self):
+        # После fork дескриптор родителя не используем: у каждого процесса свой сегмент
+        self._pid = os.getpid()
+        name = f'visits-{self._pid}-{time.time_ns()}{ACTIVE_SUFFIX}'
+        self._path = os.path.join(self.spool_dir(), name)
+        self._fd = os.open(self._path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        self._size = 0
+
+    def _seal(self):
+        os.close(self._fd)
+        os.replace(self._path, self._path[:-len(ACTIVE_SUFFIX)] + SEALED_SUFFIX)
+        self._fd = None
+        self._path = None
+        self._size = 0
+
+    def segments(self):
+        """Сегменты по времени создания: (путь, закрыт ли сегмент)."""
+        result = []
+        for path in glob.glob(os.path.join(self.spool_dir(), 'visits-*')):
+            name = os.path.basename(path)
+            if name.endswith(SEALED_SUFFIX):
+                result.append((path, True))
+            elif name.endswith(ACTIVE_SUFFIX):
+                # Сегмент упавшего процесса уже никто не допишет
+                pid = _segment_pid(name)
+                if pid == os.getpid():
+                    sealed = path != self._path
+                else:
+                    sealed = pid is None or not _pid_alive(pid)
+                result.append((path, sealed))
+        result.sort(key=lambda item: os.path.basename(item[0]).split('-')[-1].split('.')[0].zfill(20))
+        return result
+
+    def ingest(self, batch_size=5000):
+        """Загружает новые записи сегментов в журнал. Возвращает число загруженных записей.
+
+        Записи и смещение сегмента сохраняются в одной транзакции, поэтому после
+        сбоя загрузка продолжается с места последнего commit без дублей.
+        """
+        total = 0
+        for path, sealed in self.segments():
+            # Имя без суффикса: при закрытии сегмент переименовывается, а смещение должно сохраниться
+            name = os.path.splitext(os.path.basename(path))[0]
+            checkpoint = db.session.get(VisitSpoolCheckpoint, name)
+            if checkpoint is None:
+                checkpoint = VisitSpoolCheckpoint(segment=name, offset=0)
+                db.session.add(checkpoint)
+
+            batch = []
+            offset = checkpoint.offset
+            try:
+                for record, end in read_records(path, checkpoint.offset):
+                    batch.append(record)
+                    offset = end
+                    if len(batch) >= batch_size:
+                        total += self._store(batch, checkpoint, offset)
+                        batch = []
+            except FileNotFoundError:
+                if sealed:
+                    raise
+                # Владелец закрыл сегмент между glob и open: закрытый файл загрузится при следующем запуске
+                if checkpoint in db.session.new:
+                    db.session.expunge(checkpoint)
+                continue
+            if batch:
+                total += self._store(batch, checkpoint, offset)
+
+            if sealed:
+                if offset < os.path.getsize(path):
+                    self.app.logger.warning('Сегмент спула %s поврежден после смещения %s', name, offset)
+                # Сначала файл: после сбоя останется лишняя строка смещения, а не повторная загрузка
+                os.remove(path)
+                if checkpoint in db.session.new:
+                    db.session.expunge(checkpoint)
+                else:
+                    db.session.delete(checkpoint)
+                db.session.commit()
+            else:
+                db.session.commit()
+        return total
+
+    def _store(self, batch, checkpoint, offset):
+        try:
+            store_visits(batch)
+            checkpoint.offset = offset
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            path_cache.clear()
+            raise
+        return len(batch)
+
+
+visit_spool = VisitSpool()
+
+
+@click.command('ingest-visits')
+@click.option('--batch-size', default=5000, show_default=True, help='Записей в одной транзакции.')
+@with_appcontext
+def ingest_visits_command(batch_size):
+    """Загружает посещения из файлов спула в журнал посещений."""
+    started = time.perf_counter()
+    count = visit_spool.ingest(batch_size)
+    click.echo(f'Загружено посещений: {count} за {time.perf_counter() - started:.1f} с')
@@ -0,0 +1,204 @@
+# visit_writer.py
+import atexit
+import datetime
+import os
+import queue
+import threading
+import time
+
+from models import VisitLog, db
+from visit_rollups import apply_rollups
+from visit_latency import apply_latency
+from visit_paths import path_cache
+
+# Маркер остановки фонового потока
+_STOP = object()
+
+
+def store_visits(records):
+    """Добавляет пакет посещений в журнал и агрегаты в текущей транзакции (без commit)."""
+    # Пути хранятся в словаре visit_path, в журнал пишется только их id
+    path_ids = path_cache.resolve(record['path'] for record in records)
+    for record in records:
+        record['path_id'] = path_ids[record['path']]
+    # Один многострочный INSERT на весь пакет
+    db.session.execute(VisitLog.__table__.insert(),
+                       [{key: value for key, value in record.items() if key != 'path'} for record in records])
+    # Часовые агрегаты обновляются в той же транзакции
+    apply_rollups(records)
+    apply_latency(records)
+
+
+class VisitWriter:
+    """Отложенная запись журнала посещений пакетами в фоновом потоке."""
+
+    def __init__(self, app=None):
+        self.app = None
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.flushes = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self._total_flush_ms = 0.0
+        self.periodic = []  # Функции func(final), которые фоновый поток вызывает после каждого цикла
+        self.flush_listeners = []  # Функции func(flush_ms), вызываемые после записи пакета
+        self.spool = None  # VisitSpool: посещения пишутся в файл, а в базу их загружает flask ingest-visits
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('VISIT_LOG_ASYNC', True)
+        app.config.setdefault('VISIT_LOG_BATCH_SIZE', 500)  # Записей в одном INSERT
+        app.config.setdefault('VISIT_LOG_FLUSH_INTERVAL_MS', 1000)  # Максимальная задержка записи
+        app.config.setdefault('VISIT_LOG_QUEUE_SIZE', 10000)
+        app.config.setdefault('VISIT_LOG_PUT_TIMEOUT_MS', 0)  # 0 - не ждать, а отбрасывать запись
+        self.app = app
+        app.extensions['visit_writer'] = self
+        atexit.register(self.stop)
+
+    def enqueue(self, path, user_id, created_at=None, weight=1, duration_ms=None, status_code=None, query_count=None):
+        """Ставит посещение в очередь. Возвращает False, если запись отброшена.
+
+        weight - сколько посещений представляет запись при выборочном журналировании.
+        """
+        record = {
+            'path': path,
+            'user_id': user_id,
+            'created_at': created_at or datetime.datetime.now(datetime.UTC),
+            'weight': weight,
+            'duration_ms': duration_ms,
+            'status_code': status_code,
+            'query_count': query_count,
+        }
+        if self.spool is not None and self.app.config['VISIT_LOG_SPOOL']:
+            written = self.spool.append(record)
+            if self.app.config['VISIT_LOG_ASYNC']:
+                # Поток нужен только для периодических задач (сохранение скетчей)
+                self._ensure_started()
+            return written
+
+        if not self.app.config['VISIT_LOG_ASYNC']:
+            self._write([record])
+            return True
+
+        self._ensure_started()
+        timeout = self.app.config['VISIT_LOG_PUT_TIMEOUT_MS'] / 1000
+        try:
+            if timeout > 0:
+                self._queue.put(record, timeout=timeout)
+            else:
+                self._queue.put_nowait(record)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+        return True
+
+    def stop(self, timeout=10):
+        """Останавливает поток, предварительно записав все накопленное."""
+        thread = self._thread
+        if thread is None or not thread.is_alive() or self._pid != os.getpid():
+            return
+        self._queue.put(_STOP)
+        thread.join(timeout)
+        self._thread = None
+
+    def stats(self):
+        with self._lock:
+            return {
+                'queue_depth': self._queue.qsize() if self._queue is not None else 0,
+                'queue_size': self.app.config['VISIT_LOG_QUEUE_SIZE'],
+                'written': self.written,
+                'dropped': self.dropped,
+                'failed': self.failed,
+                'flushes': self.flushes,
+                'last_flush_ms': round(self.last_flush_ms, 3),
+                'avg_flush_ms': round(self._total_flush_ms / self.flushes, 3) if self.flushes else 0.0,
+                'max_flush_ms': round(self.max_flush_ms, 3),
+                'path_cache': path_cache.stats(),
+                'spool': self.spool.stats() if self.spool is not None else None,
+            }
+
+    def _ensure_started(self):
+        # После fork (gunicorn) поток родителя в дочернем процессе не существует
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(maxsize=self.app.config['VISIT_LOG_QUEUE_SIZE'])
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='visit-writer', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        batch_size = self.app.config['VISIT_LOG_BATCH_SIZE']
+        interval = self.app.config['VISIT_LOG_FLUSH_INTERVAL_MS'] / 1000
+        stopping = False
+        while not stopping:
+            batch = []
+            deadline = time.monotonic() + interval
+            while len(batch) < batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            if stopping:
+                # Дописываем все, что осталось в очереди
+                while True:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is not _STOP:
+                        batch.append(item)
+            if batch:
+                self._write(batch)
+            self._run_periodic(final=stopping)
+
+    def _run_periodic(self, final):
+        for func in self.periodic:
+            with self.app.app_context():
+                try:
+                    func(final)
+                except Exception:
+                    self.app.logger.exception('Ошибка периодической задачи журнала посещений')
+
+    def _write(self, records):
+        started = time.perf_counter()
+        with self.app.app_context():
+            try:
+                store_visits(records)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                # Новые пути могли откатиться вместе с пакетом
+                path_cache.clear()
+                self.app.logger.exception('Не удалось записать журнал посещений')
+                with self._lock:
+                    self.failed += len(records)
+                return
+        elapsed = (time.perf_counter() - started) * 1000
+        with self._lock:
+            self.written += len(records)
+            self.flushes += 1
+            self.last_flush_ms = elapsed
+            self.max_flush_ms = max(self.max_flush_ms, elapsed)
+            self._total_flush_ms += elapsed
+        for listener in self.flush_listeners:
+            listener(elapsed)
+
+
+visit_writer = VisitWriter()
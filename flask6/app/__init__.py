@@ -3,6 +3,10 @@ from flask_migrate import Migrate
 from sqlalchemy.exc import SQLAlchemyError
 
 from app.models import db
+from app.passwords import password_hasher, calibrate_password_hash_command
+from app.login_limiter import login_limiter
+from app.course_search import rebuild_course_search_command
+from app.category_tree import rebuild_category_tree_command
 from app.auth import bp as auth_bp, init_login_manager
 from app.courses import bp as courses_bp
 from app.routes import bp as main_bp
@@ -23,10 +27,15 @@ def create_app(test_config=None):
     migrate = Migrate(app, db)
 
     init_login_manager(app)
+    password_hasher.init_app(app)
+    login_limiter.init_app(app)
 
     app.register_blueprint(auth_bp)
     app.register_blueprint(courses_bp)
     app.register_blueprint(main_bp)
     app.errorhandler(SQLAlchemyError)(handle_sqlalchemy_error)
+    app.cli.add_command(calibrate_password_hash_command)
+    app.cli.add_command(rebuild_course_search_command)
+    app.cli.add_command(rebuild_category_tree_command)
 
     return app
\ No newline at end of file
@@ -3,6 +3,7 @@ from flask_login import LoginManager, login_user, logout_user, login_required
 
 from app.models import db
 from app.repositories import UserRepository
+from app.login_limiter import login_limiter
 
 user_repository = UserRepository(db)
 
@@ -25,12 +26,21 @@ def login():
         login = request.form.get('login')
         password = request.form.get('password')
         if login and password:
+            # Лимит проверяется до хеширования пароля: перебор не нагружает процессор
+            retry_after = login_limiter.retry_after(login)
+            if retry_after:
+                flash(f'Слишком много неудачных попыток входа. Повторите через {retry_after} с.', 'danger')
+                return render_template('auth/login.html'), 429, {'Retry-After': str(retry_after)}
             user = user_repository.get_user_by_login(login)
             if user and user.check_password(password):
+                login_limiter.success(login)
                 login_user(user)
+                # check_password мог пересчитать хеш с устаревшими параметрами
+                db.session.commit()
                 flash('Вы успешно аутентифицированы.', 'success')
                 next = request.args.get('next')
                 return redirect(next or url_for('main.index'))
+            login_limiter.failure(login)
         flash('Введены неверные логин и/или пароль.', 'danger')
     return render_template('auth/login.html')
 
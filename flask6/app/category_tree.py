@@ -0,0 +1,139 @@
+import click
+import sqlalchemy as sa
+from flask.cli import with_appcontext
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app.models import Category, CategoryClosure, Course, db
+from app.repositories.category_repository import CACHE_NAME, COUNTS_CACHE_NAME, mark_categories_changed
+
+closure = CategoryClosure.__table__
+categories = Category.__table__
+
+
+def subtree_ids(category_ids):
+    """Подзапрос: id категорий category_ids и всех их подкатегорий (один проход по индексу замыкания)."""
+    return sa.select(closure.c.descendant_id).where(closure.c.ancestor_id.in_(category_ids))
+
+
+def _add_courses(session, category_id, delta, strict=False):
+    """Прибавляет delta к счетчикам курсов категории и всех ее предков."""
+    ancestors = sa.select(closure.c.ancestor_id).where(closure.c.descendant_id == category_id)
+    if strict:
+        ancestors = ancestors.where(closure.c.depth > 0)
+    session.execute(sa.update(categories).where(categories.c.id.in_(ancestors))
+                    .values(course_count=categories.c.course_count + delta))
+
+
+def _link(session, category_id, parent_id):
+    """Строки замыкания новой категории: она сама и все предки ее родителя."""
+    session.execute(sa.insert(closure).values(ancestor_id=category_id, descendant_id=category_id, depth=0))
+    if parent_id is not None:
+        session.execute(sa.insert(closure).from_select(
+            ['ancestor_id', 'descendant_id', 'depth'],
+            sa.select(closure.c.ancestor_id, sa.literal(category_id), closure.c.depth + 1)
+            .where(closure.c.descendant_id == parent_id)))
+
+
+def _move(session, category_id, parent_id):
+    """Переносит поддерево category_id под parent_id вместе со счетчиками курсов."""
+    subtree = list(session.scalars(sa.select(closure.c.descendant_id).where(closure.c.ancestor_id == category_id)))
+    if parent_id in subtree:
+        raise ValueError('Категорию нельзя вложить в ее же подкатегорию')
+    count = session.scalar(sa.select(categories.c.course_count).where(categories.c.id == category_id)) or 0
+    _add_courses(session, category_id, -count, strict=True)
+    session.execute(sa.delete(closure).where(closure.c.descendant_id.in_(subtree),
+                                             closure.c.ancestor_id.not_in(subtree)))
+    if parent_id is not None:
+        above, below = closure.alias('above'), closure.alias('below')
+        session.execute(sa.insert(closure).from_select(
+            ['ancestor_id', 'descendant_id', 'depth'],
+            # Все предки нового родителя на все узлы поддерева
+            sa.select(above.c.ancestor_id, below.c.descendant_id, above.c.depth + below.c.depth + 1)
+            .select_from(above.join(below, below.c.ancestor_id == category_id))
+            .where(above.c.descendant_id == parent_id)))
+        _add_courses(session, category_id, count, strict=True)
+
+
+def _unlink(session, category):
+    _add_courses(session, category.id, -(category.course_count or 0), strict=True)
+    session.execute(sa.delete(closure).where(sa.or_(closure.c.ancestor_id == category.id,
+                                                    closure.c.descendant_id == category.id)))
+
+
+def _changed(obj, key):
+    """(старое, новое) значение атрибута, если он изменился в этом flush."""
+    history = sa.inspect(obj).attrs[key].history
+    if not history.deleted:
+        return None
+    return history.deleted[0], getattr(obj, key)
+
+
+def _sorted_by_parent(new_categories):
+    # Родитель раньше детей: строки замыкания детей строятся по строкам родителя
+    pending = {category.id: category for category in new_categories}
+    ordered = []
+    while pending:
+        ready = [category for category in pending.values() if category.parent_id not in pending]
+        for category in ready or list(pending.values()):
+            ordered.append(pending.pop(category.id))
+    return ordered
+
+
+@event.listens_for(Session, 'after_flush')
+def _maintain_closure(session, flush_context):
+    # Изменения категорий поднимают версию дерева сами (category_repository), здесь - только счетчики курсов
+    new_categories = [obj for obj in session.new if isinstance(obj, Category)]
+    changed = False
+    for category in _sorted_by_parent(new_categories):
+        _link(session, category.id, category.parent_id)
+    for obj in session.dirty:
+        if isinstance(obj, Category) and (move := _changed(obj, 'parent_id')):
+            _move(session, obj.id, move[1])
+        elif isinstance(obj, Course) and (move := _changed(obj, 'category_id')):
+            if move[0] is not None:
+                _add_courses(session, move[0], -1)
+            if move[1] is not None:
+                _add_courses(session, move[1], 1)
+            changed = True
+    for obj in session.new:
+        if isinstance(obj, Course) and obj.category_id is not None:
+            _add_courses(session, obj.category_id, 1)
+            changed = True
+    for obj in session.deleted:
+        if isinstance(obj, Course) and obj.category_id is not None:
+            _add_courses(session, obj.category_id, -1)
+            changed = True
+        elif isinstance(obj, Category):
+            _unlink(session, obj)
+    if changed:
+        # Счетчики показываются из кэша категорий: другие воркеры перечитают их без перестройки дерева
+        mark_categories_changed(session, COUNTS_CACHE_NAME)
+
+
+def rebuild():
+    """Строит замыкание и счетчики заново по categories.parent_id и courses (после загрузки в обход ORM)."""
+    tree = sa.select(categories.c.id.label('ancestor_id'), categories.c.id.label('descendant_id'),
+                     sa.literal(0).label('depth')).cte('tree', recursive=True)
+    tree = tree.union_all(
+        sa.select(tree.c.ancestor_id, categories.c.id, tree.c.depth + 1)
+        .join(categories, categories.c.parent_id == tree.c.descendant_id)
+        # Защита от циклов в parent_id
+        .where(tree.c.depth < 100))
+    courses = Course.__table__
+    db.session.execute(sa.delete(closure))
+    db.session.execute(sa.insert(closure).from_select(['ancestor_id', 'descendant_id', 'depth'], sa.select(tree)))
+    db.session.execute(sa.update(categories).values(course_count=sa.select(sa.func.count())
+        .select_from(courses).join(closure, closure.c.descendant_id == courses.c.category_id)
+        .where(closure.c.ancestor_id == categories.c.id).scalar_subquery()))
+    mark_categories_changed(db.session, CACHE_NAME)
+    mark_categories_changed(db.session, COUNTS_CACHE_NAME)
+    db.session.commit()
+
+
+@click.command('rebuild-category-tree')
+@with_appcontext
+def rebuild_category_tree_command():
+    """Перестраивает замыкание дерева категорий и счетчики курсов."""
+    rebuild()
+    click.echo('Замыкание категорий и счетчики курсов перестроены')
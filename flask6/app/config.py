@@ -12,3 +12,24 @@ UPLOAD_FOLDER = os.path.join(
     'media', 
     'images'
 )
+
+# Хеширование паролей в пуле потоков; параметры подбирает flask calibrate-password-hash
+PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+PASSWORD_HASH_POOL = 'thread'
+PASSWORD_HASH_WORKERS = 4
+PASSWORD_HASH_QUEUE = 32
+
+# Лимит неудачных входов: (попыток, секунд); LOGIN_LIMIT_STORAGE - файл SQLite, общий для воркеров
+LOGIN_LIMIT_PER_LOGIN = (5, 300)
+LOGIN_LIMIT_PER_IP = (50, 300)
+LOGIN_LIMIT_STORAGE = os.environ.get('LOGIN_LIMIT_STORAGE')
+
+# Сколько лучших совпадений полнотекстового поиска курсов ранжируется и показывается
+COURSE_SEARCH_CANDIDATES = 1000
+
+# Как часто воркер сверяет версию кэша категорий с базой, секунд
+CATEGORY_CACHE_CHECK_INTERVAL = 5
+
+# Фасеты поиска курсов: сколько запросов держать в кэше процесса и сколько секунд
+COURSE_FACET_CACHE_SIZE = 1000
+COURSE_FACET_CACHE_TTL = 60
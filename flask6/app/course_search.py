@@ -0,0 +1,132 @@
+import re
+
+import click
+import sqlalchemy as sa
+from flask import current_app, g
+from flask.cli import with_appcontext
+from markupsafe import Markup, escape
+from sqlalchemy import DDL, event
+
+from app import category_tree
+from app.models import Course, db
+
+FTS_TABLE = 'courses_fts'
+# Вес столбцов в bm25: совпадение в названии важнее, чем в описании
+FTS_WEIGHTS = (10.0, 3.0, 1.0)
+
+# Границы совпадений от highlight/snippet; заменяются на <mark> после экранирования текста
+_MARK_START = '\x02'
+_MARK_END = '\x03'
+
+# Индекс без копии текста (content=courses); unicode61 сворачивает регистр и кириллицы, ё ищется как е
+FTS_DDL = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(name, short_desc, full_desc, "
+    f"content='courses', content_rowid='id', tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON courses BEGIN "
+    f"INSERT INTO {FTS_TABLE} (rowid, name, short_desc, full_desc) "
+    f"VALUES (new.id, new.name, new.short_desc, new.full_desc); END",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON courses BEGIN "
+    f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rowid, name, short_desc, full_desc) "
+    f"VALUES ('delete', old.id, old.name, old.short_desc, old.full_desc); END",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF name, short_desc, full_desc ON courses BEGIN "
+    f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rowid, name, short_desc, full_desc) "
+    f"VALUES ('delete', old.id, old.name, old.short_desc, old.full_desc); "
+    f"INSERT INTO {FTS_TABLE} (rowid, name, short_desc, full_desc) "
+    f"VALUES (new.id, new.name, new.short_desc, new.full_desc); END",
+)
+
+fts = sa.table(FTS_TABLE, sa.column('rowid', sa.Integer))
+_fts_match = sa.literal_column(FTS_TABLE)
+
+
+def _fts5_available(connection):
+    options = {row[0] for row in connection.exec_driver_sql('PRAGMA compile_options')}
+    return 'ENABLE_FTS5' in options
+
+
+for statement in FTS_DDL:
+    event.listen(Course.__table__, 'after_create', DDL(statement).execute_if(
+        dialect='sqlite', callable_=lambda ddl, target, bind, **kw: _fts5_available(bind)))
+event.listen(Course.__table__, 'before_drop', DDL(f'DROP TABLE IF EXISTS {FTS_TABLE}').execute_if(dialect='sqlite'))
+
+
+def fts_enabled():
+    """Есть ли таблица FTS5 (SQLite, собранный с FTS5, и выполнена миграция); проверяется раз за запрос."""
+    if 'course_fts_enabled' not in g:
+        g.course_fts_enabled = db.session.get_bind().dialect.name == 'sqlite' and db.session.execute(
+            sa.text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+            {'name': FTS_TABLE}).first() is not None
+    return g.course_fts_enabled
+
+
+def match_expression(text):
+    """Запрос FTS5: каждое слово - префикс, все слова обязательны. None, если слов нет."""
+    tokens = re.findall(r'\w+', text or '')
+    if not tokens:
+        return None
+    return ' '.join(f'"{token}"*' for token in tokens)
+
+
+def candidates_query(text, category_ids=None):
+    """Подзапрос (id, score) лучших совпадений; None, если в text нет слов.
+
+    Берутся COURSE_SEARCH_CANDIDATES лучших по bm25 совпадений: bm25
+    считается для каждого совпадения, но сортировка страниц, подсчет и
+    фасеты дальше идут только по ним. Если совпадений больше, выдача
+    обрезается - см. search_limit.
+    """
+    expression = match_expression(text)
+    if expression is None:
+        return None
+    score = sa.func.bm25(_fts_match, *FTS_WEIGHTS)
+    candidates = sa.select(fts.c.rowid.label('id'), score.label('score')) \
+        .select_from(fts).join(Course, Course.id == fts.c.rowid) \
+        .where(_fts_match.op('MATCH')(expression))
+    if category_ids:
+        candidates = candidates.where(Course.category_id.in_(category_tree.subtree_ids(category_ids)))
+    return candidates.order_by(score, fts.c.rowid) \
+        .limit(current_app.config.get('COURSE_SEARCH_CANDIDATES', 1000)).subquery()
+
+
+def search_limit():
+    return current_app.config.get('COURSE_SEARCH_CANDIDATES', 1000)
+
+
+def search_query(text, category_ids=None):
+    """select(Course) по словам text в названии и описаниях, лучшие совпадения (bm25) первыми."""
+    candidates = candidates_query(text, category_ids)
+    if candidates is None:
+        return None
+    return sa.select(Course).join(candidates, candidates.c.id == Course.id).order_by(candidates.c.score, Course.id)
+
+
+def _marked(value):
+    return Markup(str(escape(value)).replace(_MARK_START, '<mark>').replace(_MARK_END, '</mark>'))
+
+
+def highlights(text, course_ids):
+    """Название и фрагмент описания с выделенными совпадениями для курсов страницы: id -> (название, фрагмент)."""
+    expression = match_expression(text)
+    if expression is None or not course_ids:
+        return {}
+    rows = db.session.execute(sa.text(
+        f"SELECT rowid, highlight({FTS_TABLE}, 0, :start, :end), "
+        f"snippet({FTS_TABLE}, -1, :start, :end, '…', 16) "
+        f"FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :match AND rowid IN :ids"
+    ).bindparams(sa.bindparam('ids', expanding=True)),
+        {'start': _MARK_START, 'end': _MARK_END, 'match': expression, 'ids': list(course_ids)})
+    return {course_id: (_marked(name), _marked(snippet)) for course_id, name, snippet in rows}
+
+
+def rebuild_index():
+    """Перестраивает индекс по таблице courses (после загрузки в обход триггеров)."""
+    db.session.execute(sa.text(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('rebuild')"))
+    db.session.commit()
+
+
+@click.command('rebuild-course-search')
+@with_appcontext
+def rebuild_course_search_command():
+    """Перестраивает полнотекстовый индекс курсов."""
+    rebuild_index()
+    click.echo(f'Индекс {FTS_TABLE} перестроен')
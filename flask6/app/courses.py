@@ -33,9 +33,15 @@ def index():
     pagination = course_repository.get_pagination_info(**search_params())
     courses = course_repository.get_all_courses(pagination=pagination)
     categories = category_repository.get_all_categories()
+    highlights = course_repository.get_highlights(search_params()['name'], courses)
+    facets = course_repository.get_facets(search_params()['name'], categories.version)
+    truncated = course_repository.get_truncated_limit(search_params()['name'], pagination)
     return render_template('courses/index.html',
                            courses=courses,
+                           highlights=highlights,
+                           truncated=truncated,
                            categories=categories,
+                           facets=facets,
                            pagination=pagination,
                            search_params=search_params())
 
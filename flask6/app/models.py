@@ -2,7 +2,6 @@ import os
 from typing import Optional
 from datetime import datetime
 import sqlalchemy as sa
-from werkzeug.security import check_password_hash, generate_password_hash
 from flask_login import UserMixin
 from flask import url_for
 from flask_sqlalchemy import SQLAlchemy
@@ -10,6 +9,8 @@ from sqlalchemy.orm import DeclarativeBase
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from sqlalchemy import String, ForeignKey, Text, Integer, MetaData
 
+from app.passwords import password_hasher
+
 
 class Base(DeclarativeBase):
   metadata = MetaData(naming_convention={
@@ -28,10 +29,34 @@ class Category(Base):
     id = mapped_column(Integer, primary_key=True)
     name: Mapped[str] = mapped_column(String(100))
     parent_id: Mapped[Optional[int]] = mapped_column(ForeignKey("categories.id"))
+    # Курсов в категории вместе с подкатегориями; ведется в app/category_tree.py
+    course_count: Mapped[int] = mapped_column(default=0, server_default='0')
 
     def __repr__(self):
         return '<Category %r>' % self.name
 
+class CategoryClosure(Base):
+    """Пары предок - потомок дерева категорий (включая саму категорию с depth 0)."""
+    __tablename__ = 'category_closure'
+
+    ancestor_id: Mapped[int] = mapped_column(ForeignKey("categories.id", ondelete='CASCADE'), primary_key=True)
+    descendant_id: Mapped[int] = mapped_column(ForeignKey("categories.id", ondelete='CASCADE'), primary_key=True,
+                                               index=True)
+    depth: Mapped[int]
+
+    def __repr__(self):
+        return '<CategoryClosure %r-%r>' % (self.ancestor_id, self.descendant_id)
+
+class CacheVersion(Base):
+    """Версия закэшированных в воркерах данных; меняется при каждой записи в них."""
+    __tablename__ = 'cache_versions'
+
+    name: Mapped[str] = mapped_column(String(50), primary_key=True)
+    version: Mapped[int] = mapped_column(default=1)
+
+    def __repr__(self):
+        return '<CacheVersion %r %r>' % (self.name, self.version)
+
 class User(Base, UserMixin):
     __tablename__ = 'users'
 
@@ -44,10 +69,16 @@ class User(Base, UserMixin):
     created_at: Mapped[datetime] = mapped_column(default=datetime.now)
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = password_hasher.hash(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        if not password_hasher.verify(self.password_hash, password):
+            return False
+        # Хеш со старыми параметрами пересчитывается при успешной проверке, сохраняет вызывающий код
+        if password_hasher.needs_rehash(self.password_hash):
+            self.set_password(password)
+            password_hasher.rehashed += 1
+        return True
 
     @property
     def full_name(self):
@@ -1,8 +1,164 @@
-from app.models import Category
+import threading
+import time
+from collections import namedtuple
+from types import MappingProxyType
+
+from flask import current_app
+from sqlalchemy import event, insert, select, update
+from sqlalchemy.orm import Session
+
+from app.models import CacheVersion, Category
+
+CACHE_NAME = 'categories'
+# Счетчики курсов меняются с каждым курсом, поэтому у них своя версия: дерево при этом не перестраивается
+COUNTS_CACHE_NAME = 'category_counts'
+
+# Категория в кэше: children - кортеж дочерних CategoryRecord
+CategoryRecord = namedtuple('CategoryRecord', 'id name parent_id course_count children')
+
+
+class CategoryTree:
+    """Неизменяемое дерево категорий одной версии.
+
+    При итерации - все категории по порядку id, как раньше отдавал запрос.
+    """
+
+    __slots__ = ('version', 'roots', 'by_id', '_flat')
+
+    def __init__(self, version, rows):
+        children_ids = {}
+        for category_id, _, parent_id, _ in rows:
+            children_ids.setdefault(parent_id, []).append(category_id)
+        names = {category_id: (name, parent_id, course_count) for category_id, name, parent_id, course_count in rows}
+        records = {}
+
+        def build(category_id, seen=()):
+            if category_id not in records:
+                name, parent_id, course_count = names[category_id]
+                children = tuple(build(child_id, seen + (category_id,))
+                                 for child_id in children_ids.get(category_id, ()) if child_id not in seen)
+                records[category_id] = CategoryRecord(category_id, name, parent_id, course_count, children)
+            return records[category_id]
+
+        # Корни - категории без родителя или с родителем, которого нет в таблице
+        self.roots = tuple(build(category_id) for category_id, _, parent_id, _ in rows if parent_id not in names)
+        for category_id, _, _, _ in rows:
+            build(category_id)
+        self.version = version
+        self.by_id = MappingProxyType(records)
+        self._flat = tuple(records[category_id] for category_id, _, _, _ in rows)
+
+    def __iter__(self):
+        return iter(self._flat)
+
+    def __len__(self):
+        return len(self._flat)
+
+    def get(self, category_id):
+        return self.by_id.get(category_id)
+
+    def with_counts(self, counts):
+        """То же дерево с новыми счетчиками курсов (id -> число), без чтения категорий."""
+        return CategoryTree(self.version, [(record.id, record.name, record.parent_id, counts.get(record.id, 0))
+                                           for record in self._flat])
+
+    def walk(self):
+        """Категории в порядке дерева: (глубина, категория), родитель перед подкатегориями."""
+        stack = [(0, record) for record in reversed(self.roots)]
+        while stack:
+            depth, record = stack.pop()
+            yield depth, record
+            stack.extend((depth + 1, child) for child in reversed(record.children))
+
+
+class CategoryCache:
+    """Дерево категорий на весь процесс.
+
+    Версии в cache_versions проверяются не чаще раза в
+    CATEGORY_CACHE_CHECK_INTERVAL секунд. Дерево перестраивается только когда
+    кто-то (в любом воркере) записал категории; после записи курсов
+    перечитываются одни счетчики.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tree = None
+        self._counts_version = None
+        self._checked_at = 0
+        self.builds = 0
+        self.count_loads = 0
+
+    def get(self, session):
+        tree = self._tree
+        now = time.monotonic()
+        if tree is not None and now - self._checked_at < current_app.config.get('CATEGORY_CACHE_CHECK_INTERVAL', 5):
+            return tree
+        with self._lock:
+            versions = dict(session.execute(select(CacheVersion.name, CacheVersion.version)
+                                            .where(CacheVersion.name.in_((CACHE_NAME, COUNTS_CACHE_NAME)))).all())
+            version, counts_version = versions.get(CACHE_NAME, 0), versions.get(COUNTS_CACHE_NAME, 0)
+            if self._tree is None or self._tree.version != version:
+                rows = session.execute(select(Category.id, Category.name, Category.parent_id, Category.course_count)
+                                       .order_by(Category.id)).all()
+                self._tree = CategoryTree(version, rows)
+                self.builds += 1
+            elif self._counts_version != counts_version:
+                counts = dict(session.execute(select(Category.id, Category.course_count)).all())
+                self._tree = self._tree.with_counts(counts)
+                self.count_loads += 1
+            self._counts_version = counts_version
+            self._checked_at = now
+            return self._tree
+
+    def invalidate(self):
+        self._tree = None
+
+    def invalidate_counts(self):
+        # Следующий get сразу сверит версии и перечитает счетчики
+        self._checked_at = float('-inf')
+
+
+category_cache = CategoryCache()
+
+
+def mark_categories_changed(session, name=CACHE_NAME):
+    """Поднимает версию name (CACHE_NAME или COUNTS_CACHE_NAME) один раз за транзакцию.
+
+    Новая версия видна всем воркерам после commit, свой кэш сбрасывается сразу после него.
+    """
+    changed = session.info.setdefault('category_caches_changed', set())
+    if name in changed:
+        return
+    bumped = session.execute(update(CacheVersion).where(CacheVersion.name == name)
+                             .values(version=CacheVersion.version + 1))
+    if bumped.rowcount == 0:
+        session.execute(insert(CacheVersion).values(name=name, version=1))
+    changed.add(name)
+
+
+@event.listens_for(Session, 'after_flush')
+def _bump_category_version(session, flush_context):
+    if any(isinstance(obj, Category) for obj in (*session.new, *session.dirty, *session.deleted)):
+        mark_categories_changed(session)
+
+
+@event.listens_for(Session, 'after_commit')
+def _drop_category_cache(session):
+    changed = session.info.pop('category_caches_changed', ())
+    if CACHE_NAME in changed:
+        category_cache.invalidate()
+    elif COUNTS_CACHE_NAME in changed:
+        category_cache.invalidate_counts()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_category_changes(session):
+    session.info.pop('category_caches_changed', None)
+
 
 class CategoryRepository:
     def __init__(self, db):
         self.db = db
 
     def get_all_categories(self):
-        return self.db.session.execute(self.db.select(Category)).scalars()
\ No newline at end of file
+        return category_cache.get(self.db.session)
@@ -1,17 +1,84 @@
-from app.models import Course
+import collections
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import func, select
+from sqlalchemy.orm import lazyload, load_only, selectinload
+
+from app.models import Course, User
+from app import category_tree, course_search
+
+# Столбцы карточки курса в каталоге; full_desc и остальное не загружаются
+LISTING_OPTIONS = (
+    load_only(Course.id, Course.name, Course.short_desc, Course.rating_sum, Course.rating_num,
+              Course.author_id, Course.background_image_id),
+    # Авторы страницы одним запросом (IN), а не по запросу на курс
+    selectinload(Course.author).load_only(User.id, User.first_name, User.last_name, User.middle_name),
+    # Категория в карточке не показывается, соединение с categories не нужно
+    lazyload(Course.category),
+)
+
+
+class FacetCache:
+    """Фасеты поиска по нормализованному запросу: LRU на процесс.
+
+    В ключе версия дерева категорий: после изменения категорий счетчики
+    считаются заново. Запись курсов версию дерева не меняет, поэтому новые
+    курсы попадают в фасеты не позже чем через COURSE_FACET_CACHE_TTL секунд.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = collections.OrderedDict()  # (запрос, версия) -> (счетчики, когда посчитаны)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, compute):
+        config = current_app.config
+        now = time.monotonic()
+        with self._lock:
+            cached = self._data.get(key)
+            if cached is not None and now - cached[1] < config.get('COURSE_FACET_CACHE_TTL', 60):
+                self._data.move_to_end(key)
+                self.hits += 1
+                return cached[0]
+        facets = compute()
+        with self._lock:
+            self.misses += 1
+            self._data[key] = (facets, now)
+            self._data.move_to_end(key)
+            while len(self._data) > config.get('COURSE_FACET_CACHE_SIZE', 1000):
+                self._data.popitem(last=False)
+        return facets
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+facet_cache = FacetCache()
+
 
 class CourseRepository:
     def __init__(self, db):
         self.db = db
 
     def _all_query(self, name, category_ids):
-        query = self.db.select(Course)
+        if name and course_search.fts_enabled():
+            # Полнотекстовый индекс по названию и описаниям вместо сканирования LIKE '%...%'
+            query = course_search.search_query(name, category_ids)
+            if query is not None:
+                return query.options(*LISTING_OPTIONS)
+
+        query = self.db.select(Course).options(*LISTING_OPTIONS)
 
         if name:
             query = query.filter(Course.name.ilike(f'%{name}%'))
 
         if category_ids:
-            query = query.filter(Course.category_id.in_(category_ids))
+            # Выбранные категории вместе со всеми подкатегориями
+            query = query.filter(Course.category_id.in_(category_tree.subtree_ids(category_ids)))
 
         return query
 
@@ -25,6 +92,49 @@ class CourseRepository:
         
         return self.db.session.execute(self._all_query(name, category_ids)).scalars()
 
+    def _matches(self, name):
+        """Подзапрос id курсов, подходящих под name, и ключ для кэша; без учета категорий."""
+        if course_search.fts_enabled():
+            candidates = course_search.candidates_query(name)
+            if candidates is not None:
+                # unicode61 сворачивает регистр сам, поэтому запросы в разном регистре дают одно и то же
+                return select(candidates.c.id), ('fts', course_search.match_expression(name.casefold()))
+        # LIKE в SQLite не сворачивает регистр кириллицы: ключ - ровно та строка, что в запросе (как в _all_query)
+        return select(Course.id).where(Course.name.ilike(f'%{name}%')), ('like', name)
+
+    def get_facets(self, name, version):
+        """Сколько курсов по запросу name в каждой категории вместе с подкатегориями: id -> число.
+
+        Без запроса - None: тогда подходят все курсы и показывается Category.course_count.
+        """
+        if not name or not name.strip():
+            return None
+        matches, key = self._matches(name)
+        closure = category_tree.closure
+
+        def compute():
+            # Один сгруппированный запрос по найденным курсам и замыканию категорий
+            rows = self.db.session.execute(
+                select(closure.c.ancestor_id, func.count())
+                .select_from(Course).join(closure, closure.c.descendant_id == Course.category_id)
+                .where(Course.id.in_(matches))
+                .group_by(closure.c.ancestor_id))
+            return dict(rows.all())
+
+        return facet_cache.get((key, version), compute)
+
+    def get_truncated_limit(self, name, pagination):
+        """Сколько лучших совпадений показано, если полнотекстовый поиск обрезал выдачу, иначе None."""
+        if not name or not course_search.fts_enabled() or course_search.match_expression(name) is None:
+            return None
+        limit = course_search.search_limit()
+        return limit if pagination.total >= limit else None
+
+    def get_highlights(self, name, courses):
+        if not name or not course_search.fts_enabled():
+            return {}
+        return course_search.highlights(name, [course.id for course in courses])
+
     def get_course_by_id(self, course_id):
         return self.db.session.get(Course, course_id)
     
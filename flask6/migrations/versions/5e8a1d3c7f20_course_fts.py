@@ -0,0 +1,53 @@
+"""course full-text search
+
+Revision ID: 5e8a1d3c7f20
+Revises: 4b54af39abdd
+Create Date: 2026-10-18 21:05:33.418265
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e8a1d3c7f20'
+down_revision = '4b54af39abdd'
+branch_labels = None
+depends_on = None
+
+TRIGGERS = ('courses_fts_ai', 'courses_fts_ad', 'courses_fts_au')
+
+
+def fts5_available(bind):
+    if bind.dialect.name != 'sqlite':
+        return False
+    return 'ENABLE_FTS5' in {row[0] for row in bind.exec_driver_sql('PRAGMA compile_options')}
+
+
+def upgrade():
+    if not fts5_available(op.get_bind()):
+        return  # Поиск по курсам остается на LIKE
+
+    op.execute("CREATE VIRTUAL TABLE courses_fts USING fts5(name, short_desc, full_desc, "
+               "content='courses', content_rowid='id', tokenize='unicode61 remove_diacritics 2', prefix='2 3')")
+    op.execute("CREATE TRIGGER courses_fts_ai AFTER INSERT ON courses BEGIN "
+               "INSERT INTO courses_fts (rowid, name, short_desc, full_desc) "
+               "VALUES (new.id, new.name, new.short_desc, new.full_desc); END")
+    op.execute("CREATE TRIGGER courses_fts_ad AFTER DELETE ON courses BEGIN "
+               "INSERT INTO courses_fts (courses_fts, rowid, name, short_desc, full_desc) "
+               "VALUES ('delete', old.id, old.name, old.short_desc, old.full_desc); END")
+    op.execute("CREATE TRIGGER courses_fts_au AFTER UPDATE OF name, short_desc, full_desc ON courses BEGIN "
+               "INSERT INTO courses_fts (courses_fts, rowid, name, short_desc, full_desc) "
+               "VALUES ('delete', old.id, old.name, old.short_desc, old.full_desc); "
+               "INSERT INTO courses_fts (rowid, name, short_desc, full_desc) "
+               "VALUES (new.id, new.name, new.short_desc, new.full_desc); END")
+    # Индекс по уже существующим курсам
+    op.execute("INSERT INTO courses_fts (courses_fts) VALUES ('rebuild')")
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    for trigger in TRIGGERS:
+        op.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+    op.execute('DROP TABLE IF EXISTS courses_fts')
@@ -1,4 +1,6 @@
 import pytest
+from contextlib import contextmanager
+from sqlalchemy import event
 from flask import Flask, url_for
 from flask_sqlalchemy import SQLAlchemy
 from app import create_app
@@ -65,4 +67,29 @@ def login(client, username, password, app):
 
 def logout(client, app):
     with app.test_request_context():
-        return client.get(url_for('auth.logout'), follow_redirects=True)
\ No newline at end of file
+        return client.get(url_for('auth.logout'), follow_redirects=True)
+
+
+@pytest.fixture
+def assert_max_queries(app):
+    """Контекстный менеджер: блок выполняет не больше limit SQL-запросов.
+
+    Возвращает список выполненных запросов, чтобы тест мог проверить и их состав.
+    """
+    @contextmanager
+    def check(limit):
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        with app.app_context():
+            engine = db.engine
+        event.listen(engine, 'before_cursor_execute', record)
+        try:
+            yield statements
+        finally:
+            event.remove(engine, 'before_cursor_execute', record)
+        assert len(statements) <= limit, f'{len(statements)} запросов вместо не больше {limit}:\n' + '\n'.join(statements)
+
+    return check
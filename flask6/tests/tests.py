@@ -50,4 +50,207 @@ def test_show_all_reviews(client, db_session, app):
         assert response.status_code == 200
         assert b'Test review on review page.' in response.data
 
-        logout(client, app)
\ No newline at end of file
+        logout(client, app)
+
+
+def test_course_full_text_search(client, db_session, app):
+    with app.test_request_context():
+        category = Category(name='Программирование')
+        db_session.add(category)
+        db_session.flush()
+        course = Course(name='Основы Python', short_desc='Первые шаги', author_id=1, category_id=category.id,
+                        full_desc='Учимся писать ПРОГРАММЫ на <b>Python</b> с нуля.', background_image_id='test_image_id')
+        db_session.add(course)
+        db_session.commit()
+
+        # Префикс слова из описания, регистр не важен
+        response = client.get(url_for('courses.index', name='программ'))
+        assert response.status_code == 200
+        html = response.get_data(as_text=True)
+        assert 'Основы Python' in html
+        assert '<mark>ПРОГРАММЫ</mark>' in html
+        assert '<b>Python</b>' not in html  # Текст курса экранирован, размечены только совпадения
+
+        response = client.get(url_for('courses.index', name='программ', category_ids=[category.id + 1]))
+        assert 'Основы Python' not in response.get_data(as_text=True)
+
+
+def test_course_listing_queries_are_bounded(client, db_session, app, assert_max_queries):
+    with app.test_request_context():
+        for index in range(5):
+            author = User(first_name='Автор', last_name=f'N{index}', login=f'author{index}', password_hash='x')
+            db_session.add(author)
+            db_session.flush()
+            db_session.add(Course(name=f'Курс {index}', short_desc='Кратко', full_desc='Подробно', author_id=author.id,
+                                  category_id=1, background_image_id='test_image_id'))
+        db_session.commit()
+
+        # Число курсов, страница курсов, авторы страницы одним IN, версия кэша категорий и
+        # само дерево (новые курсы изменили счетчики в фильтре)
+        with assert_max_queries(7) as statements:
+            response = client.get(url_for('courses.index'))
+        assert response.status_code == 200
+        assert 'Автор' in response.get_data(as_text=True)
+        page = next(statement for statement in statements if 'LIMIT' in statement and 'FROM courses' in statement)
+        assert 'full_desc' not in page and 'categories' not in page
+
+
+def test_categories_cached_until_version_changes(client, db_session, app, assert_max_queries):
+    from app.repositories.category_repository import CategoryRepository, category_cache
+    from app.models import CacheVersion
+
+    repository = CategoryRepository(db)
+    with app.test_request_context():
+        repository.get_all_categories()
+        # Пока не прошел интервал проверки, база не читается совсем
+        with assert_max_queries(0):
+            categories = repository.get_all_categories()
+        assert 'Test Category' in [category.name for category in categories]
+
+        # Запись категории в этом процессе видна сразу, версия поднимается один раз за транзакцию
+        version = categories.version
+        parent = categories.get(1)
+        db_session.add(Category(name='Веб-разработка', parent_id=parent.id))
+        db_session.flush()
+        db_session.get(Category, parent.id).name = 'Test Category'
+        db_session.commit()
+        assert db_session.scalar(db.select(CacheVersion.version).where(CacheVersion.name == 'categories')) == version + 1
+        categories = repository.get_all_categories()
+        child = next(category for category in categories if category.name == 'Веб-разработка')
+        assert child in categories.get(1).children
+
+        # Запись из другого воркера - после проверки версии
+        db_session.execute(db.update(Category).where(Category.id == child.id).values(name='Фронтенд'))
+        db_session.execute(db.update(CacheVersion).where(CacheVersion.name == 'categories')
+                           .values(version=CacheVersion.version + 1))
+        db_session.commit()
+        assert 'Фронтенд' not in [category.name for category in repository.get_all_categories()]
+        category_cache._checked_at -= app.config['CATEGORY_CACHE_CHECK_INTERVAL']
+        assert 'Фронтенд' in [category.name for category in repository.get_all_categories()]
+
+
+def test_category_subtree_filter_and_counts(client, db_session, app):
+    from app import category_tree
+    from app.repositories.category_repository import CategoryRepository
+
+    repository = CategoryRepository(db)
+    with app.test_request_context():
+        root = Category(name='Естественные науки')
+        db_session.add(root)
+        db_session.flush()
+        physics = Category(name='Физика', parent_id=root.id)
+        db_session.add(physics)
+        db_session.flush()
+        optics = Category(name='Оптика', parent_id=physics.id)
+        db_session.add(optics)
+        db_session.flush()
+        db_session.add(Course(name='Геометрическая оптика', short_desc='Линзы', full_desc='Линзы и зеркала',
+                              author_id=1, category_id=optics.id, background_image_id='test_image_id'))
+        db_session.commit()
+
+        # Курс подкатегории находится по корневой категории
+        response = client.get(url_for('courses.index', category_ids=[root.id]))
+        assert 'Геометрическая оптика' in response.get_data(as_text=True)
+        counts = {category.name: category.course_count for category in repository.get_all_categories()}
+        assert counts['Естественные науки'] == counts['Физика'] == counts['Оптика'] == 1
+
+        # Перенос поддерева переносит и счетчики
+        other = Category(name='Прикладная физика')
+        db_session.add(other)
+        db_session.flush()
+        db_session.get(Category, physics.id).parent_id = other.id
+        db_session.commit()
+        counts = {category.name: category.course_count for category in repository.get_all_categories()}
+        assert counts['Естественные науки'] == 0 and counts['Прикладная физика'] == 1
+        response = client.get(url_for('courses.index', category_ids=[root.id]))
+        assert 'Геометрическая оптика' not in response.get_data(as_text=True)
+
+        closure = set(db_session.execute(db.select(category_tree.closure)))
+        category_tree.rebuild()
+        assert set(db_session.execute(db.select(category_tree.closure))) == closure
+        assert {category.name: category.course_count for category in repository.get_all_categories()} == counts
+
+
+def test_course_search_facets(client, db_session, app, assert_max_queries):
+    from app.repositories.course_repository import facet_cache
+
+    with app.test_request_context():
+        music = Category(name='Музыка')
+        db_session.add(music)
+        db_session.flush()
+        guitar = Category(name='Гитара', parent_id=music.id)
+        db_session.add(guitar)
+        db_session.flush()
+        for name, category_id in (('Гармония для начинающих', music.id), ('Гармония на гитаре', guitar.id),
+                                  ('Аккорды', guitar.id)):
+            db_session.add(Course(name=name, short_desc='Музыка', full_desc='Музыка', author_id=1,
+                                  category_id=category_id, background_image_id='test_image_id'))
+        db_session.commit()
+
+        # Счетчики по запросу без учета выбранной категории, подкатегории входят в родителя
+        response = client.get(url_for('courses.index', name='гармон', category_ids=[guitar.id]))
+        html = response.get_data(as_text=True)
+        assert 'Музыка (2)' in html and 'Гитара (1)' in html and 'Test Category (0)' in html
+
+        # Тот же запрос в другом регистре считается из кэша
+        hits = facet_cache.hits
+        with assert_max_queries(7) as statements:
+            client.get(url_for('courses.index', name='ГАРМОН'))
+        assert facet_cache.hits == hits + 1
+        assert not any('GROUP BY' in statement for statement in statements)
+
+        # Новый курс меняет только счетчики: дерево категорий и фасеты остаются в кэше до истечения срока
+        from app.repositories.category_repository import category_cache
+        builds, count_loads = category_cache.builds, category_cache.count_loads
+        db_session.add(Course(name='Гармония в джазе', short_desc='Музыка', full_desc='Музыка', author_id=1,
+                              category_id=guitar.id, background_image_id='test_image_id'))
+        db_session.commit()
+        html = client.get(url_for('courses.index')).get_data(as_text=True)
+        assert 'Музыка (4)' in html and 'Гитара (3)' in html
+        assert (category_cache.builds, category_cache.count_loads) == (builds, count_loads + 1)
+        html = client.get(url_for('courses.index', name='гармон')).get_data(as_text=True)
+        assert 'Музыка (2)' in html
+        app.config['COURSE_FACET_CACHE_TTL'] = 0
+        try:
+            html = client.get(url_for('courses.index', name='гармон')).get_data(as_text=True)
+        finally:
+            app.config['COURSE_FACET_CACHE_TTL'] = 60
+        assert 'Музыка (3)' in html and 'Гитара (2)' in html
+
+
+def test_course_search_keeps_best_matches_when_truncated(client, db_session, app):
+    with app.test_request_context():
+        for index in range(3):
+            db_session.add(Course(name=f'Курс {index}', short_desc='Кратко', full_desc='Немного про астрономию',
+                                  author_id=1, category_id=1, background_image_id='test_image_id'))
+        # Совпадение в названии - лучшее, хотя курс добавлен последним
+        db_session.add(Course(name='Астрономия', short_desc='Кратко', full_desc='Звезды', author_id=1,
+                              category_id=1, background_image_id='test_image_id'))
+        db_session.commit()
+
+        app.config['COURSE_SEARCH_CANDIDATES'] = 2
+        try:
+            html = client.get(url_for('courses.index', name='астроном')).get_data(as_text=True)
+        finally:
+            app.config['COURSE_SEARCH_CANDIDATES'] = 1000
+        assert '<mark>Астрономия</mark>' in html
+        assert 'Показаны 2 самых подходящих курсов' in html
+
+
+def test_course_facets_without_fts_key_on_exact_query(client, db_session, app):
+    from flask import g
+    from app.repositories import CourseRepository
+
+    repository = CourseRepository(db)
+    with app.test_request_context():
+        db_session.add(Course(name='Лингвистика', short_desc='Кратко', full_desc='Кратко', author_id=1,
+                              category_id=1, background_image_id='test_image_id'))
+        db_session.commit()
+        # Без FTS5 фасеты считаются по LIKE, который в SQLite различает регистр кириллицы
+        g.course_fts_enabled = False
+        try:
+            assert repository.get_facets('Лингв', 1000).get(1) == 1
+            assert repository.get_facets('лингв', 1000).get(1) is None
+            assert repository.get_facets(' Лингв', 1000).get(1) is None
+        finally:
+            del g.course_fts_enabled